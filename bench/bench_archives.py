@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Times reading the member index of large archives and then listing their
+# subdirectories through an archives.ArchiveCache.
+# Usage: python bench_archives.py [num_members...]
+
+import os
+import sys
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import StringIO
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import archives
+
+
+MEMBERS_PER_DIR = 1000
+
+
+def member_names(num_members):
+    for i in xrange(num_members):
+        yield 'top/dir%d/file%d.txt' % (i / MEMBERS_PER_DIR, i)
+
+
+def make_zip(path, num_members):
+    archive = zipfile.ZipFile(path, 'w', allowZip64=True)
+
+    for name in member_names(num_members):
+        archive.writestr(name, 'x')
+
+    archive.close()
+
+
+def make_tar(path, num_members):
+    archive = tarfile.open(path, 'w:gz')
+
+    for name in member_names(num_members):
+        info = tarfile.TarInfo(name)
+        info.size = 1
+        archive.addfile(info, StringIO.StringIO('x'))
+
+    archive.close()
+
+
+def bench(path, num_members):
+    cache = archives.ArchiveCache()
+
+    start = time.time()
+    archives.list_dir(path, cache)
+    first = time.time() - start
+
+    num_dirs = num_members / MEMBERS_PER_DIR
+    start = time.time()
+
+    for i in xrange(num_dirs):
+        archives.list_dir(os.path.join(path, u'top', u'dir%d' % (i)), cache)
+
+    rest = (time.time() - start) / max(num_dirs, 1)
+    print '%8d members, %-7s  index %7.3f s  subdir listing %7.4f s' \
+          % (num_members, os.path.basename(path)[2:], first, rest)
+
+
+def main():
+    sizes = [10000, 100000]
+
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        for num_members in sizes:
+            zip_path = os.path.join(work_dir, u'a.zip')
+            tar_path = os.path.join(work_dir, u'a.tar.gz')
+            make_zip(zip_path, num_members)
+            make_tar(tar_path, num_members)
+            bench(zip_path, num_members)
+            bench(tar_path, num_members)
+            os.remove(zip_path)
+            os.remove(tar_path)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Compares copying a tree of many small files (and a few large ones) with
+# file_ops.Job against shutil.copytree, with different numbers of workers,
+# once from the directory itself and once from its flat view.
+# Usage: python bench_copying.py [num_files [workers...]]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import data
+import file_ops
+
+
+FILES_PER_DIR = 100
+NUM_LARGE_FILES = 4
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+
+
+def make_tree(root, num_files):
+    for i in xrange(num_files):
+        sub = os.path.join(root, 'dir%d' % (i / FILES_PER_DIR))
+
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(sub)
+
+        f = open(os.path.join(sub, 'file%d' % (i)), 'wb')
+        f.write('x' * (i % 4096))
+        f.close()
+
+    for i in xrange(NUM_LARGE_FILES):
+        f = open(os.path.join(root, 'large%d' % (i)), 'wb')
+        f.write(os.urandom(LARGE_FILE_SIZE))
+        f.close()
+
+
+def best_time(make_func, dest, repeat=3):
+    best = None
+
+    for i in range(repeat):
+        func = make_func()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        shutil.rmtree(dest)
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def main():
+    num_files = 10000
+    worker_counts = [1, 4, 8, 16]
+
+    if len(sys.argv) > 1:
+        num_files = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        worker_counts = [int(arg) for arg in sys.argv[2:]]
+
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        src = os.path.join(work_dir, 'src')
+        out = os.path.join(work_dir, 'out')
+        make_tree(src, num_files)
+        os.mkdir(out)
+        dest = os.path.join(out, 'src')
+
+        print '%d small files, %d x %d MB' \
+              % (num_files, NUM_LARGE_FILES, LARGE_FILE_SIZE / 1024 / 1024)
+
+        copytree = lambda: shutil.copytree(src, dest, symlinks=True)
+        elapsed = best_time(lambda: copytree, dest)
+        print '%-28s %7.3f s' % ('shutil.copytree', elapsed)
+
+        flat_sources = [os.path.join(path, name) for name, path, is_dir,
+                        is_link in data.recursive_list_dir(src)]
+
+        for num_workers in worker_counts:
+            make_job = lambda: file_ops.Job(file_ops.COPY, [src], out,
+                                            num_workers=num_workers).run
+            elapsed = best_time(make_job, dest)
+            print '%-28s %7.3f s' % ('Job, %d worker(s)' % (num_workers),
+                                     elapsed)
+
+            make_job = lambda: file_ops.Job(file_ops.COPY, flat_sources,
+                                            dest, src, num_workers).run
+            elapsed = best_time(make_job, dest)
+            print '%-28s %7.3f s' % ('Job, flat view, %d worker(s)'
+                                     % (num_workers), elapsed)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Compares data.construct_list_for_filling against the filter-and-sort
+# implementation it replaced.
+# Usage: python bench_filling.py [num_items...]
+
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import data
+from constants import *
+
+
+def old_construct_list_for_filling(full_list, special_filter):
+    dir_list = filter(lambda(f): f.is_dir, full_list)
+    dir_list.sort()
+
+    file_list = filter(lambda(f): not f.is_dir, full_list)
+    file_list.sort()
+
+    not_hidden = filter(lambda(f): not f.is_hidden, dir_list + file_list)
+
+    dot_dot = data.RawItem(u'..', u'.')
+    dot_dot.style = STYLE_FOLDER
+    dot_dot.is_dir = True
+    dot_dot.is_hidden = False
+    not_hidden.insert(0, dot_dot)
+
+    if special_filter is not None:
+        return filter(special_filter, not_hidden)
+    else:
+        return not_hidden
+
+
+def make_items(num_items):
+    random.seed(num_items)
+    items = []
+
+    for i in xrange(num_items):
+        name = u'%x' % random.getrandbits(48)
+
+        if i % 20 == 0:
+            name = u'.' + name
+
+        item = data.make_raw_item((name, u'.', i % 10 == 0, False))
+        items.append(item)
+
+    return items
+
+
+def best_time(func, items, special_filter, repeat=3):
+    best = None
+
+    for i in range(repeat):
+        start = time.time()
+        func(items, special_filter)
+        elapsed = time.time() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def main():
+    sizes = [10000, 100000, 1000000]
+
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+
+    filters = [('no filter', None), ('filter', data.DirectoryViewFilter(u'a'))]
+
+    for num_items in sizes:
+        items = make_items(num_items)
+
+        for filter_name, special_filter in filters:
+            old = best_time(old_construct_list_for_filling, items,
+                            special_filter)
+            new = best_time(data.construct_list_for_filling, items,
+                            special_filter)
+            print '%8d items, %-9s  old %7.3f s  new %7.3f s  %5.1fx' \
+                  % (num_items, filter_name, old, new, old / new)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Compares the old listdir+isdir listing against the scandir-based one.
+# Usage: python bench_listing.py [num_files] [existing_dir]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import data
+
+
+class StatCounter(object):
+    """
+    Wraps os.stat and os.lstat to count how many times they get called from
+    Python code. Stats done inside of scandir's C code are not visible here,
+    run the benchmark under 'strace -c -e trace=stat,lstat,newfstatat' to
+    see those too.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def _wrap(self, func):
+        def counting_func(*args, **kwargs):
+            self.count += 1
+            return func(*args, **kwargs)
+        return counting_func
+
+    def install(self):
+        self.orig_stat = os.stat
+        self.orig_lstat = os.lstat
+        os.stat = self._wrap(os.stat)
+        os.lstat = self._wrap(os.lstat)
+
+    def uninstall(self):
+        os.stat = self.orig_stat
+        os.lstat = self.orig_lstat
+
+
+def old_list_dir(cwd):
+    files = []
+
+    for file_name in os.listdir(cwd):
+        files.append((file_name, os.path.isdir(os.path.join(cwd, file_name))))
+
+    return files
+
+
+def measure(func, cwd):
+    counter = StatCounter()
+    counter.install()
+
+    try:
+        start = time.time()
+        num_entries = len(func(cwd))
+        elapsed = time.time() - start
+    finally:
+        counter.uninstall()
+
+    return num_entries, counter.count, elapsed
+
+
+def make_tree(num_files):
+    root = tempfile.mkdtemp(prefix='candy-bench-')
+
+    for i in range(num_files / 10):
+        os.mkdir(os.path.join(root, 'dir%d' % i))
+
+    for i in range(num_files - num_files / 10):
+        open(os.path.join(root, 'file%d' % i), 'w').close()
+
+    return root
+
+
+def main():
+    num_files = 100000
+    root = None
+
+    if len(sys.argv) > 1:
+        num_files = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        cwd = sys.argv[2]
+    else:
+        root = make_tree(num_files)
+        cwd = root
+
+    try:
+        print 'scandir available: %s' % (data.scandir is not None)
+
+        for name, func in [('listdir+isdir', old_list_dir),
+                           ('list_dir_entries', data.list_dir_entries)]:
+            entries, stats, elapsed = measure(func, cwd)
+            print '%-18s %8d entries %8d stat calls %8.3f s' \
+                  % (name, entries, stats, elapsed)
+    finally:
+        if root:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Measures looking items up by name in a listing, as done to restore the
+# selection after updir, a refresh or a change in the directory: a linear
+# list.index() against the model's name index. The index is built on the
+# first lookup after the items change, which costs more than a single
+# linear scan; every later lookup is O(1).
+# Usage: python bench_lookup.py [num_items]
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import data
+
+
+class Model(data.PanelModel):
+    # Keeps the model off pubsub, which has nobody listening here anyway
+    def set_items(self, items):
+        self.items = items
+        self._name_index = None
+        self._path_index = None
+
+
+def main():
+    num_items = 1000000
+
+    if len(sys.argv) > 1:
+        num_items = int(sys.argv[1])
+
+    path = u'/some/directory'
+    items = [data.RawItem(u'file%07d.txt' % i, path) for i in xrange(num_items)]
+    model = Model('m.')
+    model.set_items(items)
+
+    # The worst case for list.index: the item is the last one
+    name = items[-1].file_name
+
+    start = time.time()
+    index = items.index(name)
+    linear = time.time() - start
+
+    start = time.time()
+    assert model.index_of_name(name) == index
+    first_lookup = time.time() - start
+
+    start = time.time()
+    model.index_of_name(items[num_items / 2].file_name)
+    next_lookup = time.time() - start
+
+    print '%d items' % (num_items)
+    print 'list.index, last item:          %.3fs' % (linear)
+    print 'name index, building + lookup:  %.3fs' % (first_lookup)
+    print 'name index, lookup when built:  %.6fs' % (next_lookup)
+
+
+if __name__ == '__main__':
+    main()
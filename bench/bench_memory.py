@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Measures per-item memory of RawItem against a dict-backed item with the
+# same attributes. Each kind is measured in a separate process, since
+# freed memory is not necessarily given back to the OS.
+# Usage: python bench_memory.py [num_items]
+
+import os
+import sys
+import subprocess
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import data
+
+
+class DictBackedRawItem(object):
+    # What RawItem used to be before it got __slots__
+    def __init__(self, file_name, path):
+        self.file_name = file_name
+        self.path = path
+        self.style = 0
+        self.is_dir = False
+        self.is_hidden = False
+        self.is_link = False
+        self.visual_item = None
+        self.visible_part = ''
+        self.coords = (0, 0)
+        self.start_char_on_line = 0
+        self.start_byte_on_line = 0
+
+
+def rss_bytes():
+    # Linux only: resident set size, in pages
+    statm = open('/proc/self/statm').read().split()
+    return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(kind, num_items):
+    item_class = {'slots': data.RawItem, 'dict': DictBackedRawItem}[kind]
+    path = u'/some/directory'
+
+    # Names are made up front, so that only the items themselves get counted
+    names = [u'file%d' % i for i in xrange(num_items)]
+    before = rss_bytes()
+    items = [item_class(name, path) for name in names]
+    after = rss_bytes()
+    print after - before
+
+
+def main():
+    num_items = 1000000
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], int(sys.argv[3]))
+        return
+
+    if len(sys.argv) > 1:
+        num_items = int(sys.argv[1])
+
+    results = {}
+
+    for kind in ['dict', 'slots']:
+        output = subprocess.Popen([sys.executable, __file__, '--measure',
+                                   kind, str(num_items)],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        results[kind] = int(output.strip())
+        print '%-6s %8.1f MB total %6d bytes per item' \
+              % (kind, results[kind] / 1048576.0, results[kind] / num_items)
+
+    print 'slots use %.1f times less' \
+          % (float(results['dict']) / results['slots'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Measures switching the sort mode of a listing: the first switch to a
+# mode sorts (computing and caching the keys), switching back to a mode
+# used before and reversing only rearrange the cached orders.
+#
+# The items are real files in a temporary directory, as sorting by size or
+# mtime needs a stat of each. That's the bulk of the cost: a few
+# microseconds a file with the inodes cached, a disk seek (or a round trip
+# on network file systems) each otherwise. Hence the UI stats them with a
+# data.MetadataLoader before switching to those orders; the "stat" line
+# below is what that takes in background.
+# Usage: python bench_sorting.py [num_items]
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../src')))
+
+import data
+
+
+class Model(data.PanelModel):
+    # Keeps the model off pubsub, which has nobody listening here anyway
+    def set_items(self, items):
+        self.items = items
+
+
+def make_items(root, num_items):
+    random.seed(0)
+    stems = [u'report', u'IMG_', u'data-', u'notes']
+    exts = [u'.txt', u'.jpg', u'.py', u'']
+    items = []
+
+    for i in xrange(num_items):
+        # Numbered to keep the names unique
+        name = u'%s%d-%d%s' % (random.choice(stems),
+                               random.randrange(num_items), i,
+                               random.choice(exts))
+        f = open(os.path.join(root, name), 'wb')
+        f.truncate(random.randrange(10 ** 6))
+        f.close()
+        mtime = random.randrange(10 ** 9)
+        os.utime(os.path.join(root, name), (mtime, mtime))
+        items.append(data.RawItem(name, root))
+
+    return items
+
+
+def stat_all(items):
+    start = time.time()
+
+    for item in items:
+        item.load_stat()
+
+    return time.time() - start
+
+
+def timed(model, sort_mode, reverse=False):
+    start = time.time()
+    model.set_sort_mode(sort_mode, reverse)
+    return time.time() - start
+
+
+def main():
+    num_items = 100000
+
+    if len(sys.argv) > 1:
+        num_items = int(sys.argv[1])
+
+    root = tempfile.mkdtemp()
+
+    try:
+        model = Model('m.')
+        model._raw_items = make_items(root, num_items)
+        print '%d items' % (num_items)
+        print 'stat in background         %.3fs' \
+              % (stat_all(model._raw_items))
+
+        for sort_mode in data.SORT_MODES:
+            print 'first switch to %-10s %.3fs' % (sort_mode,
+                                                  timed(model, sort_mode))
+
+        for sort_mode in data.SORT_MODES:
+            print 'switch back to %-11s %.3fs' % (sort_mode,
+                                                  timed(model, sort_mode))
+
+        print 'reverse %-18s %.3fs' % (sort_mode,
+                                       timed(model, sort_mode, True))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
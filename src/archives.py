@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Browsing zip and tar archives as if they were directories. A path inside
+# an archive is the archive's path followed by the member's path, e.g.
+# /home/me/src.tar.gz/src/main.c. Everything there is to know about the
+# members comes from an index made by reading the archive once (just the
+# central directory of a zip, a single streaming pass over a tar), which is
+# cached for as long as the archive doesn't change.
+
+import os
+import stat
+import time
+import zlib
+import errno
+import tarfile
+import zipfile
+import threading
+
+
+ZIP_EXTENSIONS = ('.zip', '.jar', '.war', '.egg', '.whl')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tbz')
+
+DEFAULT_DIR_MODE = stat.S_IFDIR | 0755
+DEFAULT_FILE_MODE = stat.S_IFREG | 0644
+
+
+def _is_zip_name(name):
+    return name.lower().endswith(ZIP_EXTENSIONS)
+
+
+def _is_tar_name(name):
+    return name.lower().endswith(TAR_EXTENSIONS)
+
+
+def is_archive(name):
+    """Whether name looks like an archive that can be browsed."""
+    return _is_zip_name(name) or _is_tar_name(name)
+
+
+def split_archive_path(path):
+    """
+    Returns (archive path, member path) if path is inside an archive, the
+    member path being relative, with '/' separators ('' for the top of the
+    archive). None if path is not inside an archive.
+    """
+    if os.path.isdir(path):
+        return None
+
+    path = os.path.abspath(path)
+    inner = []
+    head = path
+
+    while True:
+        if is_archive(head) and os.path.isfile(head):
+            inner.reverse()
+            return head, u'/'.join(inner)
+
+        head, tail = os.path.split(head)
+
+        if not tail or os.path.isdir(head):
+            return None
+
+        inner.append(tail)
+
+
+class MemberStat(object):
+    """The bits of an os.stat() result that are known of a member."""
+    __slots__ = ('st_size', 'st_mtime', 'st_mode')
+
+    def __init__(self, size, mtime, mode):
+        self.st_size = size
+        self.st_mtime = mtime
+        self.st_mode = mode
+
+
+def _decode(name):
+    if isinstance(name, unicode):
+        return name
+
+    try:
+        return name.decode('utf-8')
+    except UnicodeDecodeError:
+        return name.decode('latin-1')
+
+
+class ArchiveIndex(object):
+    """
+    The members of an archive by directory. Directories that only show up
+    as a part of members' paths get added too.
+    """
+    def __init__(self):
+        # Member directory ('' for the top) -> {name: (is_dir, is_link, stat)}
+        self.dirs = {u'': {}}
+
+    def _add_dir(self, path):
+        if path in self.dirs:
+            return
+
+        self.dirs[path] = {}
+        parent, name = self._split(path)
+        self._add_dir(parent)
+        self.dirs[parent].setdefault(name, (True, False,
+                                            MemberStat(0, 0,
+                                                       DEFAULT_DIR_MODE)))
+
+    def _split(self, path):
+        if u'/' not in path:
+            return u'', path
+
+        return path.rsplit(u'/', 1)
+
+    def add(self, name, is_dir, is_link, member_stat):
+        # Some archivers put in './' or '/' prefixes
+        parts = [p for p in _decode(name).split(u'/') if p not in (u'', u'.')]
+
+        if not parts:
+            return
+
+        path = u'/'.join(parts)
+        parent, name = self._split(path)
+        self._add_dir(parent)
+
+        if is_dir:
+            self._add_dir(path)
+
+        self.dirs[parent][name] = (is_dir, is_link, member_stat)
+
+    def list_dir(self, path):
+        """
+        Returns (name, is_dir, is_link, stat) of the members in the member
+        directory path. Raises OSError if there's no such directory.
+        """
+        members = self.dirs.get(path.strip(u'/'))
+
+        if members is None:
+            raise OSError(errno.ENOENT, 'No such directory in the archive',
+                          path)
+
+        return [(name, is_dir, is_link, st) for name, (is_dir, is_link, st)
+                in members.iteritems()]
+
+    def walk(self, path):
+        """
+        Yields (member directory, name, is_dir, is_link, stat) of every
+        member below path that is not a directory, like a flat view lists.
+        """
+        path = path.strip(u'/')
+        prefix = path + u'/'
+
+        for dir_path, members in self.dirs.iteritems():
+            if dir_path != path and path and not dir_path.startswith(prefix):
+                continue
+
+            for name, (is_dir, is_link, st) in members.iteritems():
+                if not is_dir:
+                    yield dir_path, name, is_dir, is_link, st
+
+
+def _zip_mtime(info):
+    try:
+        return time.mktime(info.date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return 0
+
+
+def read_zip_index(path):
+    index = ArchiveIndex()
+    archive = zipfile.ZipFile(path)
+
+    try:
+        # Made out of the central directory, no member gets read
+        for info in archive.infolist():
+            is_dir = info.filename.endswith('/')
+            mode = info.external_attr >> 16
+
+            if not mode:
+                mode = is_dir and DEFAULT_DIR_MODE or DEFAULT_FILE_MODE
+
+            is_link = stat.S_ISLNK(mode)
+            st = MemberStat(info.file_size, _zip_mtime(info), mode)
+            index.add(info.filename, is_dir, is_link, st)
+    finally:
+        archive.close()
+
+    return index
+
+
+def read_tar_index(path):
+    index = ArchiveIndex()
+
+    # Headers are read in one pass from start to end, member data is
+    # skipped: seeked over in plain tars, decompressed and dropped in
+    # compressed ones. That's also what stream mode ('r|*') does, only it
+    # is more than twice as slow, copying its buffer for every header.
+    archive = tarfile.open(path, 'r:*')
+
+    try:
+        for info in archive:
+            if info.isdir():
+                type_bits = stat.S_IFDIR
+            elif info.issym():
+                type_bits = stat.S_IFLNK
+            else:
+                type_bits = stat.S_IFREG
+
+            st = MemberStat(info.size, info.mtime,
+                            type_bits | stat.S_IMODE(info.mode))
+            index.add(info.name, info.isdir(), info.issym(), st)
+    finally:
+        archive.close()
+
+    return index
+
+
+def read_index(path):
+    """Reads the ArchiveIndex of the archive at path."""
+    try:
+        if _is_zip_name(path):
+            return read_zip_index(path)
+
+        return read_tar_index(path)
+    except (zipfile.BadZipfile, tarfile.TarError, zlib.error, EOFError,
+            IOError), e:
+        raise OSError(errno.EINVAL, 'Can\'t read the archive: %s' % (e), path)
+
+
+class ArchiveCache(object):
+    """
+    Indices of the last max_archives archives read, keyed by path and only
+    handed out while the archive's mtime and size stay the same, so that
+    going around in an archive doesn't read it again. Meant to be shared
+    between panes.
+    """
+    def __init__(self, max_archives=8):
+        self.max_archives = max_archives
+
+        # path -> ((mtime, size), index)
+        self._indices = {}
+
+        # Paths, the least recently used first
+        self._lru = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._indices)
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+
+    def has_index(self, path):
+        """Whether get_index(path) would be had without reading path."""
+        path = os.path.abspath(path)
+
+        try:
+            stamp = self._stamp(path)
+        except OSError:
+            return False
+
+        self._lock.acquire()
+
+        try:
+            cached = self._indices.get(path)
+            return cached is not None and cached[0] == stamp
+        finally:
+            self._lock.release()
+
+    def get_index(self, path):
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+        self._lock.acquire()
+
+        try:
+            cached = self._indices.get(path)
+
+            if cached is not None and cached[0] == stamp:
+                self._lru.remove(path)
+                self._lru.append(path)
+                return cached[1]
+        finally:
+            self._lock.release()
+
+        index = read_index(path)
+        self._lock.acquire()
+
+        try:
+            if path in self._indices:
+                self._lru.remove(path)
+
+            self._indices[path] = (stamp, index)
+            self._lru.append(path)
+
+            while len(self._lru) > self.max_archives:
+                del self._indices[self._lru.pop(0)]
+        finally:
+            self._lock.release()
+
+        return index
+
+
+def _get_index(archive_path, cache):
+    if cache is not None:
+        return cache.get_index(archive_path)
+
+    return read_index(archive_path)
+
+
+def is_dir(path, cache=None):
+    """
+    Whether path is a directory inside an archive. Raises OSError if the
+    archive can't be read.
+    """
+    location = split_archive_path(path)
+
+    if location is None:
+        return False
+
+    archive_path, inner = location
+    return inner.strip(u'/') in _get_index(archive_path, cache).dirs
+
+
+def list_dir(path, cache=None):
+    """
+    Lists the directory path inside an archive, giving the entry tuples
+    data.list_files does, each with a MemberStat appended.
+    """
+    archive_path, inner = split_archive_path(path)
+    index = _get_index(archive_path, cache)
+    return [(name, path, is_dir, is_link, st)
+            for name, is_dir, is_link, st in index.list_dir(inner)]
+
+
+def walk(path, cache=None):
+    """Same as list_dir, but for the flat view of path."""
+    archive_path, inner = split_archive_path(path)
+    index = _get_index(archive_path, cache)
+    entries = []
+
+    for dir_path, name, is_dir, is_link, st in index.walk(inner):
+        parts = [archive_path] + [p for p in dir_path.split(u'/') if p]
+        entries.append((name, os.path.join(*parts), is_dir, is_link, st))
+
+    return entries
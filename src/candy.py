@@ -23,9 +23,11 @@
 
 import os
 import time
+import errno
 import sys
 import pdb
 import platform
+import threading
 import subprocess
 
 import wx
@@ -40,6 +42,14 @@ import wx.lib.pubsub as pubsub
 
 import keyboard
 import util
+import watcher
+import tree_index
+import name_filter
+import dir_sizes
+import file_ops
+import trash
+import archives
+import line_index
 from status_line import StatusLine
 import data
 from constants import *
@@ -51,6 +61,86 @@ general_config = util.read_config(general_conf_path)
 color_conf = os.path.join(project_dir, u'colorscheme-default.conf')
 color_scheme = util.read_config(color_conf)
 
+# Seconds a keystroke may spend on scoring fuzzy matches before the view
+# gets updated
+FUZZY_SEARCH_BUDGET = 0.03
+
+
+def describe_metadata(item):
+    # Size and mtime of item for the status bar, stat'ing it if needed
+    if item.mtime is None:
+        return u'no details'
+
+    mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(item.mtime))
+
+    if item.is_dir:
+        if item.tree_size is not None:
+            return u'%d bytes in all, %s' % (item.tree_size, mtime)
+
+        return mtime
+
+    return u'%d bytes, %s' % (item.size, mtime)
+
+
+def describe_job(job):
+    # Progress of a file_ops.Job for the status bar
+    verb = {file_ops.COPY: u'Copying', file_ops.MOVE: u'Moving',
+            file_ops.DELETE: u'Deleting', file_ops.TRASH: u'Trashing',
+            file_ops.RESTORE: u'Restoring'}[job.kind]
+    name = os.path.basename(job.current or u'')
+    text = u'%s \'%s\' (%d of %d item(s) done)' % (verb, name, job.num_done,
+                                                 len(job.sources))
+
+    if job.bytes_total > 0:
+        text += u': %d%%' % (100 * job.bytes_done / job.bytes_total)
+
+    if job.kind in (file_ops.COPY, file_ops.MOVE):
+        text += u', %.1f MB/s' % (job.throughput() / (1024.0 * 1024.0))
+
+    return text
+
+
+def describe_finished_job(job):
+    if job.kind in (file_ops.COPY, file_ops.MOVE):
+        verb = {file_ops.COPY: u'Copied', file_ops.MOVE: u'Moved'}[job.kind]
+        text = u'%s %d of %d item(s) to %s, %.1f MB in %.1fs' \
+               % (verb, job.num_done, len(job.sources), job.dest_dir,
+                  job.bytes_done / (1024.0 * 1024.0), job.elapsed())
+    else:
+        verb = {file_ops.DELETE: u'Deleted', file_ops.TRASH: u'Trashed',
+                file_ops.RESTORE: u'Restored'}[job.kind]
+        text = u'%s %d of %d item(s) in %.1fs' \
+               % (verb, job.num_done, len(job.sources), job.elapsed())
+
+        if job.kind == file_ops.RESTORE and not job.sources:
+            text = u'Nothing to restore'
+
+    if job.is_cancelled():
+        text += u', cancelled'
+
+    if job.errors:
+        src, message = job.errors[0]
+        text += u', %d failed: %s' % (len(job.errors), message)
+
+    return text
+
+
+def make_walk_settings(config):
+    def int_or_none(name):
+        value = config.get(name, '').strip()
+
+        if value == '' or value.lower() == 'none':
+            return None
+
+        return int(value)
+
+    patterns = config.get('flat-view-exclude', '').split(',')
+    exclude = [p.strip() for p in patterns if p.strip()]
+    return data.WalkSettings(int_or_none('flat-view-max-depth'),
+                             int_or_none('flat-view-max-entries'),
+                             exclude,
+                             int(config.get('flat-view-threads', 4)))
+
 
 class VisualItem(object):
     """
@@ -59,6 +149,10 @@ class VisualItem(object):
     the ViewWindow coords and the like. Number of these objects is the number
     RawItems that actually fit on screen (at least partially).
     """
+
+    __slots__ = ('start_char_on_line', 'vis_len_in_chars',
+                 'start_byte_on_line', 'vis_len_in_bytes', 'fully_in_view')
+
     def __init__(self):
         # Character on the row-representing string, which is the str[0]-th
         # char of this item's visual representation. Will not be negative,
@@ -185,13 +279,17 @@ class ViewWindow(object):
 
 
 class PanelController(object):
-    def __init__(self, panel, model_signature, controller_signature):
-        self.model = data.PanelModel(model_signature)
+    def __init__(self, panel, model_signature, controller_signature,
+                 listing_cache=None, flat_view_index=None, size_cache=None,
+                 archive_cache=None):
+        self.model = data.PanelModel(model_signature, listing_cache)
         self.controller_signature = controller_signature
         self.view = panel
         self._bind_events(self.view)
         signature = model_signature + 'NEW ITEMS'
         pubsub.Publisher().subscribe(self._after_dir_change, signature)
+        signature = model_signature + 'WORKDIR CHANGED'
+        pubsub.Publisher().subscribe(self._after_workdir_change, signature)
 
         self._subscribe(self._search_ctrl_enter, 'CONTROL ENTER')
         self._subscribe(self._search_enter, 'ENTER')
@@ -209,6 +307,63 @@ class PanelController(object):
         # Index of an item that is currently selected
         self.selected_item = 0
 
+        # Where updir put the selection, for it to follow the directory it
+        # came from as the rest of the listing comes in
+        self._followed_selection = 0
+
+        # Whether '/' ranks the items by fuzzy match instead of jumping
+        # between the substring matches
+        self.fuzzy_search = \
+            general_config.get('fuzzy-search', 'False').lower() == 'true'
+
+        # Selection to go back to when a fuzzy search gets cancelled
+        self._selection_before_fuzzy_search = 0
+
+        # Stats the items on screen in background, so that moving the
+        # selection over them shows their details without waiting for disk
+        self.metadata_loader = data.MetadataLoader()
+        self.metadata_loader.start()
+        self._metadata_requested_for = None
+
+        # Stats the whole listing before sorting it by size or mtime, which
+        # waits in self._pending_sort as (sort_mode, reverse, items) till then
+        def on_sort_stats(items):
+            wx.CallAfter(self._on_sort_stats, items)
+
+        self.sort_stat_loader = data.MetadataLoader(on_sort_stats)
+        self.sort_stat_loader.start()
+        self._pending_sort = None
+
+        # dir_sizes.SizeComputer working on the current listing, if any
+        self.size_computer = None
+        self._num_sizes_computed = 0
+        self.size_cache = size_cache
+
+        if self.size_cache is None:
+            self.size_cache = dir_sizes.SizeCache()
+
+        # Watches the working directory, so that files appearing and
+        # disappearing there show up without a refresh
+        self.dir_watcher = None
+
+        # Path in an archive to change to once the archive has been read
+        self._archive_being_read = None
+
+        # Item the delete key was pressed on once, to be deleted when it's
+        # pressed again
+        self._delete_armed_for = None
+
+        self.model.walk_settings = make_walk_settings(general_config)
+        sort_mode = general_config.get('sort-mode', data.SORT_BY_NAME).strip()
+
+        if sort_mode in data.SORT_MODES:
+            self.model.sort_mode = sort_mode
+        self.model.tree_index = flat_view_index
+        self.model.archive_cache = archive_cache
+
+        if self.model.archive_cache is None:
+            self.model.archive_cache = archives.ArchiveCache()
+
         self.keys = keyboard.KeyboardConfig()
         self.keys.load(u'keys.conf', self)
 
@@ -228,7 +383,8 @@ class PanelController(object):
     def initialize_view_settings(self, num_columns=3, num_rows=None):
         self.view.initialize_view_settings(self.model.items, num_columns,
                                            num_rows)
-        self.view.highlight_search_matches(self.model.items, self.search_str)
+        self.view.highlight_search_matches(self.model.items, self.search_str,
+                                           self.model.get_search_index())
         self._set_selection_on_curr_item()
 
     def initialize_and_show_initial_view(self):
@@ -256,8 +412,13 @@ class PanelController(object):
         if self._num_items() > 0:
             item = self._get_selection()
             status_text = u'[Folder view]: %s\t%d item(s) -- \'%s\' in %s' \
-                          % (os.getcwdu(), self._num_items() - 1,
-                             item.file_name, item.path)
+                          u' (%s)' % (os.getcwdu(), self._num_items() - 1,
+                                      item.file_name, item.path,
+                                      describe_metadata(item))
+
+            if self.model.is_scanning():
+                status_text += u' (still reading...)'
+
             self.view.get_frame().status_bar.SetStatusText(status_text)
 
     def _on_key_down(self, evt):
@@ -271,7 +432,13 @@ class PanelController(object):
 
     def _on_set_focus(self, evt):
         self.view.on_set_focus()
-        os.chdir(self.model.working_dir)
+        location = archives.split_archive_path(self.model.working_dir)
+
+        if location is None:
+            os.chdir(self.model.working_dir)
+        else:
+            # Archives can't be chdir'ed into, the one they're in will do
+            os.chdir(os.path.dirname(location[0]))
 
     def quiter(self):
         sys.exit(0)
@@ -282,31 +449,396 @@ class PanelController(object):
     def updir(self):
         self.selected_item = 0
         self.clear_screen()
-        self.selected_item = self.model.updir()
+        self.selected_item = self.model.updir(wx.CallAfter)
+        self._followed_selection = self.selected_item
 
     def list_drive_letters(self):
         if platform.system() != 'Windows':
             return
 
         self.selected_item = 0
+        self.model.cancel_scan()
         self.model.set_items(data.collect_drive_letters())
 
     def flatten_directory(self):
         self.model.flatten_directory()
-        self.model.fill_list_by_working_dir(self.model.working_dir)
+        self.model.start_filling_by_working_dir(self.model.working_dir,
+                                                wx.CallAfter)
+
+    def _resort(self, sort_mode, reverse):
+        items = self.model.items_to_stat(sort_mode)
+
+        if items:
+            # The current order stays until they're all stat'ed
+            self._pending_sort = (sort_mode, reverse, items)
+            self.sort_stat_loader.request(items)
+            status_text = u'Reading %d file(s) to sort by %s...' \
+                          % (len(items), sort_mode)
+            self.view.get_frame().status_bar.SetStatusText(status_text)
+            return
+
+        self._pending_sort = None
+        selected = None
+
+        if self._num_items() > 0:
+            item = self._get_selection()
+            selected = (item.path, item.file_name)
+
+        self.model.set_sort_mode(sort_mode, reverse)
+
+        if selected is not None:
+            index = self.model.index_of_path(*selected)
+
+            if index is not None:
+                self.selected_item = index
+
+        message = u'Sorted by %s' % (sort_mode)
+
+        if reverse:
+            message += u', reversed'
+
+        self.view.get_frame().status_bar.SetStatusText(message)
+
+    def _on_sort_stats(self, items):
+        pending = self._pending_sort
+
+        if pending is None or pending[2] is not items:
+            return
+
+        self._resort(pending[0], pending[1])
+
+    def _cancel_pending_sort(self):
+        if self._pending_sort is not None:
+            self._pending_sort = None
+            self.sort_stat_loader.request([])
+
+    def _sort_order(self):
+        # The one asked for last, even if it's still waiting for the stats
+        if self._pending_sort is not None:
+            return self._pending_sort[:2]
+
+        return self.model.sort_mode, self.model.sort_reverse
+
+    def cycle_sort_mode(self):
+        sort_mode, reverse = self._sort_order()
+        modes = data.SORT_MODES
+        index = (modes.index(sort_mode) + 1) % len(modes)
+        self._resort(modes[index], reverse)
+
+    def reverse_sort_order(self):
+        sort_mode, reverse = self._sort_order()
+        self._resort(sort_mode, not reverse)
+
+    def _cancel_size_computation(self):
+        if self.size_computer is not None:
+            self.size_computer.cancel()
+            self.size_computer = None
+
+    def compute_sizes(self):
+        self._cancel_size_computation()
+
+        if self._refuse_in_archive(u'compute sizes'):
+            return
+
+        items = [i for i in self.model.items
+                 if i.is_dir and i.file_name != u'..']
+
+        if not items:
+            return
+
+        def on_size(computer, item, size):
+            wx.CallAfter(self._on_tree_size, computer, item, size)
+
+        def on_done(computer):
+            wx.CallAfter(self._on_sizes_done, computer)
+
+        num_processes = int(general_config.get('dir-size-processes', 4))
+        self.size_computer = dir_sizes.SizeComputer(items, self.size_cache,
+                                                    on_size, on_done,
+                                                    num_processes)
+        self._num_sizes_computed = 0
+        self.size_computer.start()
+
+    def _on_tree_size(self, computer, item, size):
+        if computer is not self.size_computer:
+            return
+
+        self.model.set_tree_size(item, size)
+        self._num_sizes_computed += 1
+        status_text = u'Computing sizes: %d of %d directories' \
+                      % (self._num_sizes_computed, len(computer.items))
+        self.view.get_frame().status_bar.SetStatusText(status_text)
+
+    def _on_sizes_done(self, computer):
+        if computer is not self.size_computer:
+            return
+
+        self.size_computer = None
+
+        # A sort still waiting for stats takes the sizes in once it's done
+        resort = self._pending_sort is None \
+                 and self.model.sort_mode == data.SORT_BY_SIZE
+
+        if resort:
+            self._resort(data.SORT_BY_SIZE, self.model.sort_reverse)
+        elif self._num_items() > 0:
+            self._display_selection_info()
+
+    def _other_pane(self):
+        frame = self.view.get_frame()
+
+        if frame.p1 is self:
+            return frame.p2
+
+        return frame.p1
+
+    def _refuse_in_archive(self, what):
+        # Operations on real files make no sense on the members of archives
+        if not self.model.in_archive():
+            return False
+
+        self.view.set_status_line_text(u'Can\'t %s inside archives' % (what))
+        return True
+
+    def _refuse_without_journal(self, what):
+        # Trashing is off if the journal couldn't be had at start up
+        if self.view.get_frame().trash_journal is not None:
+            return False
+
+        self.view.set_status_line_text(u'Can\'t %s, the trash journal is '
+                                       u'not usable (see the log)' % (what))
+        return True
+
+    def _submit_file_job(self, kind):
+        if self._num_items() == 0 or self._refuse_in_archive(kind):
+            return
+
+        dest_dir = self._other_pane().model.working_dir
+        status_bar = self.view.get_frame().status_bar
+
+        if self._other_pane().model.in_archive():
+            status_bar.SetStatusText(u'Can\'t %s into archives' % (kind))
+            return
+        num_workers = int(general_config.get('copy-workers',
+                                             file_ops.DEFAULT_COPY_WORKERS))
+
+        if self.model.flat_directory_view:
+            # The whole view goes, each file keeping its path relative to
+            # the working dir
+            root = os.path.abspath(self.model.working_dir)
+            sources = [os.path.abspath(os.path.join(i.path, i.file_name))
+                       for i in self.model.items if i.file_name != u'..']
+            source_dir = root
+            what = u'%d file(s) of the flat view' % (len(sources))
+        else:
+            item = self._get_selection()
+
+            if item.file_name == u'..':
+                return
+
+            root = None
+            sources = [os.path.abspath(os.path.join(item.path,
+                                                    item.file_name))]
+            source_dir = os.path.dirname(sources[0])
+            what = u'\'%s\'' % (item.file_name)
+
+        if not sources:
+            return
+
+        if source_dir == os.path.abspath(dest_dir):
+            status_bar.SetStatusText(u'Both panes show the same directory')
+            return
+
+        job = file_ops.Job(kind, sources, dest_dir, root, num_workers)
+        self.view.get_frame().file_jobs.submit(job)
+        status_bar.SetStatusText(u'Queued %s of %s to %s'
+                                 % (kind, what, dest_dir))
+
+    def copy_to_other_pane(self):
+        self._submit_file_job(file_ops.COPY)
+
+    def move_to_other_pane(self):
+        self._submit_file_job(file_ops.MOVE)
+
+    def _submit_removal(self, kind):
+        if self._num_items() == 0 or self._refuse_in_archive(kind):
+            return
+
+        if kind == file_ops.TRASH and self._refuse_without_journal(kind):
+            return
+
+        item = self._get_selection()
+
+        if item.file_name == u'..':
+            return
+
+        source = os.path.abspath(os.path.join(item.path, item.file_name))
+        frame = self.view.get_frame()
+        num_workers = int(general_config.get('copy-workers',
+                                             file_ops.DEFAULT_COPY_WORKERS))
+        job = file_ops.Job(kind, [source], num_workers=num_workers,
+                           journal=frame.trash_journal)
+        frame.file_jobs.submit(job)
+
+        # Gone from the listing right away; if it fails, it comes back when
+        # the job is done
+        backup = self.selected_item
+        self.model.drop_items([item])
+        self.selected_item = min(backup, max(self._num_items() - 1, 0))
+        self._set_selection_on_curr_item()
+
+    def trash_selected(self):
+        self._submit_removal(file_ops.TRASH)
+
+    def delete_selected(self):
+        # Deleting for good takes pressing the key twice on the same item
+        item = None
+
+        if self._num_items() > 0:
+            item = self._get_selection()
+
+        if item is None or item is not self._delete_armed_for:
+            self._delete_armed_for = item
+
+            if item is not None and item.file_name != u'..':
+                self.view.set_status_line_text(u'Press again to delete \'%s\''
+                                               u' for good' % (item.file_name))
+            return
+
+        self._delete_armed_for = None
+        self._submit_removal(file_ops.DELETE)
+
+    def undo_trash(self):
+        if self._refuse_without_journal(u'undo trashing'):
+            return
+
+        frame = self.view.get_frame()
+        frame.file_jobs.submit(file_ops.Job(file_ops.RESTORE, [],
+                                            journal=frame.trash_journal))
+
+    def file_job_done(self, job):
+        """Puts what job didn't remove, or restored, back in the listing."""
+        paths = job.failed + job.restored
+
+        if not paths:
+            return
+
+        selected = None
+
+        if self._num_items() > 0:
+            item = self._get_selection()
+            selected = (item.path, item.file_name)
+
+        self.model.add_paths(paths)
+
+        if selected is not None:
+            index = self.model.index_of_path(*selected)
+
+            if index is not None:
+                self.selected_item = index
+
+        self.selected_item = min(self.selected_item,
+                                 max(self._num_items() - 1, 0))
+        self._set_selection_on_curr_item()
+
+    def cancel_file_operations(self):
+        self.view.get_frame().file_jobs.cancel_all()
+
+    def update_tree_index(self):
+        if self.model.tree_index is None:
+            self.view.set_status_line_text(u'Tree index is not enabled')
+            return
+
+        root = self.model.working_dir
+        index = self.model.tree_index
+        settings = data.WalkSettings(exclude=self.model.walk_settings.exclude)
+        status_bar = self.view.get_frame().status_bar
+
+        def update():
+            try:
+                num_dirs_read = index.update(root, settings)
+                status_text = u'Tree index of %s is up to date, %d dir(s) ' \
+                              u'read' % (root, num_dirs_read)
+            except tree_index.TreeIndexError, inst:
+                status_text = u'Could not update the tree index of %s: %s' \
+                              % (root, inst)
+
+            wx.CallAfter(status_bar.SetStatusText, status_text)
+
+        status_bar.SetStatusText(u'Updating tree index of %s...' % (root))
+        thread = threading.Thread(target=update)
+        thread.setDaemon(True)
+        thread.start()
+
+    def abort_reading(self):
+        # Whatever has been read so far stays in the list
+        self.model.cancel_scan()
 
     def _change_dir(self, fullPath, search_str=u''):
-        self.model.set_dir_filter(search_str)
+        try:
+            self.model.set_dir_filter(search_str)
+        except name_filter.FilterError, inst:
+            self.view.set_status_line_text(unicode(inst))
+            return
+
+        self._archive_being_read = None
 
         try:
-            os.chdir(fullPath)
+            location = archives.split_archive_path(fullPath)
+
+            if location is None:
+                os.chdir(fullPath)
+            elif not self.model.archive_cache.has_index(location[0]):
+                self._read_archive(location[0], fullPath, search_str)
+                return
+            elif archives.is_dir(fullPath, self.model.archive_cache):
+                # Archives can't be chdir'ed into, the one they're in will do
+                os.chdir(os.path.dirname(location[0]))
+            else:
+                raise OSError(errno.ENOTDIR, 'Not a directory', fullPath)
         except OSError, inst:
             self.view.set_status_line_text(str(inst))
             return
 
         self.clear_screen()
         self.selected_item = 0
-        self.model.fill_list_by_working_dir(fullPath)
+        self.model.start_filling_by_working_dir(fullPath, wx.CallAfter)
+
+    def _read_archive(self, archive_path, fullPath, search_str):
+        # Large archives take seconds to read, so that's done in background
+        # and the pane only changes to fullPath once it's done, unless it
+        # has been changed to somewhere else in the meantime
+        self._archive_being_read = fullPath
+        cache = self.model.archive_cache
+        self.view.set_status_line_text(u'Reading %s...'
+                                       % (os.path.basename(archive_path)))
+
+        def read():
+            try:
+                cache.get_index(archive_path)
+            except OSError, inst:
+                wx.CallAfter(self._on_archive_read, fullPath, search_str,
+                             str(inst))
+            else:
+                wx.CallAfter(self._on_archive_read, fullPath, search_str,
+                             None)
+
+        thread = threading.Thread(target=read)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _on_archive_read(self, fullPath, search_str, error):
+        if self._archive_being_read != fullPath:
+            return
+
+        self._archive_being_read = None
+
+        if error is not None:
+            self.view.set_status_line_text(error)
+            return
+
+        self.view.set_status_line_text(u'')
+        self._change_dir(fullPath, search_str)
 
     def _list_search_matches(self, search_str):
         self._change_dir(self.model.working_dir, search_str)
@@ -318,15 +850,89 @@ class PanelController(object):
         self._change_dir(os.path.expanduser(u'~'))
 
     def _after_dir_change(self, message):
+        # The directory updir came from might have come in or moved just
+        # now. It's followed as long as the selection is left alone.
+        index = self.model.listed_selection()
+        followed = self._followed_selection
+
+        if index is not None and self.selected_item == followed:
+            self.selected_item = self._followed_selection = index
+
+        # The list might have shrunk under the selection
+        if self.selected_item >= self._num_items():
+            self.selected_item = max(self._num_items() - 1, 0)
+
         self._update_view()
         self._set_selection_on_curr_item()
 
+    def _stop_watching(self):
+        if self.dir_watcher is not None:
+            self.dir_watcher.stop()
+            self.dir_watcher = None
+
+    def _after_workdir_change(self, message):
+        self._stop_watching()
+        self._cancel_size_computation()
+        self._cancel_pending_sort()
+
+        # Flat view spans the whole tree, watching the top directory alone
+        # would not do it any good. Archives are read once, as they're
+        # cached; they're read again when they change.
+        if self.model.flat_directory_view or self.model.in_archive():
+            return
+
+        def on_changes(dir_watcher, created, deleted):
+            wx.CallAfter(self._on_dir_changes, dir_watcher, created, deleted)
+
+        self.dir_watcher = watcher.DirectoryWatcher(message.data, on_changes)
+        self.dir_watcher.start()
+
+    def _on_dir_changes(self, dir_watcher, created, deleted):
+        # Changes may still be queued up from the directory we've just left
+        if dir_watcher is not self.dir_watcher:
+            return
+
+        if created is None:
+            self.refresh()
+            return
+
+        if self._num_items() == 0:
+            self.model.apply_dir_changes(created, deleted)
+            return
+
+        selected_name = self._get_selection().file_name
+        backup = self.selected_item
+        self.model.apply_dir_changes(created, deleted)
+
+        index = self.model.index_of_name(selected_name)
+
+        if index is None:
+            # It's gone, so stay at the same place
+            self.selected_item = min(backup, max(self._num_items() - 1, 0))
+        else:
+            self.selected_item = index
+
+        self._set_selection_on_curr_item()
+
     def _search_ctrl_enter(self, msg):
         self.view.SetFocus()
+
+        if self.model.is_fuzzy_searching():
+            # The matches are already listed, just keep them
+            self.model.end_fuzzy_search(True)
+            self.selected_item = 0
+            self._set_selection_on_curr_item()
+            return
+
         self._list_search_matches(self.search_str)
 
     def _search_enter(self, msg):
         self.view.SetFocus()
+
+        if self.model.is_fuzzy_searching():
+            self._end_fuzzy_search_on_best_match()
+            return
+
         # Here we want to stop searching and set focus on first search match.
         # But if there was no match, we want to behave more like when we cancel
         # search. Except we've no matches to clear, since no match means
@@ -337,12 +943,68 @@ class PanelController(object):
 
     def _search_escape(self, msg):
         self.view.SetFocus()
+
+        if self.model.is_fuzzy_searching():
+            self.model.end_fuzzy_search(False)
+            self.selected_item = self._selection_before_fuzzy_search
+            self._set_selection_on_curr_item()
+            return
+
         self.view.apply_default_styles(self.model.items)  # clean matches
 
     def _search_new_status_line_text(self, msg):
+        if self.fuzzy_search:
+            self._start_fuzzy_search(msg.data)
+            return
+
         self.search_str = msg.data
         self.search_match_index = self._incremental_search(self.search_str)
 
+    def toggle_fuzzy_search(self):
+        self.fuzzy_search = not self.fuzzy_search
+
+        if self.fuzzy_search:
+            message = u'Fuzzy search'
+        else:
+            message = u'Substring search'
+
+        self.view.get_frame().status_bar.SetStatusText(message)
+
+    def _start_fuzzy_search(self, query):
+        if not self.model.is_fuzzy_searching():
+            self._selection_before_fuzzy_search = self.selected_item
+
+        search = self.model.start_fuzzy_search(query)
+        self._continue_fuzzy_search(search)
+
+    def _continue_fuzzy_search(self, search):
+        # Only a slice of the items gets scored per call, so that typing
+        # stays responsive in huge listings. The rest is scored in the
+        # following idle moments, unless the query changes before that.
+        done = self.model.run_fuzzy_search(search, FUZZY_SEARCH_BUDGET)
+        self.selected_item = 0
+        self._set_selection_on_curr_item()
+
+        if not done:
+            wx.CallAfter(self._continue_fuzzy_search, search)
+
+    def _end_fuzzy_search_on_best_match(self):
+        # Go back to the whole listing, with the best match selected
+        if self._num_items() == 0:
+            self.model.end_fuzzy_search(False)
+            self.selected_item = self._selection_before_fuzzy_search
+        else:
+            best_match = self._get_selection()
+            self.model.end_fuzzy_search(False)
+
+            # By identity, as names repeat in flat view
+            for index, item in enumerate(self.model.items):
+                if item is best_match:
+                    self.selected_item = index
+                    break
+
+        self._set_selection_on_curr_item()
+
     def on_enter(self):
         selection = self._get_selection()
 
@@ -351,6 +1013,11 @@ class PanelController(object):
                 self.updir()
             else:
                 self.downdir(selection.file_name)
+        elif self.model.in_archive():
+            self.view.set_status_line_text(u'Can\'t open files inside '
+                                           u'archives')
+        elif archives.is_archive(selection.file_name):
+            self.downdir(selection.file_name)
         else:
             base, ext = os.path.splitext(selection.file_name)
             command_line = util.resolve_command_by_file_ext(ext[1:].lower())
@@ -371,7 +1038,8 @@ class PanelController(object):
         match_index = self.model.next_search_match(search_str,
                                                    self.selected_item)
         self.view.move_item_into_view(self.model.items, match_index)
-        self.view.highlight_search_matches(self.model.items, search_str)
+        self.view.highlight_search_matches(self.model.items, search_str,
+                                           self.model.get_search_index())
         return match_index
 
     def on_start_inc_search(self):
@@ -390,10 +1058,19 @@ class PanelController(object):
         if not item.visual_item or not item.visual_item.fully_in_view:
             self.view.move_item_into_view(self.model.items, self.selected_item)
             self.view.highlight_search_matches(self.model.items,
-                                               self.search_str)
+                                               self.search_str,
+                                               self.model.get_search_index())
 
         self.view.set_selection_on_item(item)
         self._display_selection_info()
+        self._load_visible_metadata()
+
+    def _load_visible_metadata(self):
+        visible_items = self.view.visible_items
+
+        if visible_items is not self._metadata_requested_for:
+            self._metadata_requested_for = visible_items
+            self.metadata_loader.request(visible_items)
 
     def move_selection_down(self):
         self.selected_item += 1
@@ -473,17 +1150,44 @@ class PanelController(object):
 
     def refresh(self):
         backup = self.selected_item
+        selected = None
+
+        if self._num_items() > 0:
+            item = self._get_selection()
+            selected = (item.path, item.file_name)
+
         self._change_dir(self.model.working_dir)
-        self.view.highlight_search_matches(self.model.items, self.search_str)
-        self.selected_item = backup
+        self.view.highlight_search_matches(self.model.items, self.search_str,
+                                           self.model.get_search_index())
+        index = None
+
+        if selected is not None:
+            index = self.model.index_of_path(*selected)
+
+        # Items added or removed before the selected one would shift it, so
+        # it's looked up by path. If it's gone (or not read yet), stay at the
+        # same place.
+        if index is None:
+            index = min(backup, max(self._num_items() - 1, 0))
+
+        self.selected_item = index
 
     def _get_selection(self):
         return self.model.items[self.selected_item]
 
     def start_viewer(self):
         import viewr
-        file = self._get_selection().file_name
-        wnd = viewr.BuiltinViewerFrame(self.view, -1, file, file)
+        item = self._get_selection()
+        file = os.path.join(item.path, item.file_name)
+        cache = self.view.get_frame().line_index_cache
+
+        try:
+            wnd = viewr.BuiltinViewerFrame(self.view, -1, item.file_name, file,
+                                           line_index_cache=cache)
+        except EnvironmentError, inst:
+            self.view.set_status_line_text(str(inst))
+            return
+
         wnd.Show(True)
 
     def switch_pane(self):
@@ -518,6 +1222,9 @@ class Panel(stc.StyledTextCtrl):
         # controller.items and represent visible parts of them on screen.
         self.visual_items = []
 
+        # The RawItems that are at least partially on screen
+        self.visible_items = []
+
         # List of full-width lines, containing the text of the items.
         # Only sublines of these lines are displayed both for performance
         # reasons and to bypass a bug in STC, failing to display extremely
@@ -672,6 +1379,7 @@ class Panel(stc.StyledTextCtrl):
 
         self.SetTextUTF8(self._extract_visible_sublines())
         self.visual_items = map(self._extract_visual_item, raw_items)
+        self.visible_items = [i for i in raw_items if i.visual_item]
         self.EmptyUndoBuffer()
         self.SetReadOnly(True)
         self._set_debug_whitespace()
@@ -702,13 +1410,18 @@ class Panel(stc.StyledTextCtrl):
         self.SetSelBackground(1, color_scheme['selection-inactive'])
         self.SetSelForeground(1, color_scheme['selection-fore'])
 
-    def highlight_search_matches(self, items, search_str):
+    def highlight_search_matches(self, items, search_str, search_index):
+        # search_index is the data.SearchIndex of items
         self.apply_default_styles(items)
-        search_str_lower = search_str.lower()
 
-        for i in items:
+        if search_str == u'':
+            return
+
+        for index in search_index.matches(search_str):
+            i = items[index]
+
             if i.visual_item:
-                match_offset = i.file_name.lower().find(search_str_lower)
+                match_offset = search_index.match_offset(index, search_str)
 
                 if match_offset != -1:
                     end_of_highlight = i.visual_item.vis_len_in_chars
@@ -844,10 +1557,54 @@ class Candy(wx.Frame):
         self.sizer.Add(self.status_line, 0, sizer_flags)
         self.SetSizer(self.sizer)
 
-        self.p1 = PanelController(Panel(self.splitter), 'm1.', 'c1.')
-        self.p2 = PanelController(Panel(self.splitter), 'm2.', 'c2.')
+        # Both panes share the cache, so going to a directory that is open
+        # in the other pane needs no reading
+        max_listings = int(general_config.get('listing-cache-dirs', 64))
+        max_megabytes = int(general_config.get('listing-cache-megabytes', 64))
+        self.listing_cache = data.ListingCache(max_listings,
+                                               max_megabytes * 1024 * 1024)
+
+        # Optional persistent index for flat views of huge trees
+        self.tree_index = None
+        index_file = general_config.get('tree-index-file', '').strip()
+
+        if index_file and tree_index.index_available():
+            index_file = os.path.expanduser(index_file)
+            self.tree_index = tree_index.open_index(index_file)
+
+        # Directory sizes and archive indices are shared too
+        self.size_cache = dir_sizes.SizeCache()
+        self.archive_cache = archives.ArchiveCache()
+
+        # Line indices of the files viewed, so that viewing one again
+        # needs no indexing
+        self.line_index_cache = line_index.LineIndexCache()
+
+        self.p1 = PanelController(Panel(self.splitter), 'm1.', 'c1.',
+                                  self.listing_cache, self.tree_index,
+                                  self.size_cache, self.archive_cache)
+        self.p2 = PanelController(Panel(self.splitter), 'm2.', 'c2.',
+                                  self.listing_cache, self.tree_index,
+                                  self.size_cache, self.archive_cache)
         self.splitter.SplitVertically(self.p1.view, self.p2.view)
 
+        # Copies, moves and deletes run in background, one after another.
+        # Each pane picks the changes up through its directory watcher,
+        # except for what a delete couldn't remove or an undo restored.
+        def on_job_progress(job):
+            wx.CallAfter(self._show_job_status, describe_job(job))
+
+        def on_job_done(job):
+            wx.CallAfter(self._on_file_job_done, job)
+
+        journal_file = general_config.get('trash-journal-file',
+                                          '~/.candy/trash-journal').strip()
+        self.trash_journal = trash.open_journal(
+            os.path.expanduser(journal_file))
+
+        self.file_jobs = file_ops.JobQueue(on_job_progress, on_job_done)
+        self.file_jobs.start()
+
         self.Bind(wx.EVT_SIZE, self.on_size)
         self.Bind(wx.EVT_SPLITTER_DCLICK, self.on_double_click, id=ID_SPLITTER)
         self.Bind(wx.EVT_SPLITTER_SASH_POS_CHANGED, self.on_sash_pos_changed,
@@ -858,6 +1615,14 @@ class Candy(wx.Frame):
         self.Center()
         self.set_active_pane(self.p1)
 
+    def _show_job_status(self, text):
+        self.status_bar.SetStatusText(text)
+
+    def _on_file_job_done(self, job):
+        self._show_job_status(describe_finished_job(job))
+        self.p1.file_job_done(job)
+        self.p2.file_job_done(job)
+
     def set_active_pane(self, pane):
         self.active_pane = pane
         pane.view.SetFocus()
@@ -0,0 +1,571 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Viewing compressed files (gzip, bzip2, xz) without decompressing them to
+# disk. A first pass in the background decompresses the whole file once,
+# keeping checkpoints to start decompressing from again, so that getting
+# to any part of the file later takes decompressing one block of it. bz2
+# and xz decompressors can't be copied, so the only checkpoints there are
+# at the starts of streams: what they decompress to is kept in a temporary
+# file instead, as going back would take decompressing it all over again.
+
+import os
+import bz2
+import zlib
+import bisect
+import tempfile
+import threading
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import paged_file
+
+
+# Decompressed bytes in a block, and so at most between two checkpoints
+# for formats that can have them anywhere (gzip)
+BLOCK_SIZE = 4 * 1024 * 1024
+
+MAX_CACHED_BLOCKS = 8
+
+READ_SIZE = 64 * 1024
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+
+def _gzip_decompressor():
+    # Expects (and skips) the gzip header
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+# Extension -> makes a decompressor for it
+DECOMPRESSORS = {
+    '.gz': _gzip_decompressor,
+    '.bz2': bz2.BZ2Decompressor,
+}
+
+# bz2 reports bad data with IOError
+DECOMPRESS_ERRORS = (zlib.error, IOError)
+
+if lzma is not None:
+    DECOMPRESSORS['.xz'] = lzma.LZMADecompressor
+    DECOMPRESS_ERRORS += (lzma.LZMAError,)
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+class Decoder(object):
+    """
+    Decompresses a file from a checkpoint on. A checkpoint is (out_offset,
+    in_offset, state): where in the decompressed and the compressed bytes
+    it is, and a decompressor that got that far, which is copied before
+    use (None at the start of a stream). Streams following each other (as
+    in concatenated .gz files) are decompressed one after another.
+    """
+    def __init__(self, f, new_decompressor, checkpoint):
+        self.file = f
+        self._new_decompressor = new_decompressor
+        self.out_offset, self.in_offset, state = checkpoint
+
+        # Read from in_offset on, not yet decompressed
+        self.pending = ''
+
+        # Decompressed already, but given back by unread()
+        self.unread_data = ''
+
+        # Whether the decompressor has not been given anything yet
+        self.stream_start = state is None
+
+        # Whether the stream has not given anything yet, and where it
+        # started, for telling garbage after the last stream
+        self.stream_empty = state is None
+        self.stream_in_offset = self.in_offset
+
+        if state is None:
+            self.decompressor = new_decompressor()
+        else:
+            self.decompressor = state.copy()
+
+    def checkpoint(self):
+        """
+        A checkpoint for where the decoder is, None if the decompressor
+        can't be copied (bz2 and xz ones can't).
+        """
+        if self.stream_start:
+            return self.out_offset, self.in_offset, None
+
+        if not hasattr(self.decompressor, 'copy'):
+            return None
+
+        return self.out_offset, self.in_offset, self.decompressor.copy()
+
+    def unread(self, data):
+        """Gives back the end of what was read, to be read again."""
+        self.unread_data = data + self.unread_data
+        self.out_offset -= len(data)
+
+    def _decompress(self, data, max_length):
+        """Returns the output, the input left over and if the stream ended."""
+        decompressor = self.decompressor
+
+        try:
+            # Only zlib can be told when to stop
+            if hasattr(decompressor, 'unconsumed_tail'):
+                out = decompressor.decompress(data, max_length)
+                rest = decompressor.unconsumed_tail
+            else:
+                out = decompressor.decompress(data)
+                rest = ''
+        except EOFError:
+            # The stream ended right where the input given before did
+            return '', data, True
+
+        if decompressor.unused_data:
+            return out, decompressor.unused_data, True
+
+        return out, rest, False
+
+    def read(self, max_length):
+        """
+        The next up to max_length decompressed bytes (more for formats that
+        can't be told when to stop, maybe none at the end of a stream),
+        None at the end of the file.
+        """
+        if self.unread_data:
+            out = self.unread_data[:max_length]
+            self.unread_data = self.unread_data[max_length:]
+            self.out_offset += len(out)
+            return out
+
+        while True:
+            if not self.pending:
+                self.file.seek(self.in_offset)
+                self.pending = self.file.read(READ_SIZE)
+
+            data = self.pending
+
+            try:
+                out, rest, ended = self._decompress(data, max_length)
+            except DECOMPRESS_ERRORS:
+                if self.stream_empty and self.stream_in_offset > 0:
+                    # Garbage after the last stream, gzip ignores it too
+                    return None
+
+                raise
+
+            self.in_offset += len(data) - len(rest)
+            self.pending = rest
+            self.out_offset += len(out)
+
+            if out:
+                self.stream_empty = False
+
+            if ended and rest:
+                self.decompressor = self._new_decompressor()
+                self.stream_start = True
+                self.stream_empty = True
+                self.stream_in_offset = self.in_offset
+                return out
+
+            if len(data) > len(rest):
+                self.stream_start = False
+
+            if out:
+                return out
+
+            if not data:
+                return None
+
+
+class CompressedData(object):
+    """
+    The decompressed bytes of a compressed file, as many of them as the
+    first pass has got through (size), to slice and search like a str. It's
+    made of blocks of BLOCK_SIZE bytes, the last MAX_CACHED_BLOCKS used of
+    which are kept.
+    """
+    def __init__(self, path, new_decompressor):
+        self.path = path
+        self._new_decompressor = new_decompressor
+        self.size = 0
+
+        # Set when the first pass is over, and to what went wrong if it
+        # didn't get to the end
+        self.done = False
+        self.error = None
+
+        # Sorted by out_offset, which are kept apart for bisecting
+        self.checkpoints = [(0, 0, None)]
+        self._checkpoint_offsets = [0]
+
+        # Block number -> its bytes
+        self._blocks = {}
+
+        # Block numbers, the least recently used first
+        self._lru = []
+        self._lock = threading.Lock()
+
+        # The decoder that decoded the last block not found in the cache,
+        # left at its end. Reading on from there beats going back to a
+        # checkpoint, which for bz2 and xz is mostly the start of the file.
+        self._decoder = None
+
+        # Temporary file the first pass writes the blocks to, for formats
+        # without checkpoints to speak of, and how many blocks are in it.
+        # The blocks are only decompressed again if it can't be written.
+        self._spill = None
+        self._num_spilled = 0
+        self._spill_lock = threading.Lock()
+
+        if not hasattr(new_decompressor(), 'copy'):
+            try:
+                self._spill = tempfile.TemporaryFile(prefix='candy-')
+            except (IOError, OSError):
+                pass
+
+        self._stopped = threading.Event()
+
+        # Opened here, so that a file that can't be is found out right away
+        f = open(path, 'rb')
+        self._thread = threading.Thread(target=self._first_pass, args=(f,))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self._keep_decoder(None)
+        self._drop_spill()
+
+    def _drop_spill(self):
+        self._spill_lock.acquire()
+
+        try:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+        finally:
+            self._spill_lock.release()
+
+    def _spill_block(self, number, block):
+        self._spill_lock.acquire()
+
+        try:
+            if self._spill is None:
+                return
+
+            try:
+                fd = self._spill.fileno()
+                os.lseek(fd, number * BLOCK_SIZE, 0)
+
+                while block:
+                    block = block[os.write(fd, block):]
+            except OSError:
+                # Out of space: decompressing it again will have to do
+                self._spill.close()
+                self._spill = None
+                return
+
+            self._num_spilled = number + 1
+        finally:
+            self._spill_lock.release()
+
+    def _spilled_block(self, number):
+        """The block as the first pass spilled it, None if it didn't."""
+        self._spill_lock.acquire()
+
+        try:
+            if self._spill is None or number >= self._num_spilled:
+                return None
+
+            fd = self._spill.fileno()
+            os.lseek(fd, number * BLOCK_SIZE, 0)
+            pieces = []
+            left = BLOCK_SIZE
+
+            while left > 0:
+                piece = os.read(fd, left)
+
+                if not piece:
+                    # The last block is shorter
+                    break
+
+                pieces.append(piece)
+                left -= len(piece)
+
+            return ''.join(pieces)
+        finally:
+            self._spill_lock.release()
+
+    def _add_checkpoint(self, checkpoint):
+        if checkpoint is None \
+           or checkpoint[0] == self._checkpoint_offsets[-1]:
+            return
+
+        # The checkpoint first: an offset means there's one for it
+        self.checkpoints.append(checkpoint)
+        self._checkpoint_offsets.append(checkpoint[0])
+
+    def _cache_block(self, number, block):
+        self._lock.acquire()
+
+        try:
+            if number in self._blocks:
+                self._lru.remove(number)
+
+            self._blocks[number] = block
+            self._lru.append(number)
+
+            while len(self._lru) > MAX_CACHED_BLOCKS:
+                del self._blocks[self._lru.pop(0)]
+        finally:
+            self._lock.release()
+
+    def _first_pass(self, f):
+        decoder = Decoder(f, self._new_decompressor, self.checkpoints[0])
+        pieces = []
+        num_pending = 0
+
+        try:
+            while not self._stopped.isSet():
+                if decoder.stream_start:
+                    self._add_checkpoint(decoder.checkpoint())
+
+                out = decoder.read(BLOCK_SIZE - num_pending)
+
+                if out is None:
+                    break
+
+                pieces.append(out)
+                num_pending += len(out)
+
+                while num_pending >= BLOCK_SIZE:
+                    pending = ''.join(pieces)
+                    number = (decoder.out_offset - num_pending) / BLOCK_SIZE
+                    self._spill_block(number, pending[:BLOCK_SIZE])
+                    self._cache_block(number, pending[:BLOCK_SIZE])
+                    pieces = [pending[BLOCK_SIZE:]]
+                    num_pending -= BLOCK_SIZE
+
+                if decoder.out_offset % BLOCK_SIZE == 0:
+                    self._add_checkpoint(decoder.checkpoint())
+
+                self.size = decoder.out_offset
+
+            if num_pending > 0 and not self._stopped.isSet():
+                number = self.size / BLOCK_SIZE
+                block = ''.join(pieces)
+                self._spill_block(number, block)
+                self._cache_block(number, block)
+        except DECOMPRESS_ERRORS, e:
+            self.error = e
+        finally:
+            f.close()
+            self.done = True
+
+    def _take_decoder(self, start):
+        """
+        The decoder left by the last block decoded, if it's at start or
+        before it, and after the checkpoint that would do otherwise.
+        """
+        i = bisect.bisect_right(self._checkpoint_offsets, start) - 1
+        self._lock.acquire()
+
+        try:
+            decoder = self._decoder
+
+            if decoder is not None \
+               and self._checkpoint_offsets[i] <= decoder.out_offset <= start:
+                self._decoder = None
+                return decoder
+        finally:
+            self._lock.release()
+
+        return Decoder(open(self.path, 'rb'), self._new_decompressor,
+                       self.checkpoints[i])
+
+    def _keep_decoder(self, decoder):
+        self._lock.acquire()
+
+        try:
+            old = self._decoder
+            self._decoder = decoder
+        finally:
+            self._lock.release()
+
+        if old is not None:
+            old.file.close()
+
+    def _decode_block(self, number):
+        start = number * BLOCK_SIZE
+        end = start + BLOCK_SIZE
+        decoder = self._take_decoder(start)
+        pos = decoder.out_offset
+        pieces = []
+
+        try:
+            while pos < end:
+                # Up to the start of the block first, then up to its end
+                if pos < start:
+                    out = decoder.read(start - pos)
+                else:
+                    out = decoder.read(end - pos)
+
+                if out is None:
+                    break
+
+                if pos + len(out) > end:
+                    # So that the decoder is left right at the end
+                    decoder.unread(out[end - pos:])
+                    out = out[:end - pos]
+
+                pieces.append(out[max(start - pos, 0):])
+                pos += len(out)
+        except:
+            decoder.file.close()
+            raise
+
+        self._keep_decoder(decoder)
+        return ''.join(pieces)
+
+    def _block(self, number):
+        self._lock.acquire()
+
+        try:
+            block = self._blocks.get(number)
+
+            if block is not None:
+                self._lru.remove(number)
+                self._lru.append(number)
+                return block
+        finally:
+            self._lock.release()
+
+        block = self._spilled_block(number)
+
+        if block is None:
+            block = self._decode_block(number)
+
+        self._cache_block(number, block)
+        return block
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(self.size)
+        pieces = []
+
+        while start < stop:
+            number = start / BLOCK_SIZE
+            block_start = number * BLOCK_SIZE
+            block = self._block(number)
+            pieces.append(block[start - block_start:stop - block_start])
+            start = block_start + BLOCK_SIZE
+
+        return ''.join(pieces)
+
+    def find(self, sub, start=0, end=None):
+        if end is None or end > self.size:
+            end = self.size
+
+        while start < end:
+            chunk_end = min(start + BLOCK_SIZE + len(sub) - 1, end)
+            found = self[start:chunk_end].find(sub)
+
+            if found != -1:
+                return start + found
+
+            start += BLOCK_SIZE
+
+        return -1
+
+    def rfind(self, sub, start=0, end=None):
+        if end is None or end > self.size:
+            end = self.size
+
+        stop = end
+
+        while stop > start:
+            chunk_start = max(stop - BLOCK_SIZE, start)
+            chunk_end = min(stop + len(sub) - 1, end)
+            found = self[chunk_start:chunk_end].rfind(sub)
+
+            if found != -1:
+                return chunk_start + found
+
+            stop = chunk_start
+
+        return -1
+
+
+class CompressedFile(paged_file.PagedFile):
+    """
+    A compressed file seen as lines of what's in it. It gets longer as the
+    first pass decompresses it (see refresh()).
+    """
+    def __init__(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        new_decompressor = DECOMPRESSORS.get(extension)
+
+        if new_decompressor is None:
+            raise IOError('Viewing %s files needs the lzma module'
+                          % extension)
+
+        st = os.stat(path)
+        self.path = path
+        self.mtime = st.st_mtime
+        self.error = None
+        self._stamp = (st.st_size, st.st_mtime)
+        self.data = CompressedData(path, new_decompressor)
+        self.size = 0
+
+    def close(self):
+        self.data.close()
+
+    def stamp(self):
+        return self._stamp
+
+    def is_loading(self):
+        return not self.data.done
+
+    def needs_refresh(self):
+        # What's decompressed is not mapped, only its growing is to be seen
+        return self.is_loading()
+
+    def set_following(self, following):
+        # Nothing gets truncated under what's been decompressed
+        pass
+
+    def refresh(self):
+        """GREW when more of the file got decompressed, otherwise None."""
+        self.error = self.data.error
+        size = self.data.size
+
+        if size == self.size:
+            return None
+
+        self.size = size
+        return paged_file.GREW
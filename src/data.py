@@ -19,7 +19,17 @@
 #
 
 import os
+import re
+import sys
+import stat
+import time
+import Queue
+import bisect
+import fnmatch
+import operator
 import platform
+import itertools
+import threading
 
 import wx.stc as stc    # TODO: this module should not include it!
 import wx.lib.pubsub as pubsub
@@ -32,47 +42,570 @@ if platform.system() == 'Windows':
         print 'Tisk tisk tisk...'
 
 import util
+import fuzzy
+import archives
+import name_filter
 from constants import *
 
 
+# Prefer os.scandir (or the scandir backport on older Pythons): it hands out
+# the entry type straight from the dirent, saving a stat() per listed file.
+# Without it, directories get listed the way they always were.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def _iter_dir(cwd):
+    """
+    Yields (file_name, full_path, is_dir, is_link) for every entry in cwd.
+    is_dir follows symlinks, just like os.path.isdir() does. Without
+    scandir, is_link is only found out for directories, as os.walk does.
+    """
+    if scandir is not None:
+        for entry in scandir(cwd):
+            # Neither of these needs a stat() unless the entry is a symlink
+            # or the filesystem doesn't fill in d_type
+            yield entry.name, entry.path, entry.is_dir(), entry.is_symlink()
+        return
+
+    for file_name in os.listdir(cwd):
+        full_path = os.path.join(cwd, file_name)
+        is_dir = os.path.isdir(full_path)
+
+        # For walks not to descend into symlinked directories
+        is_link = is_dir and os.path.islink(full_path)
+        yield file_name, full_path, is_dir, is_link
+
+
+def iter_dir_entries(cwd):
+    """
+    Lists a single directory in one pass. Yields
+    (file_name, path, is_dir, is_link) tuples, where path is cwd.
+    """
+    if scandir is None:
+        # The listing as it was before scandir, which doesn't tell links
+        for file_name in os.listdir(cwd):
+            is_dir = os.path.isdir(os.path.join(cwd, file_name))
+            yield file_name, cwd, is_dir, False
+        return
+
+    for file_name, full_path, is_dir, is_link in _iter_dir(cwd):
+        yield file_name, cwd, is_dir, is_link
+
+
+def list_dir_entries(cwd):
+    return list(iter_dir_entries(cwd))
+
+
 # Obviously excludes subdirectories
+def iter_recursive_dir(cwd):
+    dirs_to_visit = [cwd]
+
+    while dirs_to_visit:
+        root = dirs_to_visit.pop()
+
+        try:
+            entries = list(_iter_dir(root))
+        except OSError:
+            # Same as os.walk: silently skip what we can't read
+            continue
+
+        for file_name, full_path, is_dir, is_link in entries:
+            # Same as os.walk: don't descend into symlinked directories, and
+            # don't list them as files either
+            if not is_dir:
+                yield file_name, root, False, is_link
+            elif not is_link:
+                dirs_to_visit.append(full_path)
+
+
 def recursive_list_dir(cwd):
-    all_files = []
+    return list(iter_recursive_dir(cwd))
 
-    for root, dirs, files in os.walk(cwd):
-        all_files.extend(util.list_of_tuples(files, root))
 
-    return all_files
+class WalkSettings(object):
+    """
+    Limits for walking a directory tree. max_depth is how many levels below
+    the top directory to descend (0 lists the top directory alone), None
+    means no limit. The same goes for max_entries. Directories and files
+    whose names match any of the exclude glob patterns are skipped.
+    """
+    def __init__(self, max_depth=None, max_entries=None, exclude=(),
+                 num_threads=4):
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.exclude = list(exclude)
+        self.num_threads = num_threads
 
+    def exclude_matcher(self):
+        if not self.exclude:
+            return None
 
-def list_files(is_flat_directory_view, cwd):
-    files = []
+        patterns = [fnmatch.translate(p) for p in self.exclude]
+        return re.compile('|'.join(patterns)).match
+
+
+class ParallelWalker(object):
+    """
+    Yields the same entries iter_recursive_dir does, but reads several
+    directories at once on a pool of threads, so that the latencies of
+    slow disks and network mounts overlap. The entries come in no
+    particular order. cancel() stops the walk; it also stops by itself when
+    the iteration is abandoned.
+    """
+    def __init__(self, root, settings):
+        self.root = root
+        self.settings = settings
+
+        # Set when max_entries cut the walk short
+        self.truncated = False
+
+        self._excluded = settings.exclude_matcher()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._num_pending_dirs = 0
+        self._num_workers = max(settings.num_threads, 1)
+        self._dirs = None
+
+    def cancel(self):
+        if not self._cancelled.isSet():
+            self._cancelled.set()
+            self._stop_workers()
+
+    def _stop_workers(self):
+        if self._dirs is not None:
+            for i in range(self._num_workers):
+                self._dirs.put(None)
+
+    def _add_dir(self, dirs, path, depth):
+        self._lock.acquire()
+        self._num_pending_dirs += 1
+        self._lock.release()
+        dirs.put((path, depth))
+
+    def _dir_done(self, results):
+        self._lock.acquire()
+        self._num_pending_dirs -= 1
+        finished = self._num_pending_dirs == 0
+        self._lock.release()
+
+        if finished:
+            self._stop_workers()
+            results.put(None)
+
+    def _read_dir(self, dirs, root, depth):
+        files = []
+        max_depth = self.settings.max_depth
+        descend = max_depth is None or depth < max_depth
+
+        for file_name, full_path, is_dir, is_link in _iter_dir(root):
+            if self._cancelled.isSet():
+                break
+
+            if self._excluded and self._excluded(file_name):
+                continue
+
+            # Same rules as in iter_recursive_dir
+            if not is_dir:
+                files.append((file_name, root, False, is_link))
+            elif not is_link and descend:
+                self._add_dir(dirs, full_path, depth + 1)
+
+        return files
+
+    def _work(self, dirs, results):
+        while True:
+            next_dir = dirs.get()
+
+            # None is put there for each of the workers to quit
+            if next_dir is None or self._cancelled.isSet():
+                return
+
+            root, depth = next_dir
+
+            try:
+                files = self._read_dir(dirs, root, depth)
 
+                if files:
+                    results.put(files)
+            except OSError:
+                # Same as os.walk: silently skip what we can't read
+                pass
+            except Exception:
+                # Anything else gets raised where the walk is iterated. It
+                # goes in before the end of the walk does, see _dir_done.
+                results.put(sys.exc_info())
+            finally:
+                # Otherwise the walk would be waited for forever
+                self._dir_done(results)
+
+    def __iter__(self):
+        if self._cancelled.isSet():
+            return
+
+        dirs = Queue.Queue()
+        results = Queue.Queue()
+        self._add_dir(dirs, self.root, 0)
+        self._dirs = dirs
+
+        for i in range(self._num_workers):
+            worker = threading.Thread(target=self._work, args=(dirs, results))
+            worker.setDaemon(True)
+            worker.start()
+
+        max_entries = self.settings.max_entries
+        num_entries = 0
+
+        try:
+            while not self._cancelled.isSet():
+                try:
+                    files = results.get(True, 0.1)
+                except Queue.Empty:
+                    continue
+
+                if files is None:
+                    return
+
+                if isinstance(files, tuple):
+                    # What failed a worker
+                    raise files[0], files[1], files[2]
+
+                for entry in files:
+                    if max_entries is not None and num_entries >= max_entries:
+                        self.truncated = True
+                        return
+
+                    num_entries += 1
+                    yield entry
+        finally:
+            self.cancel()
+
+
+def list_files(is_flat_directory_view, cwd):
+    # Entries are produced lazily, so that DirectoryScanner can hand them
+    # over in batches while the rest of the directory is still being read.
+    # Anything iterable will do here, e.g. the fake listers return lists.
     if is_flat_directory_view:
-        files = recursive_list_dir(cwd)
+        return iter_recursive_dir(cwd)
+
+    return iter_dir_entries(cwd)
+
+
+def stat_entry(file_name, path):
+    """
+    Makes the same entry tuple list_files would for a single file_name in
+    path. Returns None if it does not exist.
+    """
+    full_path = os.path.join(path, file_name)
+
+    try:
+        is_link = stat.S_ISLNK(os.lstat(full_path).st_mode)
+    except OSError:
+        return None
+
+    return (file_name, path, os.path.isdir(full_path), is_link)
+
+
+def make_raw_item(entry):
+    # Entries listed inside archives come with their archives.MemberStat,
+    # there being nothing to stat
+    if len(entry) == 4:
+        file_name, path, is_dir, is_link = entry
+        stat_result = None
     else:
-        files = util.list_of_tuples(os.listdir(cwd), cwd)
+        file_name, path, is_dir, is_link, stat_result = entry
 
-    return files
+    item = RawItem(file_name, path)
+    item.stat_result = stat_result
+
+    if is_dir:
+        item.style = STYLE_FOLDER
+        item.is_dir = True
+
+    if is_link:
+        item.is_link = True
+
+    if item.file_name.startswith(u'.'):
+        item.is_hidden = True
+
+    return item
 
 
 def collect_list_info(is_flat_directory_view, cwd):
-    items = []
     files = list_files(is_flat_directory_view, cwd)
+    return map(make_raw_item, files)
 
-    for file_name, path in files:
-        item = RawItem(file_name, path)
 
-        if os.path.isdir(item.file_name):
-            item.style = STYLE_FOLDER
-            item.is_dir = True
+def dir_stamp(path):
+    """
+    Returns what tells whether the list of entries of a directory might have
+    changed, or None if the directory can't be stat'ed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
 
-        if item.file_name.startswith(u'.'):
-            item.is_hidden = True
+    return (st.st_mtime, st.st_ctime)
 
-        items.append(item)
 
-    return items
+class ListingCache(object):
+    """
+    A bounded LRU cache of directory listings (the tuples list_files
+    produces), keyed by absolute path. A listing is only handed out while the
+    directory's mtime and ctime are the same as they were when it was read.
+    Meant to be shared between panes; the listings are put there from the
+    scanner threads, hence the lock.
+    """
+
+    # Rough size of an entry tuple with its strings, not counting the name
+    ENTRY_OVERHEAD = 160
+
+    # Listings of directories modified less than this many seconds before
+    # reading them are not cached: on filesystems with coarse timestamps
+    # another change could sneak in without altering the mtime.
+    RACY_SECONDS = 2
+
+    def __init__(self, max_listings=64, max_bytes=64 * 1024 * 1024):
+        self.max_listings = max_listings
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.num_bytes = 0
+
+        # path -> (stamp, entries, estimated size in bytes)
+        self._listings = {}
+
+        # Paths, the least recently used first
+        self._lru = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._listings)
+
+    def _estimate_size(self, entries):
+        size = 0
+
+        for entry in entries:
+            size += self.ENTRY_OVERHEAD + 2 * len(entry[0])
+
+        return size
+
+    def _touch(self, path):
+        self._lru.remove(path)
+        self._lru.append(path)
+
+    def _drop(self, path):
+        stamp, entries, size = self._listings.pop(path)
+        self._lru.remove(path)
+        self.num_bytes -= size
+
+    def get(self, path, stamp):
+        """Returns the cached entries of path, or None."""
+        path = os.path.abspath(path)
+        self._lock.acquire()
+
+        try:
+            cached = self._listings.get(path)
+
+            if cached is None or stamp is None or cached[0] != stamp:
+                if cached is not None:
+                    self._drop(path)
+
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._touch(path)
+            return cached[1]
+        finally:
+            self._lock.release()
+
+    def put(self, path, stamp, entries):
+        if stamp is None or time.time() - stamp[0] < self.RACY_SECONDS:
+            return
+
+        path = os.path.abspath(path)
+        size = self._estimate_size(entries)
+
+        if size > self.max_bytes:
+            return
+
+        self._lock.acquire()
+
+        try:
+            if path in self._listings:
+                self._drop(path)
+
+            self._listings[path] = (stamp, entries, size)
+            self._lru.append(path)
+            self.num_bytes += size
+
+            while len(self._lru) > self.max_listings \
+                  or self.num_bytes > self.max_bytes:
+                self._drop(self._lru[0])
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def invalidate(self, path):
+        path = os.path.abspath(path)
+        self._lock.acquire()
+
+        try:
+            if path in self._listings:
+                self._drop(path)
+        finally:
+            self._lock.release()
+
+    def record(self, path, stamp, entries):
+        """
+        Passes the entries through, putting all of them in the cache once
+        they have been consumed. If they never are (e.g. the scan gets
+        cancelled), nothing is cached.
+        """
+        recorded = []
+
+        for entry in entries:
+            recorded.append(entry)
+            yield entry
+
+        self.put(path, stamp, recorded)
+
+
+class DirectoryScanner(threading.Thread):
+    """
+    Reads directory entries on a worker thread and hands them over as lists
+    of RawItems in growing batches. The batches are passed to on_batch(scanner,
+    items, done), which gets called on the worker thread, so it is up to the
+    caller to move them over to the UI thread (e.g. with wx.CallAfter).
+    """
+    def __init__(self, entries, on_batch, batch_size=1024,
+                 max_batch_size=16384):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self._source = entries
+        self._entries = iter(entries)
+        self._on_batch = on_batch
+        self._cancelled = threading.Event()
+
+        # Every batch makes the listing to be displayed again, so the
+        # batches keep doubling in size to keep that work in check
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+
+    def cancel(self):
+        self._cancelled.set()
+
+        # Stop the source as well (e.g. a ParallelWalker), in case it's
+        # blocked waiting for more entries
+        if hasattr(self._source, 'cancel'):
+            self._source.cancel()
+
+    def is_cancelled(self):
+        return self._cancelled.isSet()
+
+    def read_batch(self, size):
+        """
+        Reads up to size items on the calling thread. Returns the items and
+        whether all of the entries have been read.
+        """
+        items = []
+
+        for entry in itertools.islice(self._entries, size):
+            if self.is_cancelled():
+                return items, True
+
+            items.append(make_raw_item(entry))
+
+        return items, len(items) < size
+
+    def run(self):
+        done = False
+
+        while not done:
+            try:
+                items, done = self.read_batch(self.batch_size)
+            except Exception:
+                # Whatever went wrong, the scan has to end, or the listing
+                # would be shown as still being read forever. What has been
+                # read so far stays.
+                items, done = [], True
+
+            if self.is_cancelled():
+                return
+
+            self._on_batch(self, items, done)
+            self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+
+
+class MetadataLoader(threading.Thread):
+    """
+    Stats RawItems on a worker thread, e.g. the ones on screen, so that
+    their size, mtime and mode are at hand once asked for. Only the latest
+    request is served: items scrolled out of view in the meantime are not
+    worth the trouble. If given, on_loaded(items) is called on the worker
+    thread once the items of a request are all stat'ed.
+    """
+    def __init__(self, on_loaded=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self._on_loaded = on_loaded
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._pending = None
+
+    def request(self, items):
+        self._lock.acquire()
+
+        try:
+            self._pending = items
+        finally:
+            self._lock.release()
+
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _take_pending(self):
+        self._lock.acquire()
+
+        try:
+            items = self._pending
+            self._pending = None
+            self._wakeup.clear()
+        finally:
+            self._lock.release()
+
+        return items
+
+    def run(self):
+        while not self._stopped.isSet():
+            self._wakeup.wait()
+            items = self._take_pending()
+
+            if items is None:
+                continue
+
+            for item in items:
+                # Give up on it if a newer request came in
+                if self._wakeup.isSet():
+                    break
+
+                item.load_stat()
+            else:
+                if self._on_loaded is not None and not self._stopped.isSet():
+                    self._on_loaded(items)
 
 
 def collect_drive_letters():
@@ -92,34 +625,257 @@ def collect_drive_letters():
     return items
 
 
-def construct_list_for_filling(full_list, special_filter):
-    dir_list = filter(lambda(f): f.is_dir, full_list)
-    dir_list.sort()
+SORT_BY_NAME = 'name'
+SORT_NATURAL = 'natural'
+SORT_BY_EXTENSION = 'extension'
+SORT_BY_SIZE = 'size'
+SORT_BY_MTIME = 'mtime'
+
+# In the order they are cycled through
+SORT_MODES = (SORT_BY_NAME, SORT_NATURAL, SORT_BY_EXTENSION, SORT_BY_SIZE,
+              SORT_BY_MTIME)
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def natural_sort_key(item):
+    # 'file9' goes before 'file10'. The key alternates strings and numbers,
+    # so only the same types ever get compared.
+    key = item.natural_key
+
+    if key is None:
+        parts = _DIGITS.split(item.file_name.lower())
+        parts[1::2] = map(int, parts[1::2])
+        key = item.natural_key = tuple(parts)
+
+    return key
+
+
+def extension_sort_key(item):
+    key = item.extension_key
+
+    if key is None:
+        key = os.path.splitext(item.file_name)[1].lower()
+        item.extension_key = key
+
+    return key
+
+
+def size_sort_key(item):
+    # Directories go by the size of their trees. The ones not computed yet
+    # all tie (and stay sorted by name, see sort_items).
+    if item.is_dir:
+        if item.tree_size is None:
+            return -1
+
+        return item.tree_size
+
+    return item.size
+
+
+def mtime_sort_key(item):
+    return item.mtime
+
+
+SORT_KEYS = {
+    SORT_BY_NAME: operator.attrgetter('file_name'),
+    SORT_NATURAL: natural_sort_key,
+    SORT_BY_EXTENSION: extension_sort_key,
+    SORT_BY_SIZE: size_sort_key,
+    SORT_BY_MTIME: mtime_sort_key,
+}
+
+
+def sort_items(items, sort_mode):
+    """
+    Returns a copy of items sorted by sort_mode. The sort is stable, so
+    when items are sorted by name already, equal keys keep it that way.
+    Keys that take work to compute are cached on the items, size and mtime
+    come from their stat.
+    """
+    items = list(items)
+    items.sort(key=SORT_KEYS[sort_mode])
+    return items
+
+
+def merge_key(sort_mode):
+    """
+    Key that orders items the way sort_items does once they're sorted by
+    name: by sort_mode, then by name.
+    """
+    key = SORT_KEYS[sort_mode]
+
+    if sort_mode == SORT_BY_NAME:
+        return key
+
+    return lambda item: (key(item), item.file_name)
+
+
+def merge_items(items, keys, new_items, key):
+    """
+    Merges new_items into items, which are sorted, keys being their keys.
+    Returns the merged items and their keys, in the order a stable sort of
+    items + new_items would put them. Only the new items get their keys
+    computed and looked up, the rest is copied over in slices.
+    """
+    new_keys = map(key, new_items)
+    order = range(len(new_items))
+    order.sort(key=new_keys.__getitem__)
+    merged = []
+    merged_keys = []
+    start = 0
 
-    file_list = filter(lambda(f): not f.is_dir, full_list)
-    file_list.sort()
+    # The new items land about step apart, so the place of each is looked
+    # for a step at a time from the last one, rather than in all of keys
+    num_keys = len(keys)
+    step = num_keys / max(len(new_items), 1) + 1
 
-    not_hidden = filter(lambda(f): not f.is_hidden, dir_list + file_list)
+    for i in order:
+        new_key = new_keys[i]
+        low = start
+        high = start + step
 
+        while high < num_keys and keys[high] <= new_key:
+            low = high
+            high += step
+
+        end = bisect.bisect_right(keys, new_key, low, min(high, num_keys))
+        merged.extend(items[start:end])
+        merged_keys.extend(keys[start:end])
+        merged.append(new_items[i])
+        merged_keys.append(new_key)
+        start = end
+
+    merged.extend(items[start:])
+    merged_keys.extend(keys[start:])
+    return merged, merged_keys
+
+
+def partition_items(full_list, special_filter=None):
+    """
+    Splits the items to display out of full_list into directories and files,
+    keeping their order. Hidden and filtered out items are dropped.
+    """
+    dir_list = []
+    file_list = []
+
+    if special_filter is not None:
+        full_list = special_filter.select(full_list)
+
+    for item in full_list:
+        if item.is_hidden:
+            continue
+
+        if item.is_dir:
+            dir_list.append(item)
+        else:
+            file_list.append(item)
+
+    return dir_list, file_list
+
+
+def join_listing(dir_list, file_list, special_filter):
     dot_dot = RawItem(u'..', u'.')
     dot_dot.style = STYLE_FOLDER
     dot_dot.is_dir = True
     dot_dot.is_hidden = False
-    dot_dot.visiblePartLength = len(dot_dot.file_name)
-    not_hidden.insert(0, dot_dot)
 
-    if special_filter is not None:
-        return filter(special_filter, not_hidden)
-    else:
-        return not_hidden
+    items = []
+
+    if special_filter is None or special_filter(dot_dot):
+        items.append(dot_dot)
+
+    items.extend(dir_list)
+    items.extend(file_list)
+    return items
+
+
+def construct_list_for_filling(full_list, special_filter,
+                               sort_mode=SORT_BY_NAME):
+    """
+    Returns the items to display out of full_list: '..' first, then the
+    directories, then the files, each sorted by sort_mode.
+    """
+    # Hidden and filtered out items are dropped while partitioning, so that
+    # the sorting only deals with what is going to be displayed
+    dir_list, file_list = partition_items(full_list, special_filter)
+    key = SORT_KEYS[sort_mode]
+    dir_list.sort(key=key)
+    file_list.sort(key=key)
+    return join_listing(dir_list, file_list, special_filter)
+
+
+class SearchIndex(object):
+    """
+    Lowercased names of a listing, built once for the incremental search.
+    Keeps the matches for each search string typed so far: when the string
+    grows, only the previous matches get tested, and when it shrinks (e.g.
+    on backspace), the earlier results are reused.
+    """
+    def __init__(self, items):
+        self.items = items
+        self.lower_names = [i.file_name.lower() for i in items]
+
+        # (lowercased search string, sorted indices of matching items), each
+        # string being a prefix of the next one
+        self._history = []
+
+    def matches(self, search_str):
+        search_str = search_str.lower()
+        history = self._history
+
+        while history and not search_str.startswith(history[-1][0]):
+            history.pop()
+
+        if history and history[-1][0] == search_str:
+            return history[-1][1]
+
+        if history:
+            candidates = history[-1][1]
+        else:
+            candidates = xrange(len(self.lower_names))
+
+        names = self.lower_names
+        matches = [i for i in candidates if search_str in names[i]]
+        history.append((search_str, matches))
+        return matches
+
+    def match_offset(self, index, search_str):
+        return self.lower_names[index].find(search_str.lower())
+
+    def next_match(self, search_str, init_pos):
+        """
+        Returns the index of the first match at or after init_pos, wrapping
+        around. None if there are no matches.
+        """
+        matches = self.matches(search_str)
+
+        if not matches:
+            return None
+
+        pos = bisect.bisect_left(matches, init_pos)
+
+        if pos == len(matches):
+            return matches[0]
+
+        return matches[pos]
 
 
 class DirectoryViewFilter(object):
-    def __init__(self, search_str):
-        self.search_str = search_str.lower()
+    """
+    Filters items by a name_filter expression, e.g. '*.py !test_*'. Raises
+    name_filter.FilterError if the expression is malformed.
+    """
+    def __init__(self, expression):
+        self.name_filter = name_filter.NameFilter(expression)
 
     def __call__(self, item):
-        return self.search_str in item.file_name.lower()
+        return self.name_filter.matches(item.file_name)
+
+    def select(self, items):
+        """Returns the items that pass, evaluating all of them at once."""
+        names = [item.file_name for item in items]
+        return [items[i] for i in self.name_filter.select(names)]
 
 
 class RawItem(object):
@@ -129,12 +885,21 @@ class RawItem(object):
     file_name, path, attributes, etc. Number of these objects is the number of
     the real objects external to our app, e.g. len (os.listdir ()).
     """
+
+    # There can be millions of these in a flat view, so no __dict__ for them:
+    # that cuts the per-item memory several times (see bench/bench_memory.py)
+    __slots__ = ('file_name', 'path', 'style', 'is_dir', 'is_hidden',
+                 'is_link', 'visual_item', 'visible_part', 'coords',
+                 'start_char_on_line', 'start_byte_on_line', 'stat_result',
+                 'natural_key', 'extension_key', 'tree_size')
+
     def __init__(self, file_name, path):
         self.file_name = file_name
         self.path = path
         self.style = stc.STC_STYLE_DEFAULT
         self.is_dir = False
         self.is_hidden = False
+        self.is_link = False
         self.visual_item = None
         self.visible_part = ''
 
@@ -144,6 +909,65 @@ class RawItem(object):
         self.start_char_on_line = 0
         self.start_byte_on_line = 0
 
+        # os.stat() of the item, taken on the first access to size, mtime or
+        # mode (or by a MetadataLoader). False if it could not be taken.
+        # Reading the directory again makes new items, so a refresh starts
+        # over with fresh metadata.
+        self.stat_result = None
+
+        # Sort keys, computed on the first sort that needs them
+        self.natural_key = None
+        self.extension_key = None
+
+        # For directories: size of everything under it, once computed (see
+        # dir_sizes)
+        self.tree_size = None
+
+    def load_stat(self):
+        """Returns the stat of the item, taking it if it's not known yet."""
+        if self.stat_result is None:
+            full_path = os.path.join(self.path, self.file_name)
+
+            try:
+                self.stat_result = os.stat(full_path)
+            except OSError:
+                try:
+                    # A dangling symlink still has a stat of its own
+                    self.stat_result = os.lstat(full_path)
+                except OSError:
+                    self.stat_result = False
+
+        return self.stat_result
+
+    def _get_size(self):
+        st = self.load_stat()
+
+        if st:
+            return st.st_size
+
+        return None
+
+    def _get_mtime(self):
+        st = self.load_stat()
+
+        if st:
+            return st.st_mtime
+
+        return None
+
+    def _get_mode(self):
+        st = self.load_stat()
+
+        if st:
+            return st.st_mode
+
+        return None
+
+    # None if the item could not be stat'ed (e.g. it's gone)
+    size = property(_get_size)
+    mtime = property(_get_mtime)
+    mode = property(_get_mode)
+
     def __eq__(self, file_name):
         return self.file_name == file_name
 
@@ -155,7 +979,7 @@ class RawItem(object):
 
 
 class PanelModel(object):
-    def __init__(self, msgSign):
+    def __init__(self, msgSign, listing_cache=None):
         # Working directory of the pane
         self.working_dir = os.path.expanduser(u'~')
 
@@ -176,6 +1000,95 @@ class PanelModel(object):
         # has sent it
         self.message_signature = msgSign
 
+        # DirectoryScanner that is still reading the working directory in
+        # background, None if there's none
+        self._scanner = None
+
+        # The whole listing of the working directory (or as much of it as
+        # the scanner has read so far), before sorting and filtering
+        self._raw_items = []
+
+        # Changes to the working directory that came in while it was still
+        # being scanned. Applied once the scan is done.
+        self._pending_changes = []
+
+        # Name of the item to keep selected while the scanner is still
+        # listing (the directory updir() came from), and whether it has
+        # been listed yet
+        self._name_to_select = None
+        self._name_to_select_listed = False
+
+        # ListingCache to look directories up in before reading them. May be
+        # shared with other models. None disables caching.
+        self.listing_cache = listing_cache
+
+        # Limits for the flat view
+        self.walk_settings = WalkSettings()
+
+        # SearchIndex of self.items, built on the first search
+        self._search_index = None
+
+        # One of SORT_MODES, and whether to sort the other way around
+        self.sort_mode = SORT_BY_NAME
+        self.sort_reverse = False
+
+        # Sort mode -> (directories, files, keys) of self._raw_items sorted
+        # by it, hidden ones left out. keys are the merge_key()s of both,
+        # None until the scanner adds to them. Only sorted once per mode, so
+        # that switching back and forth doesn't sort again. Emptied whenever
+        # self._raw_items change, other than by getting scanned ones added.
+        self._sorted_raw_items = {}
+
+        # Name -> index and (path, name) -> index maps of self.items, built
+        # on the first lookup
+        self._name_index = None
+        self._path_index = None
+
+        # tree_index.TreeIndex to take flat views of the indexed trees from.
+        # None to always walk the tree.
+        self.tree_index = None
+
+        # archives.ArchiveCache to keep the indices of the archives browsed
+        # in. None reads an archive again for each directory listed in it.
+        self.archive_cache = None
+
+        # While a fuzzy search is going on: the items as they were before
+        # it started, the fuzzy.FuzzyIndex of their names and the current
+        # fuzzy.FuzzySearch. self.items then holds the matches, best first.
+        self._fuzzy_base = None
+        self._fuzzy_index = None
+        self._fuzzy_search = None
+
+    def in_archive(self):
+        return archives.split_archive_path(self.working_dir) is not None
+
+    def _list_files(self, cwd):
+        if archives.split_archive_path(cwd) is not None:
+            if self.flat_directory_view:
+                return archives.walk(cwd, self.archive_cache)
+
+            return archives.list_dir(cwd, self.archive_cache)
+
+        # Flat views are never cached: the mtime of the top directory tells
+        # nothing about the changes further down the tree
+        if self.flat_directory_view:
+            if self.tree_index is not None and self.tree_index.covers(cwd):
+                return self.tree_index.walk(cwd, self.walk_settings)
+
+            return ParallelWalker(cwd, self.walk_settings)
+
+        if self.listing_cache is None:
+            return list_files(self.flat_directory_view, cwd)
+
+        stamp = dir_stamp(cwd)
+        entries = self.listing_cache.get(cwd, stamp)
+
+        if entries is not None:
+            return entries
+
+        entries = list_files(self.flat_directory_view, cwd)
+        return self.listing_cache.record(cwd, stamp, entries)
+
     def _change_working_dir(self, newWorkingDir):
         self.working_dir = newWorkingDir
         message = self.message_signature + 'WORKDIR CHANGED'
@@ -195,50 +1108,449 @@ class PanelModel(object):
 
     def set_items(self, items):
         self.items = items
+        self._search_index = None
+        self._name_index = None
+        self._path_index = None
         message = self.message_signature + 'NEW ITEMS'
         pubsub.Publisher().sendMessage(message, self.items)
 
-    def _get_index_by_item(self, item):
-        try:
-            return self.items.index(item)
-        except ValueError:
+    def _build_index(self, keys):
+        # Built backwards, so that the first of the items with the same key
+        # (as names repeat in flat view) wins, same as with list.index
+        num_items = len(keys)
+        keys.reverse()
+        return dict(itertools.izip(keys, xrange(num_items - 1, -1, -1)))
+
+    def index_of_name(self, file_name):
+        """
+        Returns the index of the first item named file_name, None if there
+        is none.
+        """
+        if self._name_index is None:
+            names = [item.file_name for item in self.items]
+            self._name_index = self._build_index(names)
+
+        return self._name_index.get(file_name)
+
+    def index_of_path(self, path, file_name):
+        """
+        Returns the index of the item named file_name in the directory path,
+        None if there is none.
+        """
+        if self._path_index is None:
+            keys = [(item.path, item.file_name) for item in self.items]
+            self._path_index = self._build_index(keys)
+
+        return self._path_index.get((path, file_name))
+
+    def is_scanning(self):
+        return self._scanner is not None
+
+    def cancel_scan(self):
+        if self._scanner is not None:
+            self._scanner.cancel()
+            self._scanner = None
+
+        self._pending_changes = []
+        self._name_to_select = None
+        self._name_to_select_listed = False
+
+    def listed_selection(self):
+        """
+        Returns the index of the item updir() wants selected, None if the
+        scanner hasn't listed it yet or there's none. It's to be asked for
+        on every 'NEW ITEMS' until the scan is done: the batches are merged
+        into the sorted listing, and can move it.
+        """
+        name = self._name_to_select
+
+        if name is None:
+            return None
+
+        index = None
+
+        if self._name_to_select_listed:
+            index = self.index_of_name(name)
+
+        # The scan is done, the last batch can't move it any more
+        if not self.is_scanning():
+            self._name_to_select = None
+            self._name_to_select_listed = False
+
+        return index
+
+    def _select_when_listed(self, file_name):
+        # Index of file_name if it's listed already. If the listing is still
+        # being read, it's kept track of (see listed_selection).
+        index = self.index_of_name(file_name)
+
+        if self.is_scanning():
+            self._name_to_select = file_name
+            self._name_to_select_listed = index is not None
+
+        if index is None:
             return 0
 
+        return index
+
     def fill_list_by_working_dir(self, cwd):
-        allItems = collect_list_info(self.flat_directory_view, cwd)
+        self.cancel_scan()
+        self._drop_fuzzy_search()
+        allItems = map(make_raw_item, self._list_files(cwd))
+        self._raw_items = allItems
+        self._sorted_raw_items = {}
+        self._change_working_dir(cwd)
+        self.set_items(self._arrange_items())
+
+    def start_filling_by_working_dir(self, cwd, call_after,
+                                     first_batch_size=256):
+        """
+        Does the same as fill_list_by_working_dir, except that only the first
+        screenful of items is read right away. The rest is read in background
+        and appended as it arrives, each batch sending 'NEW ITEMS' again.
+        call_after(func, *args) must call func on the UI thread.
+        """
+        self.cancel_scan()
+        self._drop_fuzzy_search()
+
+        def on_batch(scanner, items, done):
+            call_after(self._add_raw_items, scanner, items, done)
+
+        entries = self._list_files(cwd)
+        scanner = DirectoryScanner(entries, on_batch)
+        items, done = scanner.read_batch(first_batch_size)
         self._change_working_dir(cwd)
-        list = construct_list_for_filling(allItems, self.directory_view_filter)
-        self.set_items(list)
 
-    def updir(self):
+        if not done:
+            self._scanner = scanner
+            scanner.start()
+
+        self._raw_items = []
+        self._sorted_raw_items = {}
+        self._add_raw_items(scanner, items, done)
+
+    def _add_raw_items(self, scanner, items, done):
+        # Batches of a cancelled scan may still be queued up for delivery
+        if scanner.is_cancelled():
+            return
+
+        self._raw_items.extend(items)
+        self._merge_raw_items(items)
+
+        name = self._name_to_select
+
+        if name is not None and name in [i.file_name for i in items]:
+            self._name_to_select_listed = True
+
+        if done:
+            self._scanner = None
+
+            for created, deleted in self._pending_changes:
+                self._remove_and_stat(created, deleted)
+
+            self._pending_changes = []
+
+        # The fuzzy search only knew of the items read so far
+        self._drop_fuzzy_search()
+        self.set_items(self._arrange_items())
+
+    def _remove_and_stat(self, created, deleted):
+        changed = set(created) | set(deleted)
+        raw_items = [i for i in self._raw_items if i.file_name not in changed]
+
+        for file_name in created:
+            entry = stat_entry(file_name, self.working_dir)
+
+            # It could have been deleted since
+            if entry is not None:
+                raw_items.append(make_raw_item(entry))
+
+        self._raw_items = raw_items
+        self._sorted_raw_items = {}
+
+    def apply_dir_changes(self, created, deleted):
+        """
+        Updates the listing with the names that appeared in and vanished from
+        the working directory, without reading all of it again. Only stats
+        the created names.
+        """
+        if self.flat_directory_view:
+            return
+
+        if self.is_scanning():
+            self._pending_changes.append((created, deleted))
+            return
+
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(self.working_dir)
+
+        self._remove_and_stat(created, deleted)
+        self._drop_fuzzy_search()
+        self.set_items(self._arrange_items())
+
+    def _set_raw_items(self, raw_items):
+        self._raw_items = raw_items
+        self._sorted_raw_items = {}
+
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(self.working_dir)
+
+        self._drop_fuzzy_search()
+        self.set_items(self._arrange_items())
+
+    def drop_items(self, items):
+        """
+        Takes items out of the listing right away, e.g. as they get deleted
+        in background, without reading the directory again.
+        """
+        dropped = set([id(i) for i in items])
+        self._set_raw_items([i for i in self._raw_items
+                             if id(i) not in dropped])
+
+    def add_paths(self, paths):
+        """
+        Puts the paths that belong in the listing (e.g. ones restored from
+        the trash) back into it, without reading the directory again. Paths
+        that don't exist or are listed already are left out.
+        """
+        working_dir = os.path.abspath(self.working_dir)
+        listed = set([(os.path.abspath(i.path), i.file_name)
+                      for i in self._raw_items])
+        raw_items = list(self._raw_items)
+
+        for path in paths:
+            dir_path, file_name = os.path.split(os.path.abspath(path))
+
+            if (dir_path, file_name) in listed:
+                continue
+
+            if dir_path == working_dir:
+                item_path = self.working_dir
+            elif self.flat_directory_view \
+                 and dir_path.startswith(working_dir.rstrip(os.sep) + os.sep):
+                relative = dir_path[len(working_dir.rstrip(os.sep)) + 1:]
+                item_path = os.path.join(self.working_dir, relative)
+            else:
+                continue
+
+            entry = stat_entry(file_name, item_path)
+
+            if entry is not None:
+                raw_items.append(make_raw_item(entry))
+                listed.add((dir_path, file_name))
+
+        self._set_raw_items(raw_items)
+
+    def _merge_raw_items(self, items):
+        # Sorting everything read so far again for every batch would make
+        # scanning a big directory quadratic, the batches get merged into
+        # the orders sorted already instead
+        new_dirs, new_files = partition_items(items)
+
+        for sort_mode, parts in self._sorted_raw_items.items():
+            dir_list, file_list, keys = parts
+            key = merge_key(sort_mode)
+
+            if keys is None:
+                keys = (map(key, dir_list), map(key, file_list))
+
+            dir_list, dir_keys = merge_items(dir_list, keys[0], new_dirs, key)
+            file_list, file_keys = merge_items(file_list, keys[1], new_files,
+                                               key)
+            self._sorted_raw_items[sort_mode] = (dir_list, file_list,
+                                                 (dir_keys, file_keys))
+
+    def _sorted_by(self, sort_mode):
+        parts = self._sorted_raw_items.get(sort_mode)
+
+        if parts is None:
+            if sort_mode == SORT_BY_NAME:
+                dir_list, file_list = partition_items(self._raw_items)
+            else:
+                # Starting from the name order makes it the tie-breaker
+                dir_list, file_list = self._sorted_by(SORT_BY_NAME)
+
+            parts = (sort_items(dir_list, sort_mode),
+                     sort_items(file_list, sort_mode), None)
+            self._sorted_raw_items[sort_mode] = parts
+
+        return parts[:2]
+
+    def _arrange_items(self):
+        # Items to display out of self._raw_items, as sorted and filtered
+        dir_list, file_list = self._sorted_by(self.sort_mode)
+
+        if self.sort_reverse:
+            dir_list = dir_list[::-1]
+            file_list = file_list[::-1]
+
+        filter = self.directory_view_filter
+
+        if filter is not None:
+            dir_list = filter.select(dir_list)
+            file_list = filter.select(file_list)
+
+        return join_listing(dir_list, file_list, filter)
+
+    def set_tree_size(self, item, size):
+        item.tree_size = size
+
+        # The size order is out of date, but items are only put in it again
+        # on the next sort, so that they don't jump around while the sizes
+        # are still coming in
+        self._sorted_raw_items.pop(SORT_BY_SIZE, None)
+
+    def set_sort_mode(self, sort_mode, reverse=False):
+        """
+        Sorts the listing by sort_mode (one of SORT_MODES) without reading
+        the directory again.
+        """
+        self.sort_mode = sort_mode
+        self.sort_reverse = reverse
+        self._drop_fuzzy_search()
+        self.set_items(self._arrange_items())
+
+    def items_to_stat(self, sort_mode):
+        """
+        Returns the items that sorting by sort_mode would have to stat
+        first. That's a stat per file, too slow for the UI thread in large
+        directories, so they're better loaded with a MetadataLoader.
+        """
+        if sort_mode == SORT_BY_SIZE:
+            # Directories go by their tree sizes instead
+            return [i for i in self._raw_items
+                    if not i.is_dir and i.stat_result is None]
+
+        if sort_mode == SORT_BY_MTIME:
+            return [i for i in self._raw_items if i.stat_result is None]
+
+        return []
+
+    def _fill(self, cwd, call_after):
+        if call_after is None:
+            self.fill_list_by_working_dir(cwd)
+        else:
+            self.start_filling_by_working_dir(cwd, call_after)
+
+    def updir(self, call_after=None):
+        """
+        Goes to the parent directory, or out of the flat view. Returns the
+        index of the directory it came from in the new listing. If
+        call_after is given, the listing is read in background as
+        start_filling_by_working_dir does it, and the index (0 if the
+        directory is not in the first batch) can change as the rest comes
+        in, see listed_selection().
+        """
+        self.cancel_scan()
+
         if platform.system() == 'Windows':
             if util.is_root_of_drive(self.working_dir):
                 self.set_items(collect_drive_letters())
                 return 0
 
         self.set_dir_filter(u'')
+        in_archive = self.in_archive()
+
         # if we're in self.flat_directory_view, all we want is to refresh
         # the view of self.working_dir without flattening
         if self.flat_directory_view:
             self._unflatten_directory()
-            self.fill_list_by_working_dir(os.getcwdu())
+
+            if in_archive:
+                self._fill(self.working_dir, call_after)
+            else:
+                self._fill(os.getcwdu(), call_after)
+
             return 0
 
+        if in_archive:
+            # There's no chdir'ing into archives, so the working dir is all
+            # there is to go by
+            parent, old_dir = os.path.split(self.working_dir)
+
+            if archives.split_archive_path(parent) is None:
+                os.chdir(parent)
+
+            self._fill(parent, call_after)
+            return self._select_when_listed(old_dir)
+
         old_dir = os.path.split(os.getcwdu())[1]
         os.chdir(u'..')
-        self.fill_list_by_working_dir(os.getcwdu())
-        return self._get_index_by_item(old_dir)
+        self._fill(os.getcwdu(), call_after)
+        return self._select_when_listed(old_dir)
+
+    def get_search_index(self):
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.items)
+
+        return self._search_index
 
     def next_search_match(self, search_str, init_pos):
         if init_pos >= len(self.items):
             init_pos = 0
 
-        search_range = util.wrapped_range(init_pos, len(self.items))
-        search_str_lower = search_str.lower()
+        match = self.get_search_index().next_match(search_str, init_pos)
+
+        if match is None:
+            return init_pos
+
+        return match
+
+    def is_fuzzy_searching(self):
+        return self._fuzzy_base is not None
+
+    def start_fuzzy_search(self, query):
+        """
+        Starts ranking the items by how well they fuzzy-match query. The
+        items present when the first query was given are the ones searched,
+        no matter how many queries follow. Returns the fuzzy.FuzzySearch,
+        which is to be passed to run_fuzzy_search.
+        """
+        if self._fuzzy_base is None:
+            self._fuzzy_base = self.items
+
+            # The names are taken from the items as they get scored, there
+            # is no time to go through all of them before that
+            self._fuzzy_index = fuzzy.FuzzyIndex(
+                self.items, operator.attrgetter('file_name'))
+
+        self._fuzzy_search = self._fuzzy_index.search(query)
+        return self._fuzzy_search
+
+    def run_fuzzy_search(self, search, budget):
+        """
+        Scores items for up to budget seconds and sets self.items to the
+        matches found so far, best first. Returns whether the search is done.
+        Searches superseded by a newer one are not run at all.
+        """
+        if search is not self._fuzzy_search:
+            return True
+
+        done = search.run(budget)
+
+        if search.query == u'':
+            self.set_items(self._fuzzy_base)
+        else:
+            base = self._fuzzy_base
+            self.set_items([base[i] for i in search.ranked()])
+
+        return done
+
+    def end_fuzzy_search(self, keep_matches):
+        """
+        Leaves the fuzzy search, either keeping the matches as the listing or
+        going back to the items it started with.
+        """
+        if self._fuzzy_base is None:
+            return
 
-        for i in search_range:
-            if search_str_lower in self.items[i].file_name.lower():
-                return i
+        base = self._fuzzy_base
+        self._drop_fuzzy_search()
 
-        return init_pos
+        if not keep_matches:
+            self.set_items(base)
 
+    def _drop_fuzzy_search(self):
+        self._fuzzy_base = None
+        self._fuzzy_index = None
+        self._fuzzy_search = None
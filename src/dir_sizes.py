@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Total sizes of directory trees, computed by a pool of worker processes
+# (each walking a tree on its own, free of the GIL) and cached by the
+# directory's device, inode and mtime.
+#
+# Note that a directory's mtime only changes when its own entries do, so a
+# cached total won't notice files changing further down the tree. Computing
+# the sizes again means walking again, which is what the cache is there to
+# avoid on repeated visits.
+
+import os
+import stat
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+
+def _disk_usage(st):
+    # Blocks actually allocated, which is what fills the disk. Falls back to
+    # the apparent size where st_blocks is not available (Windows).
+    blocks = getattr(st, 'st_blocks', None)
+
+    if blocks is None:
+        return st.st_size
+
+    return blocks * 512
+
+
+def _list_with_stats(path):
+    # Yields (full_path, lstat) for each entry of path
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                yield entry.path, entry.stat(follow_symlinks=False)
+            except OSError:
+                pass
+        return
+
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+
+        try:
+            yield full_path, os.lstat(full_path)
+        except OSError:
+            pass
+
+
+def tree_size(path):
+    """
+    Returns the disk usage of the tree under path, in bytes. Symlinks are
+    not followed, and hard-linked files are counted once. Subdirectories
+    that can't be read are skipped.
+    """
+    total = _disk_usage(os.lstat(path))
+    hard_links = set()
+    dirs_to_visit = [path]
+
+    while dirs_to_visit:
+        try:
+            entries = list(_list_with_stats(dirs_to_visit.pop()))
+        except OSError:
+            continue
+
+        for full_path, st in entries:
+            if stat.S_ISDIR(st.st_mode):
+                dirs_to_visit.append(full_path)
+            elif st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+
+                if key in hard_links:
+                    continue
+
+                hard_links.add(key)
+
+            total += _disk_usage(st)
+
+    return total
+
+
+def _tree_size_in_worker(path):
+    # Runs in the pool's processes. Errors can't be raised across.
+    try:
+        return path, tree_size(path)
+    except (OSError, IOError):
+        return path, None
+
+
+def processes_available():
+    return multiprocessing is not None
+
+
+def size_cache_key(path):
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_mtime)
+
+
+class SizeCache(object):
+    """Tree sizes by size_cache_key. May be shared between panes."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sizes = {}
+
+    def get(self, key):
+        self._lock.acquire()
+
+        try:
+            return self._sizes.get(key)
+        finally:
+            self._lock.release()
+
+    def put(self, key, size):
+        self._lock.acquire()
+
+        try:
+            self._sizes[key] = size
+        finally:
+            self._lock.release()
+
+
+class SizeComputer(threading.Thread):
+    """
+    Computes the tree sizes of directory items (data.RawItems) with a pool
+    of num_processes worker processes, or on this thread alone if there is
+    no multiprocessing or num_processes is 0. Calls on_size(computer, item,
+    size) as each size comes in, cached ones first and then in whatever
+    order they get done, and on_done(computer) at the end (unless
+    cancelled). size is None if the directory could not be read. Both are
+    called on the computer's thread.
+    """
+    def __init__(self, items, cache, on_size, on_done, num_processes=4):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.items = items
+        self.cache = cache
+        self._on_size = on_size
+        self._on_done = on_done
+        self.num_processes = num_processes
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.isSet()
+
+    def _report(self, item, size):
+        if not self.is_cancelled():
+            self._on_size(self, item, size)
+
+    def run(self):
+        # full path -> (item, cache key) of the ones left to compute
+        pending = {}
+
+        for item in self.items:
+            path = os.path.join(item.path, item.file_name)
+
+            try:
+                key = size_cache_key(path)
+            except OSError:
+                self._report(item, None)
+                continue
+
+            size = self.cache.get(key)
+
+            if size is None:
+                pending[path] = (item, key)
+            else:
+                self._report(item, size)
+
+        if pending and not self.is_cancelled():
+            if processes_available() and self.num_processes > 0:
+                self._compute_in_pool(pending)
+            else:
+                self._compute_here(pending)
+
+        if not self.is_cancelled():
+            self._on_done(self)
+
+    def _store(self, pending, path, size):
+        item, key = pending[path]
+
+        if size is not None:
+            self.cache.put(key, size)
+
+        self._report(item, size)
+
+    def _compute_here(self, pending):
+        for path in pending:
+            if self.is_cancelled():
+                return
+
+            self._store(pending, *_tree_size_in_worker(path))
+
+    def _compute_in_pool(self, pending):
+        num_processes = min(self.num_processes, len(pending))
+        pool = multiprocessing.Pool(num_processes)
+
+        try:
+            results = pool.imap_unordered(_tree_size_in_worker, pending.keys())
+
+            for path, size in results:
+                if self.is_cancelled():
+                    return
+
+                self._store(pending, path, size)
+        finally:
+            # Also kills the walks still in progress on cancel
+            pool.terminate()
+            pool.join()
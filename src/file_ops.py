@@ -0,0 +1,971 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Copying, moving and deleting files in background. File data is copied in
+# the kernel with copy_file_range() or sendfile() on Linux (called through
+# ctypes), and through a buffer otherwise (or when the kernel refuses, e.g.
+# across filesystems that don't support it).
+
+import os
+import time
+import stat
+import errno
+import Queue
+import shutil
+import platform
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+import trash
+
+
+COPY = 'copy'
+MOVE = 'move'
+DELETE = 'delete'
+TRASH = 'trash'
+
+# Puts back what the last TRASH job moved to the trash
+RESTORE = 'restore'
+
+# Bytes per system call
+CHUNK_SIZE = 1024 * 1024
+
+# Files up to this size are copied by a pool of threads, the larger ones
+# one at a time
+SMALL_FILE_SIZE = 1024 * 1024
+DEFAULT_COPY_WORKERS = 8
+
+# Progress is reported at most this often, in seconds
+PROGRESS_INTERVAL = 0.25
+
+O_BINARY = getattr(os, 'O_BINARY', 0)
+
+
+def _load_libc():
+    if ctypes is None or platform.system() != 'Linux':
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except OSError:
+        return None
+
+    return libc
+
+
+def _bind(libc, name, argtypes):
+    """The libc function name, None if there's no such one."""
+    if libc is None:
+        return None
+
+    try:
+        func = getattr(libc, name)
+    except AttributeError:
+        return None
+
+    func.argtypes = argtypes
+    func.restype = ctypes.c_ssize_t
+    return func
+
+
+def _check(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+    return result
+
+
+def _make_copy_file_range(libc):
+    func = _bind(libc, 'copy_file_range',
+                 [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                  ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint])
+
+    if func is None:
+        return None
+
+    def copy_file_range(src_fd, dst_fd, count):
+        """
+        Copies up to count bytes from src_fd to dst_fd, at and advancing
+        their offsets. Returns how many got copied, 0 at the end of src_fd.
+        """
+        return _check(func(src_fd, None, dst_fd, None, count, 0))
+
+    return copy_file_range
+
+
+def _make_sendfile(libc):
+    func = _bind(libc, 'sendfile',
+                 [ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                  ctypes.c_size_t])
+
+    if func is None:
+        return None
+
+    def sendfile(dst_fd, src_fd, count):
+        """Like copy_file_range(), with sendfile()."""
+        return _check(func(dst_fd, src_fd, None, count))
+
+    return sendfile
+
+
+# None where the system doesn't have them
+_libc = _load_libc()
+copy_file_range = _make_copy_file_range(_libc)
+sendfile = _make_sendfile(_libc)
+
+# Errors on which the kernel's way of copying is given up for the buffered
+# one, as long as nothing has been copied yet
+ZERO_COPY_UNSUPPORTED = set([errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                             getattr(errno, 'EOPNOTSUPP', errno.EINVAL),
+                             getattr(errno, 'ENOTSUP', errno.EINVAL)])
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _copy_with(copy_chunk, on_chunk):
+    """
+    Calls copy_chunk() until it returns 0, passing the number of bytes
+    copied each time to on_chunk. Returns False if copy_chunk could not
+    copy anything due to lack of support, True when done.
+    """
+    copied = 0
+
+    while True:
+        try:
+            num_bytes = copy_chunk(copied)
+        except OSError, e:
+            if copied == 0 and e.errno in ZERO_COPY_UNSUPPORTED:
+                return False
+            raise
+
+        if num_bytes == 0:
+            return True
+
+        copied += num_bytes
+        on_chunk(num_bytes)
+
+
+def copy_data(src_fd, dst_fd, on_chunk):
+    """
+    Copies everything from src_fd to dst_fd, which must both be at offset
+    0. Calls on_chunk(num_bytes) after each chunk.
+    """
+    if copy_file_range is not None:
+        def copy_chunk(offset):
+            return copy_file_range(src_fd, dst_fd, CHUNK_SIZE)
+
+        if _copy_with(copy_chunk, on_chunk):
+            return
+
+    if sendfile is not None:
+        def copy_chunk(offset):
+            return sendfile(dst_fd, src_fd, CHUNK_SIZE)
+
+        if _copy_with(copy_chunk, on_chunk):
+            return
+
+    while True:
+        data = os.read(src_fd, CHUNK_SIZE)
+
+        if not data:
+            return
+
+        written = 0
+
+        while written < len(data):
+            written += os.write(dst_fd, data[written:])
+
+        on_chunk(len(data))
+
+
+def copy_file_data(src, dst, mode, on_chunk):
+    """
+    Copies the contents of the file src to dst, which must not exist and
+    gets created with mode (less the umask). A partly written dst is removed
+    on failure.
+    """
+    src_fd = os.open(src, os.O_RDONLY | O_BINARY)
+
+    try:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | O_BINARY
+        dst_fd = os.open(dst, flags, stat.S_IMODE(mode) | stat.S_IWUSR)
+
+        try:
+            copy_data(src_fd, dst_fd, on_chunk)
+        except:
+            os.close(dst_fd)
+            os.remove(dst)
+            raise
+
+        os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def copy_file(src, dst, on_chunk):
+    """
+    Copies the file src to dst, which must not exist, along with its
+    permissions and times. A partly written dst is removed on failure.
+    """
+    copy_file_data(src, dst, os.stat(src).st_mode, on_chunk)
+    shutil.copystat(src, dst)
+
+
+def remove_tree(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def is_inside(path, directory):
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep)
+                                                + os.sep)
+
+
+def _succeeded(sources, failed_paths):
+    """The sources that neither are nor contain any of failed_paths."""
+    succeeded = []
+
+    for src in sources:
+        prefix = src.rstrip(os.sep) + os.sep
+
+        if not [f for f in failed_paths if f == src or f.startswith(prefix)]:
+            succeeded.append(src)
+
+    return succeeded
+
+
+class CopyPlan(object):
+    """
+    What copying a set of sources takes, gathered by walking them once:
+    directories to create, symlinks to recreate and files to copy, each as
+    (source, destination, lstat result). Sources that can't be copied
+    (unreadable, special files) end up in errors as (source, message).
+    """
+    def __init__(self):
+        self.dirs = []
+        self.links = []
+        self.files = []
+        self.errors = []
+        self.bytes_total = 0
+
+        # The sources given to add_tree, that all of the above come from
+        self.sources = []
+
+    def add_file(self, src, dst, st=None):
+        """Adds src, which is not a directory, to be copied to dst."""
+        try:
+            if st is None:
+                st = os.lstat(src)
+
+            if stat.S_ISLNK(st.st_mode):
+                self.links.append((src, dst, st))
+            elif stat.S_ISREG(st.st_mode):
+                self.files.append((src, dst, st))
+                self.bytes_total += st.st_size
+            else:
+                self.errors.append((src, 'Not a regular file'))
+        except OSError, e:
+            self.errors.append((src, str(e)))
+
+    def add_tree(self, src, dst):
+        """Adds src to be copied to dst, recursively if it's a directory."""
+        self.sources.append(src)
+        self._add_tree(src, dst)
+
+    def _add_tree(self, src, dst):
+        try:
+            st = os.lstat(src)
+        except OSError, e:
+            self.errors.append((src, str(e)))
+            return
+
+        if not stat.S_ISDIR(st.st_mode):
+            self.add_file(src, dst, st)
+            return
+
+        self.dirs.append((src, dst, st))
+
+        try:
+            names = os.listdir(src)
+        except OSError, e:
+            self.errors.append((src, str(e)))
+            return
+
+        for name in names:
+            self._add_tree(os.path.join(src, name), os.path.join(dst, name))
+
+
+class CopyScheduler(object):
+    """
+    Carries out a CopyPlan. Most of the time copying many small files goes
+    into opening, creating and closing them rather than moving data, so the
+    files up to small_file_size get copied by a pool of num_workers threads
+    (the GIL is released during system calls), while the larger ones are
+    streamed one at a time so that they don't compete for the disk.
+    Directories are created up front and their permissions and times, like
+    those of the files, are set in one pass at the end: that's one chmod and
+    one utime per entry from the stats gathered by the plan, and a directory
+    that isn't writable in the source doesn't get in the way of filling it.
+
+    on_chunk(num_bytes) gets called after every chunk copied, from any of
+    the threads, one call at a time; exceptions raised by it (JobCancelled)
+    stop the whole copy. on_file(source) gets called as each file is
+    started, also from any of the threads. Failures of single entries are
+    collected in errors as (source, message).
+    """
+    def __init__(self, plan, on_chunk, num_workers=DEFAULT_COPY_WORKERS,
+                 small_file_size=SMALL_FILE_SIZE, on_file=None):
+        self.plan = plan
+        self.on_file = on_file
+        self.num_workers = num_workers
+        self.small_file_size = small_file_size
+        self.errors = []
+        self._on_chunk = on_chunk
+        self._chunk_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._abort_error = None
+
+        # (source, destination, lstat result) of whatever got copied, for
+        # the metadata pass
+        self._copied_files = []
+
+    def _report_chunk(self, num_bytes):
+        if self._stop.isSet():
+            raise JobCancelled()
+
+        self._chunk_lock.acquire()
+
+        try:
+            self._on_chunk(num_bytes)
+        finally:
+            self._chunk_lock.release()
+
+    def _make_dirs(self):
+        created = set()
+        wanted = set(dst for src, dst, st in self.plan.dirs)
+        wanted.update(os.path.dirname(dst) for src, dst, st in
+                      self.plan.files + self.plan.links)
+
+        # Parents sort before their children
+        for path in sorted(wanted):
+            if path in created or os.path.isdir(path):
+                continue
+
+            try:
+                os.mkdir(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+                os.makedirs(path)
+
+            created.add(path)
+
+    def _copy_one(self, src, dst, st):
+        if self.on_file is not None:
+            self.on_file(src)
+
+        try:
+            copy_file_data(src, dst, st.st_mode, self._report_chunk)
+        except (OSError, IOError), e:
+            self.errors.append((src, str(e)))
+        else:
+            self._copied_files.append((src, dst, st))
+
+    def _worker(self, files):
+        try:
+            while not self._stop.isSet():
+                entry = files.get()
+
+                if entry is None:
+                    return
+
+                self._copy_one(*entry)
+        except Exception, e:
+            self._abort(e)
+
+    def _abort(self, error):
+        if self._abort_error is None:
+            self._abort_error = error
+
+        self._stop.set()
+
+    def _set_metadata(self, src, dst, st):
+        try:
+            os.chmod(dst, stat.S_IMODE(st.st_mode))
+            os.utime(dst, (st.st_atime, st.st_mtime))
+        except OSError, e:
+            self.errors.append((src, str(e)))
+
+    def run(self):
+        plan = self.plan
+
+        try:
+            self._make_dirs()
+        except OSError, e:
+            # Without the directories there's nowhere to copy to, none of
+            # the sources gets copied
+            message = str(e)
+            self.errors.extend([(src, message) for src in plan.sources])
+            return
+
+        for src, dst, st in plan.links:
+            try:
+                os.symlink(os.readlink(src), dst)
+            except OSError, e:
+                self.errors.append((src, str(e)))
+
+        small = [f for f in plan.files if f[2].st_size <= self.small_file_size]
+        large = [f for f in plan.files if f[2].st_size > self.small_file_size]
+
+        files = Queue.Queue()
+        workers = []
+
+        for entry in small:
+            files.put(entry)
+
+        for i in range(min(self.num_workers, len(small))):
+            files.put(None)
+            worker = threading.Thread(target=self._worker, args=(files,))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+
+        if not workers:
+            # Nothing for a pool to do, or no pool at all
+            files.put(None)
+            self._worker(files)
+
+        try:
+            for entry in large:
+                if self._stop.isSet():
+                    break
+
+                self._copy_one(*entry)
+        except Exception, e:
+            self._abort(e)
+
+        for worker in workers:
+            worker.join()
+
+        if self._abort_error is not None:
+            raise self._abort_error
+
+        for src, dst, st in self._copied_files:
+            self._set_metadata(src, dst, st)
+
+        # Deepest first, so that setting the times of a directory's children
+        # doesn't touch its own
+        for src, dst, st in reversed(plan.dirs):
+            self._set_metadata(src, dst, st)
+
+
+class TreeRemover(object):
+    """
+    Deletes the paths in sources for good, recursing into directories.
+    The trees are walked first; then all the files (and symlinks) are
+    unlinked by num_workers threads, and the directories removed level by
+    level, the deepest first, each level in parallel as well, so that every
+    directory is empty by the time it's removed.
+
+    on_removed() gets called after each entry is gone, one call at a time;
+    exceptions raised by it (JobCancelled) stop the removal. Failures are
+    collected in errors as (path, message).
+    """
+    def __init__(self, sources, on_removed, num_workers=DEFAULT_COPY_WORKERS):
+        self.sources = sources
+        self.num_workers = num_workers
+        self.errors = []
+        self.num_entries = 0
+        self._on_removed = on_removed
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._abort_error = None
+
+        self._walked = False
+        self._files = []
+
+        # Directories by depth
+        self._levels = []
+
+    def _add_dir(self, path, depth):
+        while len(self._levels) <= depth:
+            self._levels.append([])
+
+        self._levels[depth].append(path)
+
+    def walk(self):
+        """Finds what there is to remove, returns the number of entries."""
+        pending = [(src, 0) for src in self.sources]
+
+        while pending:
+            path, depth = pending.pop()
+
+            try:
+                st = os.lstat(path)
+            except OSError, e:
+                self.errors.append((path, str(e)))
+                continue
+
+            if not stat.S_ISDIR(st.st_mode):
+                self._files.append(path)
+                continue
+
+            self._add_dir(path, depth)
+
+            try:
+                names = os.listdir(path)
+            except OSError:
+                # Not removable either, but rmdir will tell
+                continue
+
+            for name in names:
+                pending.append((os.path.join(path, name), depth + 1))
+
+        self._walked = True
+        self.num_entries = len(self._files) + sum(map(len, self._levels))
+        return self.num_entries
+
+    def _remove(self, remove, path):
+        try:
+            remove(path)
+        except OSError, e:
+            self.errors.append((path, str(e)))
+            return
+
+        self._lock.acquire()
+
+        try:
+            self._on_removed()
+        finally:
+            self._lock.release()
+
+    def _worker(self, remove, paths):
+        try:
+            while not self._stop.isSet():
+                path = paths.get()
+
+                if path is None:
+                    return
+
+                self._remove(remove, path)
+        except Exception, e:
+            if self._abort_error is None:
+                self._abort_error = e
+
+            self._stop.set()
+
+    def _remove_all(self, remove, entries):
+        paths = Queue.Queue()
+        workers = []
+
+        for path in entries:
+            paths.put(path)
+
+        for i in range(max(1, min(self.num_workers, len(entries)))):
+            paths.put(None)
+
+        for i in range(min(self.num_workers, len(entries))):
+            worker = threading.Thread(target=self._worker,
+                                      args=(remove, paths))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+
+        if not workers:
+            self._worker(remove, paths)
+
+        for worker in workers:
+            worker.join()
+
+        if self._abort_error is not None:
+            raise self._abort_error
+
+    def run(self):
+        if not self._walked:
+            self.walk()
+
+        self._remove_all(os.remove, self._files)
+
+        for level in reversed(self._levels):
+            self._remove_all(os.rmdir, level)
+
+
+class Job(object):
+    """
+    Copies or moves (kind is COPY or MOVE) the paths in sources into the
+    directory dest_dir. Items that fail are recorded in errors, the rest
+    still get done.
+
+    If root is given, sources are paths below it (as listed in a flat view)
+    that keep their path relative to root under dest_dir; otherwise each of
+    them goes right into dest_dir. Files get copied by num_workers threads,
+    see CopyScheduler.
+
+    DELETE removes sources for good (see TreeRemover), counting entries
+    rather than bytes in bytes_total and bytes_done. TRASH moves them to the
+    trash, recording them in journal (a trash.Journal); RESTORE puts back
+    the last batch recorded there, filling sources in as it runs. Neither
+    takes a dest_dir.
+    """
+    def __init__(self, kind, sources, dest_dir=None, root=None,
+                 num_workers=DEFAULT_COPY_WORKERS, journal=None):
+        self.kind = kind
+        self.sources = sources
+        self.dest_dir = dest_dir
+        self.root = root
+        self.num_workers = num_workers
+        self.journal = journal
+
+        # Sources that are still where they were after a DELETE or TRASH,
+        # and the original paths put back by a RESTORE
+        self.failed = []
+        self.restored = []
+
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.num_done = 0
+        self.started = None
+        self.finished = None
+
+        # Source being worked on
+        self.current = None
+
+        # (source, error message)
+        self.errors = []
+
+        self._cancelled = threading.Event()
+        self._on_progress = None
+        self._last_progress = 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.isSet()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+
+        return (self.finished or time.time()) - self.started
+
+    def throughput(self):
+        """Bytes per second so far."""
+        elapsed = self.elapsed()
+
+        if elapsed <= 0:
+            return 0.0
+
+        return self.bytes_done / elapsed
+
+    def _add_progress(self, num_bytes):
+        self.bytes_done += num_bytes
+
+        if self.is_cancelled():
+            raise JobCancelled()
+
+        now = time.time()
+
+        if self._on_progress is not None \
+           and now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self._on_progress(self)
+
+    def _set_current(self, src):
+        self.current = src
+
+    def _copy_plan(self, plan):
+        """Copies what's in plan, returns the sources that failed."""
+        self.bytes_total += plan.bytes_total
+        scheduler = CopyScheduler(plan, self._add_progress, self.num_workers,
+                                  on_file=self._set_current)
+        scheduler.run()
+        failed = plan.errors + scheduler.errors
+        self.errors.extend(failed)
+        return [path for path, message in failed]
+
+    def _move(self, src, dst):
+        try:
+            # Instant within the same filesystem
+            os.rename(src, dst)
+            return
+        except OSError, e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        # Across filesystems it takes copying after all
+        plan = CopyPlan()
+        plan.add_tree(src, dst)
+
+        if not self._copy_plan(plan):
+            remove_tree(src)
+
+    def _destination(self, src):
+        src = src.rstrip(os.sep)
+
+        if self.root is None:
+            return os.path.join(self.dest_dir, os.path.basename(src))
+
+        root = self.root.rstrip(os.sep) + os.sep
+
+        if not src.startswith(root):
+            raise OSError(errno.EINVAL, 'Not below %s' % (self.root), src)
+
+        return os.path.join(self.dest_dir, src[len(root):])
+
+    def _check(self, src):
+        """Returns where src goes, unless it can't go there."""
+        dst = self._destination(src)
+
+        if os.path.lexists(dst):
+            raise OSError(errno.EEXIST, 'Already exists', dst)
+
+        if os.path.isdir(src) and is_inside(self.dest_dir, src):
+            raise OSError(errno.EINVAL, 'Can\'t copy into itself', src)
+
+        return dst
+
+    def _run_copy(self):
+        # All the sources go into one plan, so that the small files among
+        # them get copied in parallel however they're spread
+        plan = CopyPlan()
+        planned = []
+
+        for src in self.sources:
+            try:
+                plan.add_tree(src, self._check(src))
+            except (OSError, IOError), e:
+                self.errors.append((src, str(e)))
+            else:
+                planned.append(src)
+
+        failed = self._copy_plan(plan)
+        self.num_done += len(_succeeded(planned, failed))
+
+    def _run_move(self):
+        for src in self.sources:
+            if self.is_cancelled():
+                break
+
+            self.current = src
+
+            try:
+                dst = self._check(src)
+
+                if self.root is not None:
+                    parent = os.path.dirname(dst)
+
+                    if not os.path.isdir(parent):
+                        os.makedirs(parent)
+
+                self._move(src, dst)
+            except (OSError, IOError), e:
+                self.errors.append((src, str(e)))
+            else:
+                self.num_done += 1
+
+    def _run_delete(self):
+        remover = TreeRemover(self.sources, lambda: self._add_progress(1),
+                              self.num_workers)
+        self.bytes_total = remover.walk()
+
+        try:
+            remover.run()
+        finally:
+            # Including whatever a cancel left halfway
+            self.errors.extend(remover.errors)
+            self.failed = [src for src in self.sources
+                           if os.path.lexists(src)]
+            self.num_done = len(self.sources) - len(self.failed)
+
+    def _run_trash(self):
+        batch = self.journal.new_batch()
+
+        for src in self.sources:
+            if self.is_cancelled():
+                self.failed.append(src)
+                continue
+
+            self.current = src
+
+            try:
+                self._trash(batch, src)
+            except (OSError, IOError), e:
+                self.errors.append((src, str(e)))
+                self.failed.append(src)
+            else:
+                self.num_done += 1
+
+    def _trash(self, batch, src):
+        trashed, info_path = trash.reserve_in_trash(src)
+
+        # Recorded before the move, so that nothing gets into the trash
+        # without the journal knowing how to get it back
+        try:
+            self.journal.record(batch, src, trashed)
+        except (OSError, IOError):
+            trash.cancel_reservation(info_path)
+            raise
+
+        try:
+            trash.finish_move_to_trash(src, trashed, info_path)
+        except (OSError, IOError):
+            try:
+                self.journal.forget(batch, [(src, trashed)])
+            except (OSError, IOError):
+                # Undoing skips entries of things that never got trashed
+                pass
+
+            raise
+
+    def _run_restore(self):
+        last = self.journal.last_batch()
+
+        if last is None:
+            self.sources = []
+            return
+
+        batch, entries = last
+        self.sources = [original for original, trashed in entries]
+        forgotten = []
+
+        for original, trashed in entries:
+            self.current = original
+
+            if not os.path.lexists(trashed):
+                forgotten.append((original, trashed))
+
+                # Unless it never got there, it was emptied from the trash
+                # since, there's no getting it back
+                if not os.path.lexists(original):
+                    self.errors.append((original, 'No longer in the trash'))
+
+                continue
+
+            try:
+                trash.restore_from_trash(trashed, original)
+            except (OSError, IOError), e:
+                self.errors.append((original, str(e)))
+                continue
+
+            forgotten.append((original, trashed))
+            self.restored.append(original)
+            self.num_done += 1
+
+        self.journal.forget(batch, forgotten)
+
+    def run(self, on_progress=None):
+        self._on_progress = on_progress
+        self.started = time.time()
+        run_kind = {COPY: self._run_copy, MOVE: self._run_move,
+                    DELETE: self._run_delete, TRASH: self._run_trash,
+                    RESTORE: self._run_restore}[self.kind]
+
+        try:
+            run_kind()
+        except JobCancelled:
+            pass
+        except Exception, e:
+            # Reported like any failure, and the queue goes on with the
+            # next job
+            self.errors.append((self.current, 'Unexpected error: %s' % e))
+
+            if self.kind in (DELETE, TRASH):
+                self.failed = [src for src in self.sources
+                               if os.path.lexists(src)]
+
+        self.current = None
+        self.finished = time.time()
+
+
+class JobQueue(threading.Thread):
+    """
+    Runs Jobs one after another on a worker thread. Calls on_progress(job)
+    now and then while a job runs, and on_done(job) after it's finished or
+    cancelled, both on the worker thread.
+    """
+    def __init__(self, on_progress, on_done):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._jobs = Queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def submit(self, job):
+        self._lock.acquire()
+
+        try:
+            self._pending.append(job)
+        finally:
+            self._lock.release()
+
+        self._jobs.put(job)
+
+    def pending_jobs(self):
+        """The jobs queued or running, the running one first."""
+        self._lock.acquire()
+
+        try:
+            return list(self._pending)
+        finally:
+            self._lock.release()
+
+    def cancel_all(self):
+        for job in self.pending_jobs():
+            job.cancel()
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+
+            if job is None:
+                return
+
+            if not job.is_cancelled():
+                job.run(self._on_progress)
+
+            self._lock.acquire()
+
+            try:
+                self._pending.remove(job)
+            finally:
+                self._lock.release()
+
+            self._on_done(job)
+
+    def stop(self):
+        self._jobs.put(None)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Searching files of any size without reading them whole: the file is
+# scanned a chunk at a time on a worker thread, forward or backward from an
+# offset, until the first match.
+
+import re
+import time
+import threading
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Regex matches can't be longer than this (or they might not be found)
+MAX_MATCH_LENGTH = 64 * 1024
+
+# Progress is reported at most this often, in seconds
+PROGRESS_INTERVAL = 0.1
+
+FORWARD = 'forward'
+BACKWARD = 'backward'
+
+
+def make_pattern(query):
+    """
+    Compiles what's typed into a search: 're:' followed by a regular
+    expression, or text to find as it is. Either way case is ignored
+    unless the query has capitals in it. Returns (regex, literal,
+    ignore_case), one of regex and literal None. Raises re.error for bad
+    regular expressions.
+    """
+    ignore_case = query == query.lower()
+
+    if query.startswith('re:'):
+        flags = re.MULTILINE
+
+        if ignore_case:
+            flags |= re.IGNORECASE
+
+        return re.compile(query[3:], flags), None, ignore_case
+
+    return None, query, ignore_case
+
+
+class FileSearch(threading.Thread):
+    """
+    Looks for query (see make_pattern) in data, size bytes of a
+    paged_file.PagedFile, starting at offset: the first match starting at
+    or after it searching FORWARD, the last one starting before it
+    searching BACKWARD. Chunks overlap by as much as a match can be long,
+    so matches that cross chunk boundaries are found too.
+
+    Calls on_progress(search, offset) now and then with how far it got, and
+    on_done(search) at the end, both on the search thread. match is then
+    (start, end) of the match, or None if there's none or it was cancelled.
+    """
+    def __init__(self, paged, query, offset, direction, on_progress,
+                 on_done, chunk_size=CHUNK_SIZE):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.data = paged.data
+        self.size = paged.size
+        self.regex, self.literal, self.ignore_case = make_pattern(query)
+        self.offset = offset
+        self.direction = direction
+        self.chunk_size = chunk_size
+        self.match = None
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._cancelled = threading.Event()
+        self._last_progress = 0
+
+        if self.literal is not None:
+            self.overlap = max(len(self.literal) - 1, 0)
+        else:
+            self.overlap = MAX_MATCH_LENGTH
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.isSet()
+
+    def _progress(self, offset):
+        now = time.time()
+
+        if now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self._on_progress(self, offset)
+
+    def _buffer(self, start, end):
+        # The byte before start goes in too, for '^' to know whether start
+        # is at the beginning of a line
+        buffer_start = max(start - 1, 0)
+        buffer = self.data[buffer_start:min(end, self.size)]
+
+        # Much faster than finding literals with re.IGNORECASE
+        if self.literal is not None and self.ignore_case:
+            buffer = buffer.lower()
+
+        return buffer_start, buffer
+
+    def _search_chunk(self, start, stop):
+        """First match starting in [start, stop), or None."""
+        buffer_start, buffer = self._buffer(start, stop + self.overlap)
+        pos = start - buffer_start
+        end_pos = stop - buffer_start
+
+        if self.literal is not None:
+            found = buffer.find(self.literal, pos, end_pos + self.overlap)
+
+            if found == -1:
+                return None
+
+            return (buffer_start + found,
+                    buffer_start + found + len(self.literal))
+
+        match = self.regex.search(buffer, pos)
+
+        if match is None or match.start() >= end_pos:
+            return None
+
+        return buffer_start + match.start(), buffer_start + match.end()
+
+    def _rsearch_chunk(self, start, stop):
+        """Last match starting in [start, stop), or None."""
+        buffer_start, buffer = self._buffer(start, stop + self.overlap)
+        pos = start - buffer_start
+        end_pos = stop - buffer_start
+
+        if self.literal is not None:
+            found = buffer.rfind(self.literal, pos, end_pos + self.overlap)
+
+            if found == -1 or found >= end_pos:
+                return None
+
+            return (buffer_start + found,
+                    buffer_start + found + len(self.literal))
+
+        last = None
+
+        # Matches can't overlap, so stepping one byte past the start of the
+        # last one is what finds all of the candidates
+        while pos < end_pos:
+            match = self.regex.search(buffer, pos)
+
+            if match is None or match.start() >= end_pos:
+                break
+
+            last = match
+            pos = match.start() + 1
+
+        if last is None:
+            return None
+
+        return buffer_start + last.start(), buffer_start + last.end()
+
+    def _run_forward(self):
+        start = self.offset
+
+        while start < self.size and not self.is_cancelled():
+            stop = min(start + self.chunk_size, self.size)
+            match = self._search_chunk(start, stop)
+
+            if match is not None:
+                return match
+
+            start = stop
+            self._progress(start)
+
+        return None
+
+    def _run_backward(self):
+        stop = min(self.offset, self.size)
+
+        while stop > 0 and not self.is_cancelled():
+            start = max(stop - self.chunk_size, 0)
+            match = self._rsearch_chunk(start, stop)
+
+            if match is not None:
+                return match
+
+            stop = start
+            self._progress(stop)
+
+        return None
+
+    def run(self):
+        if self.direction == FORWARD:
+            match = self._run_forward()
+        else:
+            match = self._run_backward()
+
+        if not self.is_cancelled():
+            self.match = match
+
+        self._on_done(self)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Fuzzy (subsequence) matching of names, ranked by score, in the spirit of
+# fzf. A name matches when all the characters of the query appear in it in
+# the same order, case-insensitively.
+
+import time
+
+
+SCORE_MATCH = 16
+
+# Matching the first char of a word ('foo_bar', 'foo.bar', 'fooBar')
+BONUS_BOUNDARY = 8
+
+# Matching right after the previous match
+BONUS_CONSECUTIVE = 8
+
+# For skipping characters between two matches
+PENALTY_GAP_START = 3
+PENALTY_GAP_EXTENSION = 1
+
+WORD_SEPARATORS = u'/\\_-. '
+
+# How many names get scored between the checks of the time budget. Scoring
+# one takes a few microseconds, so the budget is never overshot by much.
+CHECK_BUDGET_EVERY = 16
+
+
+def _is_boundary(name, pos):
+    if pos == 0:
+        return True
+
+    prev = name[pos - 1]
+
+    if prev in WORD_SEPARATORS:
+        return True
+
+    # camelCase
+    return prev.islower() and name[pos].isupper()
+
+
+def match_positions(query, lower_name):
+    """
+    Returns the positions in lower_name where the chars of query match,
+    picking the shortest stretch of the name that contains the match. None
+    if query is not a subsequence of lower_name. query must be lowercase.
+    """
+    pos = 0
+
+    for char in query:
+        pos = lower_name.find(char, pos)
+
+        if pos == -1:
+            return None
+
+        pos += 1
+
+    # Going back from the earliest end gives the latest possible start
+    start = pos
+
+    for char in reversed(query):
+        start = lower_name.rfind(char, 0, start)
+
+    positions = []
+    pos = start
+
+    for char in query:
+        pos = lower_name.find(char, pos)
+        positions.append(pos)
+        pos += 1
+
+    return positions
+
+
+def score(query, lower_name, name):
+    """
+    Scores how well name matches query (the higher, the better). None if it
+    does not match at all. query must be lowercase.
+    """
+    positions = match_positions(query, lower_name)
+
+    if positions is None:
+        return None
+
+    total = 0
+    prev = None
+
+    for pos in positions:
+        total += SCORE_MATCH
+
+        if _is_boundary(name, pos):
+            total += BONUS_BOUNDARY
+
+        if prev is not None:
+            gap = pos - prev - 1
+
+            if gap == 0:
+                total += BONUS_CONSECUTIVE
+            else:
+                total -= PENALTY_GAP_START + PENALTY_GAP_EXTENSION * (gap - 1)
+
+        prev = pos
+
+    return total
+
+
+class FuzzySearch(object):
+    """
+    Scores the candidates of one query. run() can be called repeatedly with
+    a time budget, each time scoring where the previous call stopped. The
+    candidates come as (indices, start, stop) parts, indices[start:stop]
+    being the indices of the names to score, so that they can be shared
+    with an earlier search rather than copied.
+    """
+    def __init__(self, index, query, parts):
+        self.index = index
+        self.query = query.lower()
+        self.done = False
+        self._parts = parts
+
+        # (-score, len(name), index), so that sorting puts the best first
+        self._results = []
+
+        # The indices of the results, in the order they were found
+        self._matches = []
+
+    def run(self, budget):
+        """
+        Scores candidates for up to budget seconds. Returns whether all of
+        them have been scored.
+        """
+        deadline = time.time() + budget
+        names = self.index.names
+        key = self.index.key
+        lower_names = self.index.lower_names
+        query = self.query
+        results = self._results
+        matches = self._matches
+        parts = self._parts
+
+        while parts:
+            indices, start, stop = parts[0]
+            end = min(start + CHECK_BUDGET_EVERY, stop)
+
+            for i in xrange(start, end):
+                index = indices[i]
+                name = names[index]
+
+                if key is not None:
+                    name = key(name)
+
+                lower_name = lower_names[index]
+
+                if lower_name is None:
+                    lower_name = lower_names[index] = name.lower()
+
+                name_score = score(query, lower_name, name)
+
+                if name_score is not None:
+                    results.append((-name_score, len(name), index))
+                    matches.append(index)
+
+            if end == stop:
+                del parts[0]
+            else:
+                parts[0] = (indices, end, stop)
+
+            if parts and time.time() > deadline:
+                return False
+
+        self.done = True
+        return True
+
+    def matches(self):
+        """Indices of the matches found so far, in no particular order."""
+        return list(self._matches)
+
+    def narrowed_parts(self):
+        """
+        Candidates for a query this one is a subsequence of: the matches
+        found so far, and what's left to score.
+        """
+        return [(self._matches, 0, len(self._matches))] + self._parts
+
+    def ranked(self):
+        """Indices of the matches found so far, the best first."""
+        self._results.sort()
+        return [r[2] for r in self._results]
+
+
+class FuzzyIndex(object):
+    """
+    Names to run fuzzy searches on. Nothing gets done for all of them up
+    front: names are lowercased as they get scored the first time, by the
+    budgeted FuzzySearch.run(). When the last query is a subsequence of the
+    new one (e.g. the query grew), only the matches the last search found
+    so far and the names it hasn't got to yet get considered. If key is
+    given, names are objects that key(name) gives the names of.
+    """
+    def __init__(self, names, key=None):
+        self.names = names
+        self.key = key
+        self.lower_names = [None] * len(names)
+        self._last_search = None
+
+    def _candidates(self, query):
+        last = self._last_search
+
+        # What doesn't match the last query can't match this one either
+        if last is not None and last.query \
+           and match_positions(last.query, query) is not None:
+            return last.narrowed_parts()
+
+        return [(xrange(len(self.names)), 0, len(self.names))]
+
+    def search(self, query):
+        query = query.lower()
+
+        if query == u'':
+            search = FuzzySearch(self, query, [])
+        else:
+            search = FuzzySearch(self, query, self._candidates(query))
+
+        self._last_search = search
+        return search
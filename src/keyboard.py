@@ -151,20 +151,26 @@ class KeyboardConfig(object):
         self.events = {}
 
     def get_func(self, key_code, key_mod):
+        # XXX: make sure MOD_WIN flag is not on. We don't have any
+        # shortcuts bound for MOD_WIN yet, and I've seen a VM that
+        # weirdmostly produces every keystroke with MOD_WIN bit set.
+        key_mod = (key_mod or 0) & ~wx.MOD_WIN
+        fallback = None
+
+        # The binding with exactly these modifiers wins, e.g. 'u' must not
+        # run what's bound to 'U' (which is Shift-u)
         for e in self.events:
-            if key_code == e.key_code:
-                if not key_mod:
-                    return self.events[e]
+            if key_code != e.key_code:
+                continue
 
-                # XXX: make sure MOD_WIN flag is not on. We don't have any
-                # shortcuts bound for MOD_WIN yet, and I've seen a VM that
-                # weirdmostly produces every keystroke with MOD_WIN bit set.
-                key_mod = key_mod & ~wx.MOD_WIN
+            if key_mod == e.modifiers_bit_mask():
+                return self.events[e]
 
-                if key_mod == e.modifiers_bit_mask():
-                    return self.events[e]
+            # When no modifiers are reported, any binding of the key goes
+            if not key_mod and fallback is None:
+                fallback = self.events[e]
 
-        return None
+        return fallback
 
     def _parse_bindings(self, command, bindings):
         events = []
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Line numbers for files too big to count the lines of every time: where
+# every INDEX_STEP-th line starts is found once, on a background thread,
+# and finding any line takes going through at most INDEX_STEP - 1 lines
+# from there.
+
+import os
+import time
+import bisect
+import threading
+
+
+INDEX_STEP = 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+# Progress is reported at most this often, in seconds
+PROGRESS_INTERVAL = 0.2
+
+
+class LineIndex(object):
+    """
+    offsets[k] is where line k * INDEX_STEP starts (lines counted from 0),
+    for the first indexed_to bytes of the file, which is all that can be
+    told about. Only newlines end lines here, however long they are.
+    """
+    def __init__(self):
+        self.offsets = [0]
+        self.indexed_to = 0
+        self.num_newlines = 0
+
+        # Whether the last of the indexed bytes is not a newline
+        self.unterminated = False
+
+    def num_lines(self):
+        """Lines in the indexed part of the file."""
+        if self.unterminated:
+            return self.num_newlines + 1
+
+        return self.num_newlines
+
+    def offset_of_line(self, data, line):
+        """
+        Offset of line in data, the bytes of the file. None if it's not in
+        the indexed part of the file.
+        """
+        step = line / INDEX_STEP
+
+        if line < 0 or step >= len(self.offsets):
+            return None
+
+        offset = self.offsets[step]
+
+        for i in xrange(line % INDEX_STEP):
+            newline = data.find('\n', offset, self.indexed_to)
+
+            if newline == -1:
+                return None
+
+            offset = newline + 1
+
+        if offset >= self.indexed_to:
+            return None
+
+        return offset
+
+    def line_of_offset(self, data, offset):
+        """Line offset is in, None if it's not indexed yet."""
+        if offset >= self.indexed_to:
+            return None
+
+        # Taken first, as the indexer might be adding to it
+        offsets = self.offsets[:]
+        step = bisect.bisect_right(offsets, offset) - 1
+        return step * INDEX_STEP + data[offsets[step]:offset].count('\n')
+
+
+class LineIndexCache(object):
+    """
+    Line indices of the last max_files files viewed, by path, and only
+    handed out while the file's stamp (see PagedFile.stamp()) stays the
+    same, so that viewing the same file again takes no indexing. Indices
+    of files that were not indexed to the end are kept too, indexing them
+    goes on from where it stopped.
+    """
+    def __init__(self, max_files=16):
+        self.max_files = max_files
+
+        # path -> (stamp, LineIndex)
+        self._indices = {}
+
+        # Paths, the least recently used first
+        self._lru = []
+
+    def __len__(self):
+        return len(self._indices)
+
+    def get(self, path, stamp):
+        """The index of the file, a new empty one if there's none yet."""
+        cached = self._indices.get(os.path.abspath(path))
+
+        if cached is not None and cached[0] == stamp:
+            index = cached[1]
+        else:
+            index = LineIndex()
+
+        self.put(path, stamp, index)
+        return index
+
+    def put(self, path, stamp, index):
+        """
+        Keeps index for the file, e.g. one that was made for it before it
+        grew (all of which is still good for it then).
+        """
+        path = os.path.abspath(path)
+
+        if path in self._indices:
+            self._lru.remove(path)
+
+        self._indices[path] = (stamp, index)
+        self._lru.append(path)
+
+        while len(self._lru) > self.max_files:
+            del self._indices[self._lru.pop(0)]
+
+
+class LineIndexer(threading.Thread):
+    """
+    Indexes the lines of paged (a paged_file.PagedFile) into index, from
+    where index got up to, to the end of the file. What's indexed can be
+    used as it goes.
+
+    Calls on_progress(indexer) now and then, and on_done(indexer) at the
+    end, both on the indexer's thread.
+    """
+    def __init__(self, index, paged, on_progress, on_done,
+                 chunk_size=CHUNK_SIZE):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.index = index
+        self.data = paged.data
+        self.size = paged.size
+        self.chunk_size = chunk_size
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._cancelled = threading.Event()
+        self._last_progress = time.time()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.isSet()
+
+    def _index_chunk(self, start, chunk):
+        index = self.index
+        num_newlines = chunk.count('\n')
+        count = num_newlines
+
+        # Newlines left to go through to the next line to record
+        to_next = INDEX_STEP - index.num_newlines % INDEX_STEP
+        pos = 0
+
+        while count >= to_next:
+            for i in xrange(to_next):
+                pos = chunk.find('\n', pos) + 1
+
+            index.offsets.append(start + pos)
+            count -= to_next
+            to_next = INDEX_STEP
+
+        # The offsets first: whatever is below indexed_to must be in them
+        index.num_newlines += num_newlines
+        index.unterminated = chunk[-1] != '\n'
+        index.indexed_to = start + len(chunk)
+
+    def run(self):
+        start = self.index.indexed_to
+
+        while start < self.size and not self.is_cancelled():
+            end = min(start + self.chunk_size, self.size)
+            self._index_chunk(start, self.data[start:end])
+            start = end
+
+            if time.time() - self._last_progress >= PROGRESS_INTERVAL:
+                self._last_progress = time.time()
+                self._on_progress(self)
+
+        self._on_done(self)
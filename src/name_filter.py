@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Expressions to filter listings by names with. An expression is a list of
+# whitespace separated terms. A name passes when it matches any of the
+# positive terms (or there are none) and none of the negated ones:
+#
+#   foo          names containing 'foo'
+#   *.py         glob, matching the whole name
+#   re:^a\d+     regular expression, searched for in the name
+#   ext:py,txt   names with any of these extensions
+#   !term        negation of any of the above
+#
+# Matching is case-insensitive. Every term is compiled into a regex once,
+# and a listing is evaluated by running each regex over all of the names,
+# lowercased and joined by newlines, instead of calling a function per
+# name.
+
+import re
+
+
+GLOB_CHARS = '*?['
+
+
+class FilterError(Exception):
+    pass
+
+
+def glob_to_regex(glob):
+    """
+    Translates glob to a regex matching the same names (unanchored). None
+    of its parts match a newline.
+    """
+    parts = []
+    i = 0
+    n = len(glob)
+
+    while i < n:
+        char = glob[i]
+        i += 1
+
+        if char == '*':
+            parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        elif char == '[':
+            j = i
+
+            if j < n and glob[j] == '!':
+                j += 1
+
+            if j < n and glob[j] == ']':
+                j += 1
+
+            j = glob.find(']', j)
+
+            if j == -1:
+                parts.append('\\[')
+            else:
+                chars = glob[i:j].replace('\\', '\\\\')
+                i = j + 1
+
+                if chars.startswith('!'):
+                    chars = '^\\n' + chars[1:]
+                elif chars.startswith('^'):
+                    chars = '\\' + chars
+
+                parts.append('[%s]' % chars)
+        else:
+            parts.append(re.escape(char))
+
+    return ''.join(parts)
+
+
+class Term(object):
+    """
+    One term of an expression, matched against lowercased names. Raises
+    FilterError if it is malformed.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.negated = text.startswith('!') and len(text) > 1
+
+        if self.negated:
+            text = text[1:]
+
+        # Only a user's regex can match across the newline between names,
+        # e.g. with '[^x]'
+        self.may_span_names = False
+        flags = re.UNICODE | re.MULTILINE
+
+        if text.startswith('re:'):
+            pattern = text[3:]
+            flags |= re.IGNORECASE
+            self.may_span_names = True
+        elif text.startswith('ext:'):
+            exts = [re.escape(e) for e in text[4:].lower().split(',') if e]
+            pattern = '\\.(?:%s)$' % '|'.join(exts)
+        elif [c for c in GLOB_CHARS if c in text]:
+            pattern = '^%s$' % glob_to_regex(text.lower())
+        else:
+            pattern = re.escape(text.lower())
+
+        try:
+            self.regex = re.compile(pattern, flags)
+
+            # Swallows the rest of the line too, so that finditer goes on
+            # with the next name
+            self.line_regex = re.compile('(?:%s)[^\\n]*' % pattern, flags)
+        except re.error, e:
+            raise FilterError(u'Bad filter term \'%s\': %s' % (self.text, e))
+
+    def matches(self, name):
+        return self.regex.search(name.lower()) is not None
+
+    def matching_lines(self, buf, names):
+        """
+        Returns the indices of the names that match, buf being the names
+        lowercased and joined by newlines.
+        """
+        if self.may_span_names:
+            return self._matching_lines_checked(buf, names)
+
+        matched = []
+        count = buf.count
+        index = 0
+        counted = 0
+
+        for match in self.line_regex.finditer(buf):
+            start = match.start()
+            index += count('\n', counted, start)
+            counted = start
+            matched.append(index)
+
+        return matched
+
+    def _matching_lines_checked(self, buf, names):
+        matched = []
+        search = self.regex.search
+        index = 0
+        counted = 0
+        pos = 0
+
+        while True:
+            match = search(buf, pos)
+
+            if match is None:
+                break
+
+            start = match.start()
+            index += buf.count('\n', counted, start)
+            counted = start
+            line_end = buf.find('\n', start)
+
+            if line_end == -1:
+                line_end = len(buf)
+
+            # A match running into the next name doesn't count, but there
+            # may be another one within the name
+            if match.end() <= line_end or self.matches(names[index]):
+                matched.append(index)
+
+            # Searching from past the end would find an empty match at the
+            # end again, forever
+            if line_end >= len(buf):
+                break
+
+            pos = line_end + 1
+
+        return matched
+
+
+class NameFilter(object):
+    def __init__(self, expression):
+        """Raises FilterError if expression is malformed."""
+        self.expression = expression
+        terms = [Term(t) for t in expression.split()]
+        self.positive = [t for t in terms if not t.negated]
+        self.negative = [t for t in terms if t.negated]
+
+    def matches(self, name):
+        for term in self.negative:
+            if term.matches(name):
+                return False
+
+        if not self.positive:
+            return True
+
+        for term in self.positive:
+            if term.matches(name):
+                return True
+
+        return False
+
+    def select(self, names):
+        """Returns the sorted indices of the names that pass the filter."""
+        if not names:
+            return []
+
+        try:
+            buf = u'\n'.join(names).lower()
+        except UnicodeDecodeError:
+            # Names undecodable in the filesystem encoding come as byte
+            # strings, which don't mix with the others
+            buf = None
+
+        if buf is None or buf.count(u'\n') != len(names) - 1:
+            # Names with newlines in them would break the line mapping
+            return [i for i, name in enumerate(names) if self.matches(name)]
+
+        rejected = set()
+
+        for term in self.negative:
+            rejected.update(term.matching_lines(buf, names))
+
+        if not self.positive:
+            return [i for i in xrange(len(names)) if i not in rejected]
+
+        if len(self.positive) == 1 and not rejected:
+            return self.positive[0].matching_lines(buf, names)
+
+        selected = set()
+
+        for term in self.positive:
+            selected.update(term.matching_lines(buf, names))
+
+        selected = list(selected - rejected)
+        selected.sort()
+        return selected
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Viewing files far too big to be read whole. The file is mmap'ed, and
+# lines are only ever looked for around the part of it being looked at, so
+# opening a file and moving around in it take the same time whatever its
+# size. Files being followed are read instead, see PagedFile.set_following().
+
+import os
+import mmap
+import threading
+
+
+# Lines longer than this are cut into pieces this long, so that finding
+# where a line starts never takes scanning more than this much of the file
+# (think of a multi-GB file without a single newline)
+MAX_LINE_LENGTH = 64 * 1024
+
+# What PagedFile.refresh() finds happened to the file
+GREW = 'grew'
+TRUNCATED = 'truncated'
+REPLACED = 'replaced'
+
+# How much of the file FileBytes.find() and rfind() read at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class FileBytes(object):
+    """
+    The bytes of an open file, read with os.read() rather than mapped, with
+    the methods of mmap the viewer uses. Reading the part of a map past the
+    end of a file that got truncated kills the process with SIGBUS, reading
+    the file there just comes out short.
+    """
+    def __init__(self, f, size):
+        # A descriptor of its own, as the file might get closed (rotated
+        # away) while a search is still reading this
+        self._fd = os.dup(f.fileno())
+        self._lock = threading.Lock()
+        self.size = size
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(self.size)
+        pieces = []
+
+        # The descriptor has a single position, readers take turns with it
+        self._lock.acquire()
+
+        try:
+            os.lseek(self._fd, start, 0)
+
+            while start < stop:
+                piece = os.read(self._fd, stop - start)
+
+                if not piece:
+                    # Got truncated
+                    break
+
+                pieces.append(piece)
+                start += len(piece)
+        finally:
+            self._lock.release()
+
+        return ''.join(pieces)
+
+    def find(self, sub, start=0, end=None):
+        if end is None or end > self.size:
+            end = self.size
+
+        while start < end:
+            chunk_end = min(start + READ_CHUNK_SIZE + len(sub) - 1, end)
+            found = self[start:chunk_end].find(sub)
+
+            if found != -1:
+                return start + found
+
+            start += READ_CHUNK_SIZE
+
+        return -1
+
+    def rfind(self, sub, start=0, end=None):
+        if end is None or end > self.size:
+            end = self.size
+
+        stop = end
+
+        while stop > start:
+            chunk_start = max(stop - READ_CHUNK_SIZE, start)
+            chunk_end = min(stop + len(sub) - 1, end)
+            found = self[chunk_start:chunk_end].rfind(sub)
+
+            if found != -1:
+                return chunk_start + found
+
+            stop = chunk_start
+
+        return -1
+
+
+class PagedFile(object):
+    """
+    A file seen as lines. Lines are addressed by the offset of their first
+    byte, there's no telling which line number that is without reading
+    everything before it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+
+        # Whether the file is read rather than mapped, and the FileBytes
+        # reading it then (one per file, see set_following())
+        self._following = False
+        self._bytes = None
+        self._map()
+
+        # What went wrong reading the file, if anything
+        self.error = None
+
+    def _map(self):
+        st = os.fstat(self._file.fileno())
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self._id = (st.st_dev, st.st_ino)
+
+        # The old map is not closed, a search might still be reading it.
+        # It's unmapped when the last reference to it goes.
+        if self._following:
+            if self._bytes is None:
+                self._bytes = FileBytes(self._file, self.size)
+
+            # Kept for as long as the file is, readers of it share its
+            # position in the file
+            self._bytes.size = self.size
+            self.data = self._bytes
+        elif self.size > 0:
+            self.data = mmap.mmap(self._file.fileno(), self.size,
+                                  access=mmap.ACCESS_READ)
+        else:
+            # Empty files can't be mmap'ed
+            self.data = ''
+
+    def stamp(self):
+        """Size and mtime of the file, which change when it does."""
+        return self.size, self.mtime
+
+    def is_loading(self):
+        """Whether the file is still being read (see CompressedFile)."""
+        return False
+
+    def needs_refresh(self):
+        """
+        Whether refresh() has to be called every so often. A mapped file
+        can get truncated under the map any time, see refresh().
+        """
+        return True
+
+    def set_following(self, following):
+        """
+        Reads the file rather than mapping it if following: followed files
+        are logs, which get rotated by copying and truncating them, and the
+        map can be read past their new end (see refresh()) by anything
+        reading it before refresh() gets called. Whatever is reading data
+        in background has to start over with the new one.
+        """
+        if following != self._following:
+            self._following = following
+            self._bytes = None
+            self._map()
+
+    def refresh(self):
+        """
+        Catches up with the file having changed since it was opened or last
+        refreshed. Returns GREW if it got longer (only the bytes after the
+        old size are new then), TRUNCATED if it got shorter, REPLACED if
+        there's another file at path now (a rotated log), None if nothing
+        changed.
+
+        Note that reading the part of the map past the end of a file that
+        got truncated kills the process with SIGBUS, refresh() has to be
+        called often enough for as long as the file is open, unless it's
+        being followed.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # Rotated away, and the new one is not there yet
+            st = None
+
+        if st is not None and (st.st_dev, st.st_ino) != self._id:
+            try:
+                new_file = open(self.path, 'rb')
+            except IOError:
+                return None
+
+            self._file.close()
+            self._file = new_file
+            self._bytes = None
+            self._map()
+            return REPLACED
+
+        old_size = self.size
+        new_size = os.fstat(self._file.fileno()).st_size
+
+        if new_size == old_size:
+            return None
+
+        self._map()
+
+        if self.size > old_size:
+            return GREW
+
+        return TRUNCATED
+
+    def close(self):
+        if not isinstance(self.data, str):
+            self.data.close()
+
+        self._file.close()
+
+    def next_line(self, offset):
+        """Offset of the line after the one starting at offset."""
+        end = min(offset + MAX_LINE_LENGTH, self.size)
+        newline = self.data.find('\n', offset, end)
+
+        if newline == -1:
+            return end
+
+        return newline + 1
+
+    def prev_line(self, offset):
+        """Offset of the line before the one starting at offset."""
+        if offset <= 0:
+            return 0
+
+        newline = self.data.rfind('\n', max(0, offset - 1 - MAX_LINE_LENGTH),
+                                  offset - 1)
+
+        if newline == -1:
+            return max(0, offset - MAX_LINE_LENGTH)
+
+        return newline + 1
+
+    def line_start(self, offset):
+        """Offset of the line offset is in."""
+        offset = max(0, min(offset, self.size))
+        limit = max(0, offset - MAX_LINE_LENGTH)
+        newline = self.data.rfind('\n', limit, offset)
+
+        if newline != -1:
+            return newline + 1
+
+        if limit == 0:
+            return 0
+
+        # Deep inside an overlong line: it starts here as far as we care
+        return offset
+
+    def is_end(self, offset):
+        """Whether there are no more lines starting at offset or after."""
+        return offset >= self.size
+
+    def lines_before(self, offset, count):
+        """Offset of the line count lines before the one at offset."""
+        for i in xrange(count):
+            if offset <= 0:
+                break
+
+            offset = self.prev_line(offset)
+
+        return offset
+
+    def last_lines(self, count):
+        """Offset of the first of the last count lines."""
+        return self.lines_before(self.size, count)
+
+    def read_lines(self, offset, count):
+        """
+        Reads up to count lines starting at offset. Returns the offsets
+        they start at, the lines (without the line ends) and the offset of
+        the line after the last one read.
+        """
+        offsets = []
+        lines = []
+
+        while len(lines) < count and not self.is_end(offset):
+            next = self.next_line(offset)
+            offsets.append(offset)
+            lines.append(self.data[offset:next].rstrip('\r\n'))
+            offset = next
+
+        return offsets, lines, offset
+
+
+def parse_offset(text, size):
+    """
+    Reads an offset into a file of size bytes from text: decimal, hex
+    (0x...) or a percentage of the size (50%). Raises ValueError if it's
+    neither, or not in the file.
+    """
+    text = text.strip().lower()
+
+    if text.endswith('%'):
+        offset = int(float(text[:-1]) * size / 100)
+    elif text.startswith('0x'):
+        offset = int(text[2:], 16)
+    else:
+        offset = int(text)
+
+    if offset < 0 or offset > size:
+        raise ValueError('%d is not in the file' % (offset))
+
+    return offset
+
+
+BYTES_PER_ROW = 16
+
+# Byte -> what stands for it in the text column of the hex view
+_PRINTABLE = ''.join([32 <= i < 127 and chr(i) or '.' for i in range(256)])
+
+
+def format_row(offset, row):
+    """One row of the hex view: offset, the bytes in hex and as text."""
+    hex_bytes = ['%02x' % ord(byte) for byte in row]
+
+    # An extra space in the middle, as hexdump -C does it
+    hex_column = ' '.join(hex_bytes[:8]) + '  ' + ' '.join(hex_bytes[8:])
+    return '%08x  %-*s  |%s|' % (offset, BYTES_PER_ROW * 3, hex_column,
+                                 row.translate(_PRINTABLE))
+
+
+class HexRows(object):
+    """
+    A PagedFile seen as rows of BYTES_PER_ROW bytes in hex, with the same
+    methods as PagedFile has for lines. Rows are where they are, so none of
+    them takes looking at the file, only formatting the rows read does.
+    """
+    def __init__(self, paged):
+        self.paged = paged
+
+    def _get_size(self):
+        return self.paged.size
+
+    # Follows the size of the file as it gets refreshed
+    size = property(_get_size)
+
+    def line_start(self, offset):
+        offset = max(0, min(offset, self.size))
+        return offset - offset % BYTES_PER_ROW
+
+    def next_line(self, offset):
+        return min(offset + BYTES_PER_ROW, self.size)
+
+    def prev_line(self, offset):
+        return self.line_start(max(0, offset - 1))
+
+    def is_end(self, offset):
+        return offset >= self.size
+
+    def lines_before(self, offset, count):
+        return max(0, self.line_start(offset) - count * BYTES_PER_ROW)
+
+    def last_lines(self, count):
+        if self.size == 0:
+            return 0
+
+        last_row = self.line_start(self.size - 1)
+        return max(0, last_row - (count - 1) * BYTES_PER_ROW)
+
+    def read_lines(self, offset, count):
+        offset = self.line_start(offset)
+        end = min(offset + count * BYTES_PER_ROW, self.size)
+        data = self.paged.data[offset:end]
+        offsets = range(offset, end, BYTES_PER_ROW)
+        rows = [format_row(o, data[o - offset:o - offset + BYTES_PER_ROW])
+                for o in offsets]
+        return offsets, rows, end
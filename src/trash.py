@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Moving files to the trash the way desktops do (the freedesktop.org Trash
+# specification), and a journal of what was moved where, kept on disk so
+# that the last batch can be put back, even after a restart.
+
+import os
+import time
+import errno
+import urllib
+import logging
+import threading
+
+
+def home_trash_dir():
+    data_home = os.environ.get('XDG_DATA_HOME') \
+                or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data_home, 'Trash')
+
+
+def _mount_point(path):
+    path = os.path.realpath(path)
+    dev = os.lstat(path).st_dev
+
+    while True:
+        parent = os.path.dirname(path)
+
+        if parent == path or os.lstat(parent).st_dev != dev:
+            return path
+
+        path = parent
+
+
+def trash_dir_for(path):
+    """
+    The trash to move path into without copying: the home trash if it's on
+    the same filesystem, $topdir/.Trash-$uid of path's filesystem otherwise.
+    """
+    home_trash = home_trash_dir()
+    dev = os.lstat(path).st_dev
+    existing = home_trash
+
+    # The home trash may not have been made yet
+    while not os.path.exists(existing):
+        existing = os.path.dirname(existing)
+
+    if os.lstat(existing).st_dev == dev:
+        return home_trash
+
+    top_dir = _mount_point(os.path.dirname(os.path.abspath(path)))
+    return os.path.join(top_dir, '.Trash-%d' % (os.getuid()))
+
+
+def _make_dirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+
+
+def _quote(path):
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+
+    return urllib.quote(path, safe='/')
+
+
+def _unquote(text, as_unicode):
+    path = urllib.unquote(text)
+
+    if as_unicode:
+        return path.decode('utf-8')
+
+    return path
+
+
+def reserve_in_trash(path, trash_dir=None):
+    """
+    Picks the name path gets in trash_dir (trash_dir_for(path) by default)
+    and writes the .trashinfo file that lets desktops restore it, without
+    moving path yet (see finish_move_to_trash()). Returns the path it is
+    to end up at, and that of the .trashinfo file.
+    """
+    path = os.path.abspath(path)
+
+    if trash_dir is None:
+        trash_dir = trash_dir_for(path)
+
+    files_dir = os.path.join(trash_dir, 'files')
+    info_dir = os.path.join(trash_dir, 'info')
+    _make_dirs(files_dir)
+    _make_dirs(info_dir)
+
+    base_name = os.path.basename(path.rstrip(os.sep))
+    info = '[Trash Info]\nPath=%s\nDeletionDate=%s\n' \
+           % (_quote(path), time.strftime('%Y-%m-%dT%H:%M:%S'))
+    number = 1
+
+    # Creating the info file exclusively is what reserves the name
+    while True:
+        name = base_name
+
+        if number > 1:
+            name = '%s.%d' % (base_name, number)
+
+        info_path = os.path.join(info_dir, name + '.trashinfo')
+
+        try:
+            fd = os.open(info_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0600)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+            number += 1
+            continue
+
+        trashed = os.path.join(files_dir, name)
+
+        if os.path.lexists(trashed):
+            os.close(fd)
+            os.remove(info_path)
+            number += 1
+            continue
+
+        break
+
+    try:
+        os.write(fd, info)
+    finally:
+        os.close(fd)
+
+    return trashed, info_path
+
+
+def cancel_reservation(info_path):
+    try:
+        os.remove(info_path)
+    except OSError:
+        pass
+
+
+def finish_move_to_trash(path, trashed, info_path):
+    """Moves path to where reserve_in_trash() said, or drops the info."""
+    try:
+        os.rename(os.path.abspath(path), trashed)
+    except OSError:
+        cancel_reservation(info_path)
+        raise
+
+
+def move_to_trash(path, trash_dir=None):
+    """
+    Moves path into trash_dir (trash_dir_for(path) by default), along with
+    its .trashinfo file. Returns the path it ends up at.
+    """
+    trashed, info_path = reserve_in_trash(path, trash_dir)
+    finish_move_to_trash(path, trashed, info_path)
+    return trashed
+
+
+def restore_from_trash(trashed, original):
+    """Moves trashed back to original and drops its .trashinfo."""
+    if os.path.lexists(original):
+        raise OSError(errno.EEXIST, 'Already exists', original)
+
+    os.rename(trashed, original)
+
+    files_dir, name = os.path.split(trashed)
+    info_path = os.path.join(os.path.dirname(files_dir), 'info',
+                             name + '.trashinfo')
+
+    try:
+        os.remove(info_path)
+    except OSError:
+        pass
+
+
+def _format_entry(batch, original, trashed):
+    # 'u' marks paths that were unicode, to get them back the same way
+    kind = 'b'
+
+    if isinstance(original, unicode):
+        kind = 'u'
+
+    return '%d\t%s\t%s\t%s\n' % (batch, kind, _quote(original),
+                                  _quote(trashed))
+
+
+class Journal(object):
+    """
+    What got moved to the trash, a line per item: the number of the batch
+    (one per trashing command), the original path and the trashed path,
+    URL-quoted. Lines are appended as items are trashed, so the journal is
+    accurate up to the last item even if Candy exits halfway.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Raises IOError or OSError if the journal can't be read or there's
+        no making the directory it goes in.
+        """
+        self._lock.acquire()
+
+        try:
+            _make_dirs(os.path.dirname(os.path.abspath(self.path)))
+            self._read()
+        finally:
+            self._lock.release()
+
+    def _read(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+
+        entries = []
+
+        try:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+
+                # A line cut short by a crash
+                if len(parts) != 4:
+                    continue
+
+                batch, kind, original, trashed = parts
+                as_unicode = kind == 'u'
+                entries.append((int(batch), _unquote(original, as_unicode),
+                                _unquote(trashed, as_unicode)))
+        finally:
+            f.close()
+
+        return entries
+
+    def new_batch(self):
+        """Number for the next batch of items to record."""
+        self._lock.acquire()
+
+        try:
+            entries = self._read()
+
+            if not entries:
+                return 1
+
+            return entries[-1][0] + 1
+        finally:
+            self._lock.release()
+
+    def record(self, batch, original, trashed):
+        line = _format_entry(batch, original, trashed)
+        self._lock.acquire()
+
+        try:
+            _make_dirs(os.path.dirname(os.path.abspath(self.path)))
+            f = open(self.path, 'ab')
+
+            try:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+
+    def last_batch(self):
+        """(batch, [(original, trashed)...]) of the last batch, or None."""
+        self._lock.acquire()
+
+        try:
+            entries = self._read()
+        finally:
+            self._lock.release()
+
+        if not entries:
+            return None
+
+        batch = entries[-1][0]
+        return batch, [(o, t) for b, o, t in entries if b == batch]
+
+    def forget(self, batch, items):
+        """Drops the (original, trashed) items of batch from the journal."""
+        items = set(items)
+        self._lock.acquire()
+
+        try:
+            entries = [e for e in self._read()
+                       if e[0] != batch or (e[1], e[2]) not in items]
+            temp_path = self.path + '.tmp'
+            f = open(temp_path, 'wb')
+
+            try:
+                for entry in entries:
+                    f.write(_format_entry(*entry))
+            finally:
+                f.close()
+
+            os.rename(temp_path, self.path)
+        finally:
+            self._lock.release()
+
+
+def open_journal(path):
+    """
+    The Journal in path, None if it can't be used (logged). Trashing can't
+    be undone without it, so there's no trashing then.
+    """
+    journal = Journal(path)
+
+    try:
+        journal.check()
+    except (OSError, IOError), e:
+        logging.error("Can't use trash journal %s: %s", path, e)
+        return None
+
+    return journal
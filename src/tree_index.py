@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Persistent index of directory trees, so that the flat view of a huge tree
+# doesn't need to read every directory in it. The index keeps the entries
+# of each directory along with the directory's mtime and ctime. A directory
+# is only read again when these have changed, which costs a stat() per
+# directory instead of reading all of it.
+#
+# Note that a directory's mtime only changes when entries get added,
+# removed or renamed, so sizes and mtimes of the files themselves may be
+# outdated. Only the names and types are to be relied upon.
+
+import os
+import sys
+import stat
+import time
+import logging
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    ctime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    dir_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    is_link INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_by_dir ON entries (dir_id);
+'''
+
+# Rescanned directories are committed at least this often (in seconds).
+# The write lock is held until then, and another walk or update of the
+# index waits for it for TreeIndex.connect()'s timeout at most.
+COMMIT_INTERVAL = 1.0
+
+# Directories modified less than this many seconds ago are not stored, as
+# another change could come within the same timestamp (same as with
+# data.ListingCache)
+RACY_SECONDS = 2
+
+
+class TreeIndexError(Exception):
+    pass
+
+
+def index_available():
+    return sqlite3 is not None
+
+
+def open_index(file_name):
+    """
+    The TreeIndex in file_name, made if it's not there yet. None if that
+    fails (logged), flat views do without it.
+    """
+    try:
+        return TreeIndex(file_name)
+    except (OSError, IOError, sqlite3.Error), e:
+        logging.error("Can't use tree index %s: %s", file_name, e)
+        return None
+
+
+def read_dir_with_stats(path):
+    """
+    Returns a list of (name, is_dir, is_link, size, mtime) for every entry
+    in path.
+    """
+    entries = []
+
+    for name in os.listdir(path):
+        full_path = os.path.join(path, name)
+
+        try:
+            st = os.lstat(full_path)
+        except OSError:
+            # Vanished in the meantime
+            continue
+
+        is_link = stat.S_ISLNK(st.st_mode)
+        is_dir = stat.S_ISDIR(st.st_mode) \
+                 or (is_link and os.path.isdir(full_path))
+        entries.append((name, is_dir, is_link, st.st_size, st.st_mtime))
+
+    return entries
+
+
+class TreeIndex(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+        dir_name = os.path.dirname(file_name)
+
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+
+        conn = self.connect()
+
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def connect(self):
+        # Walks are started on the UI thread and continued on a scanner
+        # thread, hence check_same_thread. A connection is never used by two
+        # threads at once, though.
+        return sqlite3.connect(self.file_name, timeout=30,
+                               check_same_thread=False)
+
+    def covers(self, path):
+        """
+        Tells whether path has ever been indexed. An index that can't be
+        read covers nothing.
+        """
+        try:
+            conn = self.connect()
+
+            try:
+                cursor = conn.execute('SELECT 1 FROM dirs WHERE path = ?',
+                                      (os.path.abspath(path),))
+                return cursor.fetchone() is not None
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+
+    def walk(self, root, settings):
+        return IndexedWalker(self, root, settings)
+
+    def update(self, root, settings):
+        """
+        Brings the index of the tree under root up to date. Returns the
+        number of directories that had to be read. Raises TreeIndexError if
+        the index couldn't be written to.
+        """
+        walker = self.walk(root, settings)
+
+        for entry in walker:
+            pass
+
+        if walker.error is not None:
+            raise TreeIndexError(walker.error)
+
+        return walker.num_dirs_read
+
+
+class IndexedWalker(object):
+    """
+    Yields the same entries data.ParallelWalker does, with the same
+    settings, but takes the directories that did not change from the index.
+    The ones that did change are read and put in the index on the way.
+    """
+    def __init__(self, index, root, settings):
+        self.index = index
+
+        if not isinstance(root, unicode):
+            root = root.decode(sys.getfilesystemencoding() or 'utf-8')
+
+        self.root = os.path.abspath(root)
+        self.settings = settings
+        self.truncated = False
+        self.num_dirs_read = 0
+        self._excluded = settings.exclude_matcher()
+        self._cancelled = threading.Event()
+        self._last_commit = None
+
+        # What went wrong with the index, if anything. The rest of the walk
+        # reads the directories without it then.
+        self.error = None
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _index_failed(self, conn, error):
+        # Locked by another writer for longer than the timeout, or broken
+        self.error = u'Tree index not used: %s' % error
+
+        if conn is not None:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+
+    def _lookup_dir(self, conn, path, st):
+        """
+        Returns the id of path in the index (None if it isn't there) and its
+        entries, if they are still up to date.
+        """
+        row = conn.execute('SELECT id, mtime, ctime FROM dirs WHERE path = ?',
+                           (path,)).fetchone()
+
+        if row is None:
+            return None, None
+
+        if row[1] == st.st_mtime and row[2] == st.st_ctime:
+            return row[0], conn.execute('SELECT name, is_dir, is_link, size, '
+                                        'mtime FROM entries WHERE dir_id = ?',
+                                        (row[0],)).fetchall()
+
+        return row[0], None
+
+    def _forget_dir(self, conn, path):
+        # Drops the directory along with everything that was under it
+        escaped = path.replace('\\', '\\\\').replace('%', '\\%')
+        escaped = escaped.replace('_', '\\_')
+        pattern = escaped.rstrip(os.sep) + os.sep + '%'
+        query = 'SELECT id FROM dirs WHERE path = ? ' \
+                'OR path LIKE ? ESCAPE \'\\\''
+        ids = [row[0] for row in conn.execute(query, (path, pattern))]
+
+        for dir_id in ids:
+            conn.execute('DELETE FROM entries WHERE dir_id = ?', (dir_id,))
+            conn.execute('DELETE FROM dirs WHERE id = ?', (dir_id,))
+
+    def _store_dir(self, conn, path, st, entries, old_dir_id):
+        if old_dir_id is not None:
+            old_subdirs = conn.execute('SELECT name FROM entries '
+                                       'WHERE dir_id = ? AND is_dir = 1',
+                                       (old_dir_id,))
+            new_names = set([e[0] for e in entries if e[1]])
+
+            for (name,) in old_subdirs.fetchall():
+                if name not in new_names:
+                    self._forget_dir(conn, os.path.join(path, name))
+
+            conn.execute('DELETE FROM entries WHERE dir_id = ?',
+                         (old_dir_id,))
+            conn.execute('UPDATE dirs SET mtime = ?, ctime = ? WHERE id = ?',
+                         (st.st_mtime, st.st_ctime, old_dir_id))
+            dir_id = old_dir_id
+        else:
+            cursor = conn.execute('INSERT INTO dirs (path, mtime, ctime) '
+                                  'VALUES (?, ?, ?)',
+                                  (path, st.st_mtime, st.st_ctime))
+            dir_id = cursor.lastrowid
+
+        conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                         [(dir_id,) + tuple(e) for e in entries])
+
+    def _entries_of(self, conn, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        dir_id = None
+
+        if self.error is None:
+            try:
+                dir_id, entries = self._lookup_dir(conn, path, st)
+            except sqlite3.Error, e:
+                self._index_failed(conn, e)
+            else:
+                if entries is not None:
+                    return entries
+
+        try:
+            entries = read_dir_with_stats(path)
+        except OSError:
+            return None
+
+        self.num_dirs_read += 1
+
+        if self.error is not None or time.time() - st.st_mtime < RACY_SECONDS:
+            return entries
+
+        # Names that aren't valid in the filesystem encoding come as byte
+        # strings, which can't go into the index. Such directories are
+        # read every time.
+        for entry in entries:
+            if not isinstance(entry[0], unicode):
+                return entries
+
+        try:
+            self._store_dir(conn, path, st, entries, dir_id)
+
+            if time.time() - self._last_commit >= COMMIT_INTERVAL:
+                conn.commit()
+                self._last_commit = time.time()
+        except sqlite3.Error, e:
+            self._index_failed(conn, e)
+
+        return entries
+
+    def __iter__(self):
+        try:
+            conn = self.index.connect()
+        except sqlite3.Error, e:
+            conn = None
+            self._index_failed(conn, e)
+
+        self._last_commit = time.time()
+        max_depth = self.settings.max_depth
+        max_entries = self.settings.max_entries
+        num_entries = 0
+        dirs_to_visit = [(self.root, 0)]
+
+        try:
+            while dirs_to_visit and not self._cancelled.isSet():
+                path, depth = dirs_to_visit.pop()
+                entries = self._entries_of(conn, path)
+
+                if entries is None:
+                    continue
+
+                descend = max_depth is None or depth < max_depth
+
+                for name, is_dir, is_link, size, mtime in entries:
+                    if self._excluded and self._excluded(name):
+                        continue
+
+                    # Same rules as in data.iter_recursive_dir
+                    if is_dir:
+                        if not is_link and descend:
+                            dirs_to_visit.append((os.path.join(path, name),
+                                                  depth + 1))
+                        continue
+
+                    if max_entries is not None and num_entries >= max_entries:
+                        self.truncated = True
+                        return
+
+                    num_entries += 1
+                    yield name, path, False, bool(is_link)
+        finally:
+            if conn is not None:
+                if self.error is None:
+                    try:
+                        conn.commit()
+                    except sqlite3.Error, e:
+                        self._index_failed(conn, e)
+
+                conn.close()
@@ -68,11 +68,10 @@ def resolve_command_by_file_ext(ext):
         'bmp':  'gqview',
         'xpm':  'gqview',
         'gif':  'gqview',
-        # TODO: handle archives as folders
+        # zip and tar archives are browsed as folders (see archives.py), and
+        # compressed files can be viewed with F3 (see compressed.py)
         'rar':  'file-roller',
-        'zip':  'file-roller',
         'gz':   'file-roller',
-        'tar':  'file-roller',
         'txt':  'gvim'}
 
     try:
@@ -81,13 +80,15 @@ def resolve_command_by_file_ext(ext):
         return None
 
 
-def list_of_tuples(list, secondItem):
-    tuples = []
+def list_of_file_entries(names, path, is_dir=False):
+    # Produces the same (file_name, path, is_dir, is_link) tuples that
+    # data.list_files does
+    entries = []
 
-    for i in list:
-        tuples.append((i, secondItem))
+    for name in names:
+        entries.append((name, path, is_dir, False))
 
-    return tuples
+    return entries
 
 
 def is_root_of_drive(path):
@@ -105,12 +106,6 @@ def int_div_floor(a, b):
     return int(math.floor(float(a) / b))
 
 
-def wrapped_range(start, length):
-    # Construct a range of indices to produce wrapped search from
-    # given position
-    return range(start, length) + range(start)
-
-
 #==========================================================
 # Utilities for testing
 #==========================================================
@@ -130,7 +125,8 @@ def fake_file_lister(is_flat_directory_view, cwd):
     for i in range(5):
         hidden.append('.hid' + str(i))
 
-    return list_of_tuples(dirs + files + hidden, '.')
+    return list_of_file_entries(dirs, '.', True) \
+           + list_of_file_entries(files + hidden, '.')
 
 
 # This one produces only few items to test the case with a single column
@@ -148,7 +144,8 @@ def fake_file_lister2(is_flat_directory_view, cwd):
     for i in range(1):
         hidden.append('.hid' + str(i))
 
-    return list_of_tuples(dirs + files + hidden, '.')
+    return list_of_file_entries(dirs, '.', True) \
+           + list_of_file_entries(files + hidden, '.')
 
 
 def failing_file_lister(is_flat_directory_view, cwd):
@@ -18,25 +18,362 @@
 # along with Candy. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import bisect
+import re
+
 import wx
 import wx.stc as stc
 
+import compressed
+import file_search
+import line_index
+import paged_file
+
 
 faceCourier = 'Courier'
 pb = 12
 
+# Lines kept in the control at a time, and how close to either end of them
+# the view may get before the lines around it are loaded instead
+WINDOW_LINES = 1000
+WINDOW_MARGIN = 200
+
+# For showing the bytes of the file as text
+ENCODING = 'utf-8'
+
+# How often the file is checked for changes when following it, in ms
+FOLLOW_INTERVAL = 250
+
 
 class BuiltinViewerControl(stc.StyledTextCtrl):
+    """
+    Shows a window of WINDOW_LINES lines of a file, loading the lines
+    around the view instead as it gets near either end of them, so that
+    only a screenful or so of a file of any size is ever read.
+    """
     def __init__(self, parent, ID):
         stc.StyledTextCtrl.__init__(self, parent, ID)
 
         self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
         self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
+        self.Bind(stc.EVT_STC_UPDATEUI, self.OnUpdateUI)
 
         styleSpec = 'size:%d,face:%s' % (pb, faceCourier)
         self.StyleSetSpec(stc.STC_STYLE_DEFAULT, styleSpec)
         self.SetFocus()
 
+        # paged_file.PagedFile being shown
+        self.lines = None
+
+        # Offsets of the lines loaded into the control, and of the line
+        # after the last of them
+        self.line_offsets = []
+        self.window_end = 0
+
+        # Set while the text is being replaced, which scrolls the view
+        self._loading = False
+
+        # file_search.FileSearch running, the query of the last one, and
+        # (start, end) of the last match found
+        self.search = None
+        self.query = u''
+        self.last_match = None
+
+    def show_lines(self, lines):
+        self.lines = lines
+        self.load_window(0)
+
+    def is_hex(self):
+        return isinstance(self.lines, paged_file.HexRows)
+
+    def toggle_hex(self):
+        """Switches between the text and the hex view, at the same place."""
+        offset = self.current_offset()
+
+        if self.is_hex():
+            self.lines = self.lines.paged
+        else:
+            self.lines = paged_file.HexRows(self.lines)
+
+        self.line_offsets = []
+        self.go_to_offset(offset)
+
+    def ask_offset(self):
+        text = wx.GetTextFromUser(u'Offset (decimal, 0x for hex, or %):',
+                                  u'Go to offset', u'', self)
+
+        if not text:
+            return
+
+        try:
+            offset = paged_file.parse_offset(text, self.lines.size)
+        except ValueError, inst:
+            self.GetParent().status_bar.SetStatusText(unicode(inst))
+            return
+
+        self.go_to_offset(offset)
+
+    def ask_query(self, direction):
+        text = wx.GetTextFromUser(u'Search for (re: for a regex):',
+                                  u'Search', self.query, self)
+
+        if not text:
+            return
+
+        self.query = text
+        self.last_match = None
+        self.find(direction)
+
+    def find(self, direction):
+        """
+        Looks for the query from the caret on (or from the last match, if
+        the caret is still on its line), in a thread. The view jumps to the
+        match when it's found.
+        """
+        if not self.query or self.search is not None:
+            return
+
+        offset = self.current_offset()
+        last_match = self.last_match
+
+        if last_match is not None \
+           and self.lines.line_start(last_match[0]) == offset:
+            offset = last_match[0]
+
+            if direction == file_search.FORWARD:
+                offset += 1
+
+        status_bar = self.GetParent().status_bar
+        paged = self.lines
+
+        if self.is_hex():
+            paged = self.lines.paged
+
+        try:
+            search = file_search.FileSearch(paged,
+                                            self.query.encode(ENCODING),
+                                            offset, direction,
+                                            self._search_progress,
+                                            self._search_done)
+        except re.error, inst:
+            status_bar.SetStatusText(u'Bad regex: %s' % inst)
+            return
+
+        self.search = search
+        status_bar.SetStatusText(u'Searching... (Esc to cancel)')
+        search.start()
+
+    def cancel_search(self):
+        if self.search is not None:
+            self.search.cancel()
+
+    def stop_search(self):
+        """Cancels the search and waits for it to be done reading."""
+        search = self.search
+
+        if search is not None:
+            search.cancel()
+            search.join()
+            self.search = None
+
+    def _search_progress(self, search, offset):
+        wx.CallAfter(self._on_search_progress, search, offset)
+
+    def _search_done(self, search):
+        wx.CallAfter(self._on_search_done, search)
+
+    def _on_search_progress(self, search, offset):
+        # The viewer might have been closed by the time this gets called
+        if not self or search is not self.search:
+            return
+
+        percent = 100 * offset / max(search.size, 1)
+        self.GetParent().status_bar.SetStatusText(
+            u'Searching... %d%% (Esc to cancel)' % percent)
+
+    def _on_search_done(self, search):
+        if not self or search is not self.search:
+            return
+
+        self.search = None
+        status_bar = self.GetParent().status_bar
+
+        if search.is_cancelled():
+            status_bar.SetStatusText(u'Search cancelled')
+        elif search.match is None:
+            status_bar.SetStatusText(u'Not found: %s' % self.query)
+        else:
+            self.last_match = search.match
+            self.select_match(*search.match)
+
+    def select_match(self, start, end):
+        self.go_to_offset(start)
+
+        if self.is_hex():
+            return
+
+        # Positions in the control count the bytes of its UTF-8 text, which
+        # are the bytes of the file, as long as it's valid UTF-8
+        line = self.line_of_offset(start)
+        line_offset = self.line_offsets[line]
+        line_start = self.PositionFromLine(line)
+        line_end = self.GetLineEndPosition(line)
+        self.SetSelection(min(line_start + start - line_offset, line_end),
+                          min(line_start + end - line_offset, line_end))
+
+    def _decode(self, lines):
+        return u'\n'.join([line.decode(ENCODING, 'replace')
+                           for line in lines])
+
+    def load_window(self, start):
+        """Loads WINDOW_LINES lines starting at offset start."""
+        offsets, lines, end = self.lines.read_lines(start, WINDOW_LINES)
+        self.line_offsets = offsets
+        self.window_end = end
+        text = self._decode(lines)
+        self._loading = True
+
+        try:
+            self.SetReadOnly(False)
+            self.SetText(text)
+            self.SetReadOnly(True)
+            self.EmptyUndoBuffer()
+        finally:
+            self._loading = False
+
+    def append_lines(self):
+        """
+        Loads up to WINDOW_LINES of what got appended to the file after the
+        window, which has to reach what used to be the end of the file.
+        Only the new lines are added to the text, and lines from the start
+        of the window are dropped when it gets too long.
+        """
+        if not self.line_offsets:
+            self.load_window(0)
+            return
+
+        # The last line is read again, it might have been only partly
+        # written the last time
+        last = len(self.line_offsets) - 1
+        offsets, lines, end = self.lines.read_lines(self.line_offsets[last],
+                                                    WINDOW_LINES)
+        self.line_offsets[last:] = offsets
+        self.window_end = end
+        num_dropped = max(len(self.line_offsets) - 2 * WINDOW_LINES, 0)
+        self._loading = True
+
+        try:
+            self.SetReadOnly(False)
+            self.SetTargetStart(self.PositionFromLine(last))
+            self.SetTargetEnd(self.GetLength())
+            self.ReplaceTarget(self._decode(lines))
+
+            if num_dropped > 0:
+                self.SetTargetStart(0)
+                self.SetTargetEnd(self.PositionFromLine(num_dropped))
+                self.ReplaceTarget(u'')
+                del self.line_offsets[:num_dropped]
+
+            self.SetReadOnly(True)
+            self.EmptyUndoBuffer()
+        finally:
+            self._loading = False
+
+    def file_changed(self, change, old_size, pin=True):
+        """
+        Shows the file as it is after PagedFile.refresh() returned change,
+        with the view at its end if pin. old_size is what the size was
+        before.
+        """
+        if change == paged_file.GREW:
+            # Unless pinned, only filled up to a window, not to move the view
+            if self.window_end >= old_size \
+               and (pin or len(self.line_offsets) < WINDOW_LINES):
+                self.append_lines()
+
+            if not pin:
+                return
+
+            if self.lines.is_end(self.window_end):
+                self.GotoLine(max(len(self.line_offsets) - 1, 0))
+                return
+        else:
+            # Whatever was found or being looked for is gone. The search
+            # has to be done reading the old map before it's dropped: what
+            # it's reading might not be in the file any more.
+            self.stop_search()
+            self.last_match = None
+
+        # So much got appended that none of the window would be left, or
+        # what it had is not in the file any more
+        self.go_to_end()
+
+    def is_loaded(self, offset):
+        if not self.line_offsets:
+            return False
+
+        if self.lines.is_end(self.window_end):
+            return offset >= self.line_offsets[0]
+
+        return self.line_offsets[0] <= offset < self.window_end
+
+    def line_of_offset(self, offset):
+        """Line of the control the loaded offset is in."""
+        return max(0, bisect.bisect_right(self.line_offsets, offset) - 1)
+
+    def offset_of_line(self, line):
+        if not self.line_offsets:
+            return 0
+
+        return self.line_offsets[min(line, len(self.line_offsets) - 1)]
+
+    def current_offset(self):
+        """Offset of the line the caret is on."""
+        return self.offset_of_line(self.GetCurrentLine())
+
+    def go_to_offset(self, offset):
+        """Puts the caret on the line offset is in, loading it if needed."""
+        if not self.is_loaded(offset):
+            start = self.lines.line_start(offset)
+            self.load_window(self.lines.lines_before(start, WINDOW_LINES / 2))
+
+        self.GotoLine(self.line_of_offset(offset))
+
+    def go_to_start(self):
+        self.load_window(0)
+        self.GotoLine(0)
+
+    def go_to_end(self):
+        self.load_window(self.lines.last_lines(WINDOW_LINES))
+        self.GotoLine(max(len(self.line_offsets) - 1, 0))
+
+    def _reload_around(self, first_visible):
+        # Keeps both the caret and the view on the same lines of the file
+        first_offset = self.offset_of_line(first_visible)
+        caret_offset = self.current_offset()
+        self.load_window(self.lines.lines_before(first_offset,
+                                                 WINDOW_LINES / 2))
+        self.GotoLine(self.line_of_offset(caret_offset))
+        self.ScrollToLine(self.line_of_offset(first_offset))
+
+    def OnUpdateUI(self, evt):
+        evt.Skip()
+
+        if self._loading or not self.line_offsets:
+            return
+
+        first = self.GetFirstVisibleLine()
+        last = first + self.LinesOnScreen()
+
+        near_start = first < WINDOW_MARGIN and self.line_offsets[0] > 0
+        near_end = last > len(self.line_offsets) - WINDOW_MARGIN \
+                   and not self.lines.is_end(self.window_end)
+
+        if near_start or near_end:
+            self._reload_around(first)
+
+        self.GetParent().show_position(self.current_offset())
+
     def OnDestroy(self, evt):
         # This is how the clipboard contents can be preserved after
         # the app has exited.
@@ -52,33 +389,239 @@ class BuiltinViewerControl(stc.StyledTextCtrl):
 
         if key == 'Q':
             self.GetParent().OnCloseWindow(evt)
+        elif key == '/' and evt.ShiftDown():
+            self.ask_query(file_search.BACKWARD)
         elif key == '/':
-            self.searchMode = True
-            self.searchStr = ''
+            self.ask_query(file_search.FORWARD)
+        elif key == 'N' and evt.ShiftDown():
+            self.find(file_search.BACKWARD)
+        elif key == 'N':
+            self.find(file_search.FORWARD)
+        elif keyCode == wx.WXK_ESCAPE and self.search is not None:
+            self.cancel_search()
+        elif key == 'H':
+            self.toggle_hex()
+        elif key == 'G':
+            self.ask_offset()
+        elif key == 'F':
+            self.GetParent().toggle_follow()
+        elif key == 'L':
+            self.GetParent().ask_line()
+        elif keyCode == wx.WXK_HOME and evt.ControlDown():
+            self.go_to_start()
+        elif keyCode == wx.WXK_END and evt.ControlDown():
+            self.go_to_end()
+        else:
+            # Moving around is left to the control
+            evt.Skip()
 
 
 class BuiltinViewerFrame(wx.Frame):
     def __init__(self, parent, ID, title, file, pos=wx.DefaultPosition,
-                 size=wx.DefaultSize, style=wx.DEFAULT_FRAME_STYLE):
+                 size=wx.DefaultSize, style=wx.DEFAULT_FRAME_STYLE,
+                 line_index_cache=None):
+        # Mapped rather than read, so that opening takes the same time for a
+        # file of any size (and one bigger than the memory can be opened).
+        # Compressed files get decompressed as they're being looked at.
+        # Opened first, so that there's no frame left over if it fails.
+        if compressed.is_compressed(file):
+            lines = compressed.CompressedFile(file)
+        else:
+            lines = paged_file.PagedFile(file)
+
         wx.Frame.__init__(self, parent, ID, title, pos, size, style)
         panel = wx.Panel(self, -1)
 
         self.file = file
+        self.lines = lines
+
+        # Following the file as it grows, like tail -f
+        self.following = False
+        self.follow_timer = wx.Timer(self)
+
+        # Line numbers come from an index made in the background, which is
+        # kept for viewing the file again
+        if line_index_cache is None:
+            line_index_cache = line_index.LineIndexCache()
+
+        self.line_index_cache = line_index_cache
+        self.line_index = line_index_cache.get(lines.path, lines.stamp())
+        self.indexer = None
 
         viewr = BuiltinViewerControl(self, -1)
         box = wx.BoxSizer(wx.VERTICAL)
         box.Add(viewr, 1, wx.ALL | wx.GROW, 1)
         self.SetSizer(box)
         self.SetAutoLayout(True)
+        self.status_bar = self.CreateStatusBar()
 
-        viewr.SetText(open(file).read())
-        viewr.SetReadOnly(True)
+        viewr.show_lines(self.lines)
+        self.viewr = viewr
 
         self.Bind(wx.EVT_CLOSE, self.OnCloseWindow)
         self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
+        self.Bind(wx.EVT_TIMER, self.OnFollowTimer, self.follow_timer)
         self.Maximize()
+        self.start_indexing()
+        self._update_timer()
+
+    def start_indexing(self):
+        """Indexes the lines of the file that aren't yet, in a thread."""
+        if self.indexer is not None \
+           or self.line_index.indexed_to >= self.lines.size:
+            return
+
+        self.indexer = line_index.LineIndexer(self.line_index, self.lines,
+                                              self._indexing_progress,
+                                              self._indexing_done)
+        self.indexer.start()
+
+    def stop_indexing(self):
+        if self.indexer is not None:
+            self.indexer.cancel()
+            self.indexer.join()
+            self.indexer = None
+
+    def _indexing_progress(self, indexer):
+        wx.CallAfter(self._on_indexing_progress, indexer)
+
+    def _indexing_done(self, indexer):
+        wx.CallAfter(self._on_indexing_done, indexer)
+
+    def _on_indexing_progress(self, indexer):
+        # The viewer might have been closed by the time this gets called
+        if not self or indexer is not self.indexer:
+            return
+
+        self.show_position(self.viewr.current_offset())
+
+    def _on_indexing_done(self, indexer):
+        if not self or indexer is not self.indexer:
+            return
+
+        self.indexer = None
+
+        # The file might have grown while it was being indexed
+        self.start_indexing()
+        self.show_position(self.viewr.current_offset())
+
+    def ask_line(self):
+        text = wx.GetTextFromUser(u'Line number:', u'Go to line', u'', self)
+
+        if not text:
+            return
+
+        try:
+            line = int(text)
+        except ValueError:
+            self.status_bar.SetStatusText(u'Not a line number: %s' % text)
+            return
+
+        index = self.line_index
+        offset = index.offset_of_line(self.lines.data, line - 1)
+
+        if offset is not None:
+            self.viewr.go_to_offset(offset)
+        elif self.indexer is None and not self.lines.is_loading():
+            self.status_bar.SetStatusText(u'There are only %d lines'
+                                          % index.num_lines())
+        else:
+            self.status_bar.SetStatusText(u'Line %d is not indexed yet'
+                                          % line)
+
+    def _update_timer(self):
+        # Runs while following, and whenever the file has to be refreshed:
+        # a mapped file might get truncated (which reading it past its new
+        # end doesn't survive), a compressed one grows as it's decompressed
+        if self.following or self.lines.needs_refresh():
+            if not self.follow_timer.IsRunning():
+                self.follow_timer.Start(FOLLOW_INTERVAL)
+        else:
+            self.follow_timer.Stop()
+
+    def toggle_follow(self):
+        self.following = not self.following
+
+        # Whatever reads the file in background has to be done with it
+        # before it gets read another way (see PagedFile.set_following)
+        self.stop_indexing()
+        self.viewr.stop_search()
+        self.lines.set_following(self.following)
+        self.start_indexing()
+
+        if self.following:
+            self.OnFollowTimer(None)
+            self.viewr.go_to_end()
+
+        self._update_timer()
+        self.show_position(self.viewr.current_offset())
+
+    def OnFollowTimer(self, evt):
+        # Polled rather than watched with inotify: a rotated log is another
+        # file at the same path, which a watch on the old one can't see.
+        # Checked before refreshing, so that the last of it isn't missed.
+        lines = self.lines
+        needed = lines.needs_refresh()
+        old_size = lines.size
+        change = lines.refresh()
+
+        if not needed:
+            self._update_timer()
+
+        if change is None:
+            return
+
+        if change == paged_file.GREW:
+            # Only got appended to, what's indexed is still good
+            self.line_index_cache.put(lines.path, lines.stamp(),
+                                      self.line_index)
+        else:
+            self.stop_indexing()
+            self.line_index = self.line_index_cache.get(lines.path,
+                                                        lines.stamp())
+
+        self.start_indexing()
+        self.viewr.file_changed(change, old_size, self.following)
+        self.show_position(self.viewr.current_offset())
+
+    def show_position(self, offset):
+        size = self.lines.size
+        percent = 100
+
+        if size > 0:
+            percent = 100 * offset / size
+
+        text = u'Byte %d of %d (%d%%)' % (offset, size, percent)
+        index = self.line_index
+        line = index.line_of_offset(self.lines.data, offset)
+
+        if line is not None and self.indexer is None:
+            text = u'Line %d of %d, %s' % (line + 1, index.num_lines(), text)
+        elif line is not None:
+            text = u'Line %d, %s' % (line + 1, text)
+
+        if self.indexer is not None and size > 0:
+            text += u', indexing lines (%d%%)' % (100 * index.indexed_to
+                                                  / size)
+
+        if self.lines.is_loading():
+            text += u', decompressing'
+
+        if self.lines.error is not None:
+            text += u', %s' % self.lines.error
+
+        if self.following:
+            text += u', following (F to stop)'
+
+        self.status_bar.SetStatusText(text)
 
     def OnCloseWindow(self, event):
+        self.follow_timer.Stop()
+        self.stop_indexing()
+
+        # The search must be done reading before the file gets unmapped
+        self.viewr.stop_search()
+        self.lines.close()
         self.Destroy()
 
     def OnKeyDown(self, evt):
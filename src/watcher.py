@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Watches a directory for entries being created, deleted or renamed. Uses
+# inotify on Linux, falls back to polling the directory's mtime elsewhere.
+
+import os
+import time
+import errno
+import select
+import struct
+import platform
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO \
+             | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# struct inotify_event, without the trailing name
+EVENT_HEADER = 'iIII'
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+
+
+def _load_libc():
+    if ctypes is None or platform.system() != 'Linux':
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+        libc.inotify_init
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    return _libc is not None
+
+
+class ChangeSet(object):
+    """
+    Net effect of a burst of events on the names in a directory. A name that
+    got created and then deleted within the burst is only reported as
+    deleted, since it might have existed before the burst.
+    """
+    def __init__(self):
+        self.created = {}
+        self.deleted = {}
+
+        # Set when the changes could not be tracked (e.g. the event queue
+        # overflowed), meaning the whole directory should be read again
+        self.needs_rescan = False
+
+    def __len__(self):
+        return len(self.created) + len(self.deleted)
+
+    def add_created(self, name):
+        self.created[name] = True
+
+    def add_deleted(self, name):
+        self.created.pop(name, None)
+        self.deleted[name] = True
+
+    def is_empty(self):
+        return len(self) == 0 and not self.needs_rescan
+
+
+class DirectoryWatcher(threading.Thread):
+    """
+    Calls on_changes(watcher, created, deleted) with the lists of names that
+    appeared in and vanished from path. Renames are reported as a deletion
+    of the old name and creation of the new one. When a burst of changes can't
+    be tracked, created and deleted are both None. The callback gets called
+    on the watcher's thread.
+
+    Events are coalesced: the changes are only reported after settle_time
+    seconds pass without new events, or max_delay seconds after the first
+    event of a burst, whichever is sooner.
+    """
+    def __init__(self, path, on_changes, settle_time=0.2, max_delay=1.0,
+                 poll_interval=2.0):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.path = path
+        self._on_changes = on_changes
+        self._stopped = threading.Event()
+        self.settle_time = settle_time
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_stopped(self):
+        return self._stopped.isSet()
+
+    def _report(self, changes):
+        if self.is_stopped() or changes.is_empty():
+            return
+
+        if changes.needs_rescan:
+            self._on_changes(self, None, None)
+        else:
+            self._on_changes(self, changes.created.keys(),
+                             changes.deleted.keys())
+
+    def run(self):
+        fd = -1
+
+        if inotify_available():
+            fd = _libc.inotify_init()
+
+        if fd < 0:
+            self._poll()
+            return
+
+        path = self.path
+
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+
+        try:
+            wd = _libc.inotify_add_watch(fd, path, WATCH_MASK)
+
+            if wd < 0:
+                self._poll()
+            else:
+                self._watch(fd)
+        finally:
+            os.close(fd)
+
+    def _read_events(self, fd, changes):
+        buf = os.read(fd, 64 * 1024)
+        pos = 0
+
+        while pos + EVENT_HEADER_SIZE <= len(buf):
+            wd, mask, cookie, length = struct.unpack_from(EVENT_HEADER, buf,
+                                                          pos)
+            pos += EVENT_HEADER_SIZE
+            name = buf[pos:pos + length].rstrip('\0')
+            pos += length
+
+            try:
+                name = name.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                changes.add_created(name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changes.add_deleted(name)
+            elif mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF
+                         | IN_IGNORED):
+                changes.needs_rescan = True
+
+    def _wait_readable(self, fd, timeout):
+        try:
+            readable = select.select([fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+
+        return len(readable) > 0
+
+    def _watch(self, fd):
+        changes = ChangeSet()
+        burst_start = None
+
+        while not self.is_stopped():
+            if burst_start is None:
+                # Nothing pending, just check now and then whether we were
+                # told to stop
+                timeout = 0.5
+            else:
+                timeout = self.settle_time
+
+            if self._wait_readable(fd, timeout):
+                self._read_events(fd, changes)
+
+                if burst_start is None:
+                    burst_start = time.time()
+
+                if time.time() - burst_start < self.max_delay:
+                    continue
+
+            if burst_start is not None:
+                self._report(changes)
+                changes = ChangeSet()
+                burst_start = None
+
+    def _list_names(self):
+        try:
+            return set(os.listdir(self.path))
+        except OSError:
+            return None
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+
+        return (st.st_mtime, st.st_ctime)
+
+    def _poll(self):
+        stamp = self._stamp()
+        names = self._list_names()
+
+        while not self._stopped.wait(self.poll_interval) \
+              and not self.is_stopped():
+            new_stamp = self._stamp()
+
+            if new_stamp == stamp:
+                continue
+
+            stamp = new_stamp
+            new_names = self._list_names()
+            changes = ChangeSet()
+
+            if names is None or new_names is None:
+                changes.needs_rescan = True
+            else:
+                for name in new_names - names:
+                    changes.add_created(name)
+
+                for name in names - new_names:
+                    changes.add_deleted(name)
+
+            names = new_names
+            self._report(changes)
@@ -48,7 +48,7 @@ class TestMotion(unittest.TestCase):
         # | c f
         # +-
         lst = ['a', 'b', 'c', 'd', 'e']
-        data.list_files = lambda a, b: util.list_of_tuples(lst, b)
+        data.list_files = lambda a, b: util.list_of_file_entries(lst, b)
         self.panel = theFrame.p1
         self.panel.initialize_view_settings(3, 3)
         self.panel.model.fill_list_by_working_dir('.')
@@ -135,7 +135,7 @@ class TestMotion(unittest.TestCase):
     #
     def testGtoD(self):
         lst = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
-        data.list_files = lambda a, b: util.list_of_tuples(lst, b)
+        data.list_files = lambda a, b: util.list_of_file_entries(lst, b)
         # Constrain the size, to feed the test data in a controlled manner
         self.panel.initialize_view_settings(3, 4)
         self.panel.model.fill_list_by_working_dir('.')
@@ -153,7 +153,7 @@ class TestMotion(unittest.TestCase):
 
     def testAtoH(self):
         lst = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
-        data.list_files = lambda a, b: util.list_of_tuples(lst, b)
+        data.list_files = lambda a, b: util.list_of_file_entries(lst, b)
         # Constrain the size, to feed the test data in a controlled manner
         self.panel.initialize_view_settings(3, 4)
         self.panel.model.fill_list_by_working_dir('.')
@@ -163,7 +163,7 @@ class TestMotion(unittest.TestCase):
 
     def testHtoA(self):
         lst = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
-        data.list_files = lambda a, b: util.list_of_tuples(lst, b)
+        data.list_files = lambda a, b: util.list_of_file_entries(lst, b)
         # Constrain the size, to feed the test data in a controlled manner
         self.panel.initialize_view_settings(3, 4)
         self.panel.model.fill_list_by_working_dir('.')
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+import stat
+import shutil
+import tarfile
+import zipfile
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import archives
+
+
+MEMBERS = ['README', 'src/main.c', 'src/lib/util.c', 'src/lib/util.h',
+           'doc/']
+
+
+def make_zip(path):
+    archive = zipfile.ZipFile(path, 'w')
+
+    for name in MEMBERS:
+        if name.endswith('/'):
+            info = zipfile.ZipInfo(name)
+            info.external_attr = (stat.S_IFDIR | 0755) << 16
+            archive.writestr(info, '')
+        else:
+            archive.writestr(name, 'contents of ' + name)
+
+    archive.close()
+
+
+def make_tar(path, source_dir):
+    for name in MEMBERS:
+        full_path = os.path.join(source_dir, name)
+
+        if name.endswith('/'):
+            os.makedirs(full_path)
+            continue
+
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+
+        f = open(full_path, 'w')
+        f.write('contents of ' + name)
+        f.close()
+
+    archive = tarfile.open(path, 'w:gz')
+
+    for name in ['README', 'src', 'doc']:
+        archive.add(os.path.join(source_dir, name), './' + name)
+
+    archive.close()
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.root, u'a.zip')
+        self.tar_path = os.path.join(self.root, u'a.tar.gz')
+        make_zip(self.zip_path)
+        make_tar(self.tar_path, os.path.join(self.root, 'tree'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def names(self, entries):
+        return sorted([e[0] for e in entries])
+
+
+class TestArchivePaths(ArchiveTestCase):
+    def testIsArchive(self):
+        self.assertTrue(archives.is_archive(u'x.ZIP'))
+        self.assertTrue(archives.is_archive(u'x.tar.bz2'))
+        self.assertTrue(archives.is_archive(u'x.tgz'))
+        self.assertFalse(archives.is_archive(u'x.gz'))
+        self.assertFalse(archives.is_archive(u'x.txt'))
+
+    def testSplit(self):
+        self.assertEquals(archives.split_archive_path(self.zip_path),
+                          (self.zip_path, u''))
+        inner = os.path.join(self.zip_path, u'src', u'lib')
+        self.assertEquals(archives.split_archive_path(inner),
+                          (self.zip_path, u'src/lib'))
+
+    def testNotInArchive(self):
+        self.assertEquals(archives.split_archive_path(self.root), None)
+        path = os.path.join(self.root, u'tree', u'src', u'main.c')
+        self.assertEquals(archives.split_archive_path(path), None)
+        path = os.path.join(self.root, u'nothing', u'here')
+        self.assertEquals(archives.split_archive_path(path), None)
+
+    def testIsDir(self):
+        self.assertTrue(archives.is_dir(self.zip_path))
+        self.assertTrue(archives.is_dir(os.path.join(self.zip_path, u'src')))
+        self.assertFalse(archives.is_dir(os.path.join(self.zip_path,
+                                                      u'README')))
+        self.assertFalse(archives.is_dir(self.root))
+
+
+class TestListing(ArchiveTestCase):
+    def check_listing(self, path):
+        top = archives.list_dir(path)
+        self.assertEquals(self.names(top), [u'README', u'doc', u'src'])
+
+        for name, entry_path, is_dir, is_link, st in top:
+            self.assertEquals(entry_path, path)
+            self.assertEquals(is_dir, name != u'README')
+            self.assertEquals(stat.S_ISDIR(st.st_mode), is_dir)
+
+        readme = [e for e in top if e[0] == u'README'][0]
+        self.assertEquals(readme[4].st_size, len('contents of README'))
+
+        lib = archives.list_dir(os.path.join(path, u'src', u'lib'))
+        self.assertEquals(self.names(lib), [u'util.c', u'util.h'])
+        self.assertEquals(archives.list_dir(os.path.join(path, u'doc')), [])
+
+    def testZip(self):
+        self.check_listing(self.zip_path)
+
+    def testTar(self):
+        self.check_listing(self.tar_path)
+
+    def testMissingDir(self):
+        self.assertRaises(OSError, archives.list_dir,
+                          os.path.join(self.zip_path, u'nope'))
+
+    def testBrokenArchive(self):
+        path = os.path.join(self.root, u'broken.zip')
+        f = open(path, 'w')
+        f.write('not a zip')
+        f.close()
+        self.assertRaises(OSError, archives.list_dir, path)
+
+    def testWalk(self):
+        entries = archives.walk(os.path.join(self.tar_path, u'src'))
+        found = sorted([(e[1], e[0]) for e in entries])
+        src = os.path.join(self.tar_path, u'src')
+        self.assertEquals(found, [(src, u'main.c'),
+                                  (os.path.join(src, u'lib'), u'util.c'),
+                                  (os.path.join(src, u'lib'), u'util.h')])
+
+
+class TestArchiveCache(ArchiveTestCase):
+    def setUp(self):
+        ArchiveTestCase.setUp(self)
+        self.reads = []
+        self.saved_read_index = archives.read_index
+
+        def counting_read_index(path):
+            self.reads.append(path)
+            return self.saved_read_index(path)
+
+        archives.read_index = counting_read_index
+
+    def tearDown(self):
+        archives.read_index = self.saved_read_index
+        ArchiveTestCase.tearDown(self)
+
+    def testReadOnce(self):
+        cache = archives.ArchiveCache()
+        archives.list_dir(self.zip_path, cache)
+        archives.list_dir(os.path.join(self.zip_path, u'src'), cache)
+        archives.list_dir(os.path.join(self.zip_path, u'src', u'lib'), cache)
+        self.assertEquals(self.reads, [self.zip_path])
+
+    def testReadAgainWhenChanged(self):
+        cache = archives.ArchiveCache()
+        archives.list_dir(self.zip_path, cache)
+        archive = zipfile.ZipFile(self.zip_path, 'a')
+        archive.writestr('NEWS', 'news')
+        archive.close()
+        entries = archives.list_dir(self.zip_path, cache)
+        self.assertTrue(u'NEWS' in self.names(entries))
+        self.assertEquals(len(self.reads), 2)
+
+    def testHasIndex(self):
+        cache = archives.ArchiveCache()
+        self.assertFalse(cache.has_index(self.tar_path))
+        cache.get_index(self.tar_path)
+        self.assertTrue(cache.has_index(self.tar_path))
+        self.assertFalse(cache.has_index(os.path.join(self.root, u'nope')))
+
+    def testEviction(self):
+        cache = archives.ArchiveCache(1)
+        cache.get_index(self.zip_path)
+        cache.get_index(self.tar_path)
+        self.assertEquals(len(cache), 1)
+        cache.get_index(self.zip_path)
+        self.assertEquals(len(self.reads), 3)
+
+
+def suite():
+    paths_suite = unittest.makeSuite(TestArchivePaths)
+    listing_suite = unittest.makeSuite(TestListing)
+    cache_suite = unittest.makeSuite(TestArchiveCache)
+    return unittest.TestSuite([paths_suite, listing_suite, cache_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
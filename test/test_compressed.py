@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+import unittest
+import os
+import sys
+import bz2
+import gzip
+import shutil
+import tempfile
+import StringIO
+
+sys.path.append(os.path.abspath('../src'))
+
+import paged_file
+import compressed
+
+
+def gzipped(contents):
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(contents)
+    f.close()
+    return out.getvalue()
+
+
+class CompressedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.files = []
+
+        # Small enough for everything to take many of them
+        self.saved = compressed.BLOCK_SIZE, compressed.READ_SIZE
+        compressed.BLOCK_SIZE = 16
+        compressed.READ_SIZE = 7
+
+    def tearDown(self):
+        compressed.BLOCK_SIZE, compressed.READ_SIZE = self.saved
+
+        for f in self.files:
+            f.close()
+
+        shutil.rmtree(self.root)
+
+    def open(self, name, data):
+        path = os.path.join(self.root, name)
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+        paged = compressed.CompressedFile(path)
+        self.files.append(paged)
+
+        # Lets the first pass finish
+        paged.data._thread.join()
+        paged.refresh()
+        return paged
+
+    def assertReadsAs(self, paged, contents):
+        self.assertEquals(paged.size, len(contents))
+
+        for start in range(len(contents)):
+            for end in range(start, len(contents) + 2):
+                self.assertEquals(paged.data[start:end], contents[start:end])
+
+
+class TestCompressedFile(CompressedTestCase):
+    contents = ''.join(['line %d\n' % i for i in range(20)])
+
+    def testGzip(self):
+        paged = self.open('f.gz', gzipped(self.contents))
+        self.assertEquals(paged.error, None)
+        self.assertFalse(paged.is_loading())
+        self.assertReadsAs(paged, self.contents)
+
+        # Every block starts at a checkpoint
+        offsets = [c[0] for c in paged.data.checkpoints]
+        self.assertEquals(offsets, range(0, len(self.contents), 16))
+
+    def testConcatenatedGzip(self):
+        data = gzipped(self.contents[:30]) + gzipped(self.contents[30:])
+        paged = self.open('f.gz', data)
+        self.assertReadsAs(paged, self.contents)
+
+    def testTrailingGarbage(self):
+        paged = self.open('f.gz', gzipped(self.contents) + '\0' * 10)
+        self.assertEquals(paged.error, None)
+        self.assertReadsAs(paged, self.contents)
+
+    def testBzip2(self):
+        paged = self.open('f.bz2', bz2.compress(self.contents))
+        self.assertReadsAs(paged, self.contents)
+
+    def testConcatenatedBzip2(self):
+        data = bz2.compress(self.contents[:30]) \
+               + bz2.compress(self.contents[30:])
+        paged = self.open('f.bz2', data)
+        self.assertReadsAs(paged, self.contents)
+
+        # Where a stream starts is a checkpoint too
+        offsets = [c[0] for c in paged.data.checkpoints]
+        self.assertEquals(offsets, [0, 30])
+
+    def testBlockSeeks(self):
+        contents = self.contents * 4
+        paged = self.open('f.bz2', bz2.compress(contents))
+        data = paged.data
+        made = []
+        decoder_class = compressed.Decoder
+
+        class CountedDecoder(decoder_class):
+            def __init__(self, *args):
+                made.append(self)
+                decoder_class.__init__(self, *args)
+
+        compressed.Decoder = CountedDecoder
+
+        try:
+            # As if the blocks couldn't be spilled
+            data._drop_spill()
+
+            # Only the first pass has cached the last few blocks
+            data._blocks.clear()
+            del data._lru[:]
+
+            # Scanning on reads on from where the last block was decoded,
+            # rather than from the start of the file again
+            for start in range(0, len(contents), 5):
+                self.assertEquals(data[start:start + 5],
+                                  contents[start:start + 5])
+
+            self.assertEquals(len(made), 1)
+
+            # Going back does take starting over
+            data._blocks.clear()
+            del data._lru[:]
+            self.assertEquals(data[20:40], contents[20:40])
+            self.assertEquals(len(made), 2)
+            self.assertEquals(data[300:340], contents[300:340])
+            self.assertEquals(len(made), 2)
+        finally:
+            compressed.Decoder = decoder_class
+
+    def testSpilledBlocksAreNotDecodedAgain(self):
+        paged = self.open('f.bz2', bz2.compress(self.contents))
+        data = paged.data
+        self.assertEquals(data._num_spilled, (len(self.contents) + 15) / 16)
+        data._blocks.clear()
+        del data._lru[:]
+        decoder_class = compressed.Decoder
+
+        def no_decoding(*args):
+            self.fail('decoded again')
+
+        compressed.Decoder = no_decoding
+
+        try:
+            self.assertReadsAs(paged, self.contents)
+        finally:
+            compressed.Decoder = decoder_class
+
+    def testGzipIsNotSpilled(self):
+        paged = self.open('f.gz', gzipped(self.contents))
+        self.assertEquals(paged.data._spill, None)
+
+    def testCorrupt(self):
+        data = gzipped(self.contents)
+        paged = self.open('f.gz', data[:20] + 'x' * 20 + data[40:])
+        self.assertNotEquals(paged.error, None)
+        self.assertFalse(paged.is_loading())
+
+    def testFind(self):
+        paged = self.open('f.gz', gzipped(self.contents))
+        data = paged.data
+
+        for sub in ['\n', 'line 1', 'line 19\n', 'nothing']:
+            for start in range(0, len(self.contents), 5):
+                self.assertEquals(data.find(sub, start),
+                                  self.contents.find(sub, start))
+                self.assertEquals(data.rfind(sub, 0, start),
+                                  self.contents.rfind(sub, 0, start))
+
+    def testLines(self):
+        paged = self.open('f.gz', gzipped('one\ntwo\nthree'))
+        self.assertEquals(paged.read_lines(0, 10),
+                          ([0, 4, 8], ['one', 'two', 'three'], 13))
+        self.assertEquals(paged.last_lines(1), 8)
+        self.assertEquals(paged.refresh(), None)
+        self.failIf(paged.needs_refresh())
+
+    def testStamp(self):
+        data = gzipped(self.contents)
+        paged = self.open('f.gz', data)
+        self.assertEquals(paged.stamp()[0], len(data))
+
+    def testNeedsLzma(self):
+        if '.xz' in compressed.DECOMPRESSORS:
+            return
+
+        path = os.path.join(self.root, 'f.xz')
+        open(path, 'wb').close()
+        self.assertRaises(IOError, compressed.CompressedFile, path)
+
+
+def suite():
+    compressed_suite = unittest.makeSuite(TestCompressedFile)
+    return unittest.TestSuite([compressed_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
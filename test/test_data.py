@@ -21,6 +21,11 @@
 import unittest
 import os
 import sys
+import time
+import shutil
+import threading
+import tempfile
+import zipfile
 
 sys.path.append(os.path.abspath('../src'))
 
@@ -51,6 +56,501 @@ class TestFileLister(unittest.TestCase):
         self.assertEquals(len(filter(lambda(f): f.is_hidden, list)), 5)
 
 
+class TestListConstruction(unittest.TestCase):
+    def setUp(self):
+        entries = util.list_of_file_entries([u'b', u'.c', u'a'], u'.', True)
+        entries += util.list_of_file_entries([u'B', u'a.txt', u'.x'], u'.')
+        self.raw_items = map(data.make_raw_item, entries)
+
+    def names(self, items):
+        return [i.file_name for i in items]
+
+    def testDirsFirstThenFilesSortedByName(self):
+        items = data.construct_list_for_filling(self.raw_items, None)
+        self.assertEquals(self.names(items), [u'..', u'a', u'b', u'B',
+                                              u'a.txt'])
+
+    def testFilterAppliesToDotDotToo(self):
+        special_filter = data.DirectoryViewFilter(u'A')
+        items = data.construct_list_for_filling(self.raw_items, special_filter)
+        self.assertEquals(self.names(items), [u'a', u'a.txt'])
+
+    def testFilterExpression(self):
+        special_filter = data.DirectoryViewFilter(u'*.TXT !b*')
+        items = data.construct_list_for_filling(self.raw_items, special_filter)
+        self.assertEquals(self.names(items), [u'a.txt'])
+
+
+class FakeStat(object):
+    def __init__(self, size, mtime):
+        self.st_size = size
+        self.st_mtime = mtime
+
+
+class TestSorting(unittest.TestCase):
+    def make_items(self, names, is_dir=False):
+        entries = util.list_of_file_entries(names, u'.', is_dir)
+        return map(data.make_raw_item, entries)
+
+    def names(self, items):
+        return [i.file_name for i in items]
+
+    def testDirectoriesBySizeOfTheirTrees(self):
+        dirs = self.make_items([u'a', u'b', u'c'], True)
+        dirs[0].tree_size = 10
+        dirs[2].tree_size = 5
+        items = data.sort_items(dirs, data.SORT_BY_SIZE)
+        self.assertEquals(self.names(items), [u'b', u'c', u'a'])
+
+    def testNatural(self):
+        items = self.make_items([u'file10', u'file9', u'File1', u'file'])
+        items = data.sort_items(items, data.SORT_NATURAL)
+        self.assertEquals(self.names(items),
+                          [u'file', u'File1', u'file9', u'file10'])
+        self.assertEquals(items[3].natural_key, (u'file', 10, u''))
+
+    def testExtension(self):
+        items = self.make_items([u'a.txt', u'b.PY', u'c', u'd.py'])
+        items = data.sort_items(items, data.SORT_BY_EXTENSION)
+        self.assertEquals(self.names(items), [u'c', u'b.PY', u'd.py',
+                                              u'a.txt'])
+
+    def testSizeKeepsDirectoriesByName(self):
+        dirs = self.make_items([u'x', u'w'], True)
+        files = self.make_items([u'big', u'small'])
+
+        for item, size in zip(dirs + files, [1, 2, 300, 3]):
+            item.stat_result = FakeStat(size, 0)
+
+        items = data.construct_list_for_filling(dirs + files, None,
+                                                data.SORT_BY_SIZE)
+        self.assertEquals(self.names(items), [u'..', u'x', u'w', u'small',
+                                              u'big'])
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        names = [u'Alpha', u'beta', u'gamma', u'ALPS']
+        entries = util.list_of_file_entries(names, u'.')
+        self.index = data.SearchIndex(map(data.make_raw_item, entries))
+
+    def testCaseInsensitive(self):
+        self.assertEquals(self.index.matches(u'aLp'), [0, 3])
+
+    def testGrowingStringOnlyTestsPreviousMatches(self):
+        self.index.matches(u'l')
+        self.index.lower_names[1] = u'alphabet'
+        self.assertEquals(self.index.matches(u'lp'), [0, 3])
+
+    def testShrinkingStringReusesEarlierResults(self):
+        self.index.matches(u'a')
+        self.index.matches(u'alp')
+        self.index.lower_names[2] = u'x'
+        self.assertEquals(self.index.matches(u'a'), [0, 1, 2, 3])
+
+    def testNextMatchWraps(self):
+        self.assertEquals(self.index.next_match(u'alp', 1), 3)
+        self.assertEquals(self.index.next_match(u'alp', 4), 0)
+        self.assertEquals(self.index.next_match(u'zzz', 0), None)
+
+
+
+class TestDirEntries(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'sub'))
+        open(os.path.join(self.root, 'a.txt'), 'w').close()
+        open(os.path.join(self.root, 'sub', 'b.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testTypesComeWithEntries(self):
+        entries = data.list_dir_entries(self.root)
+        types = dict([(e[0], e[2]) for e in entries])
+        self.assertEquals(types, {'sub': True, 'a.txt': False})
+
+    def testRecursiveListingSkipsDirs(self):
+        entries = data.recursive_list_dir(self.root)
+        names = [e[0] for e in entries]
+        names.sort()
+        self.assertEquals(names, ['a.txt', 'b.txt'])
+
+    def testRecursiveListingKeepsRoots(self):
+        entries = data.recursive_list_dir(self.root)
+        roots = dict([(e[0], e[1]) for e in entries])
+        self.assertEquals(roots['b.txt'], os.path.join(self.root, 'sub'))
+
+    def testRecursiveListingSkipsLinkedDirs(self):
+        os.symlink(os.path.join(self.root, 'sub'),
+                   os.path.join(self.root, 'link'))
+        names = [e[0] for e in data.recursive_list_dir(self.root)]
+        names.sort()
+        self.assertEquals(names, ['a.txt', 'b.txt'])
+
+
+class TestDirectoryScanner(unittest.TestCase):
+    def setUp(self):
+        self.entries = util.list_of_file_entries(['f%d' % i for i in range(10)],
+                                                 '.')
+        self.batches = []
+
+    def on_batch(self, scanner, items, done):
+        self.batches.append((len(items), done))
+
+    def testBatchesGrow(self):
+        scanner = data.DirectoryScanner(self.entries, self.on_batch, 2)
+        scanner.run()
+        self.assertEquals(self.batches, [(2, False), (4, False), (4, True)])
+
+    def testReadBatchReportsDone(self):
+        scanner = data.DirectoryScanner(self.entries, self.on_batch)
+        items, done = scanner.read_batch(20)
+        self.assertEquals(len(items), 10)
+        self.assertTrue(done)
+
+    def testScanEndsOnUnexpectedError(self):
+        def entries():
+            yield self.entries[0]
+            raise ValueError('unexpected')
+
+        scanner = data.DirectoryScanner(entries(), self.on_batch, 2)
+        scanner.run()
+        self.assertEquals(self.batches, [(0, True)])
+
+    def testCancelledScannerIsSilent(self):
+        scanner = data.DirectoryScanner(self.entries, self.on_batch, 2)
+        scanner.cancel()
+        scanner.run()
+        self.assertEquals(self.batches, [])
+
+
+class TestListingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = data.ListingCache(2, 10000)
+        self.stamp = (0.0, 0.0)
+        self.entries = util.list_of_file_entries(['a', 'b'], '/x')
+
+    def testMissThenHit(self):
+        self.assertEquals(self.cache.get('/x', self.stamp), None)
+        self.cache.put('/x', self.stamp, self.entries)
+        self.assertEquals(self.cache.get('/x', self.stamp), self.entries)
+        self.assertEquals((self.cache.hits, self.cache.misses), (1, 1))
+
+    def testChangedStampInvalidates(self):
+        self.cache.put('/x', self.stamp, self.entries)
+        self.assertEquals(self.cache.get('/x', (1.0, 0.0)), None)
+        self.assertEquals(len(self.cache), 0)
+
+    def testRecentlyModifiedIsNotCached(self):
+        self.cache.put('/x', (time.time(), 0.0), self.entries)
+        self.assertEquals(len(self.cache), 0)
+
+    def testEvictsLeastRecentlyUsed(self):
+        self.cache.put('/x', self.stamp, self.entries)
+        self.cache.put('/y', self.stamp, self.entries)
+        self.cache.get('/x', self.stamp)
+        self.cache.put('/z', self.stamp, self.entries)
+        self.assertEquals(self.cache.get('/y', self.stamp), None)
+        self.assertEquals(self.cache.get('/x', self.stamp), self.entries)
+
+    def testEvictsBySize(self):
+        self.cache.put('/x', self.stamp, self.entries)
+        self.cache.max_bytes = self.cache.num_bytes + 1
+        self.cache.put('/y', self.stamp, self.entries)
+        self.assertEquals(len(self.cache), 1)
+        self.assertEquals(self.cache.evictions, 1)
+
+    def testRecordCachesOnlyWhenConsumed(self):
+        recorder = self.cache.record('/x', self.stamp, self.entries)
+        recorder.next()
+        self.assertEquals(len(self.cache), 0)
+        list(recorder)
+        self.assertEquals(self.cache.get('/x', self.stamp), self.entries)
+
+
+class TestParallelWalker(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+        for path in ['a/b/c', 'a/.git/objects', 'd']:
+            os.makedirs(os.path.join(self.root, path))
+
+        for path in ['f', 'a/f', 'a/b/f', 'a/b/c/f', 'a/.git/objects/f']:
+            open(os.path.join(self.root, path), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def walk(self, settings):
+        entries = list(data.ParallelWalker(self.root, settings))
+        paths = [os.path.join(e[1], e[0])[len(self.root) + 1:]
+                 for e in entries]
+        paths.sort()
+        return paths
+
+    def testSameAsSerialWalk(self):
+        serial = data.recursive_list_dir(self.root)
+        paths = [os.path.join(e[1], e[0])[len(self.root) + 1:]
+                 for e in serial]
+        paths.sort()
+        self.assertEquals(self.walk(data.WalkSettings()), paths)
+
+    def testMaxDepth(self):
+        settings = data.WalkSettings(max_depth=1)
+        self.assertEquals(self.walk(settings), ['a/f', 'f'])
+
+    def testMaxEntries(self):
+        walker = data.ParallelWalker(self.root, data.WalkSettings(None, 2))
+        self.assertEquals(len(list(walker)), 2)
+        self.assertTrue(walker.truncated)
+
+    def testExclude(self):
+        settings = data.WalkSettings(exclude=['.git', 'c'])
+        self.assertEquals(self.walk(settings), ['a/b/f', 'a/f', 'f'])
+
+    def testCancelStopsIteration(self):
+        walker = data.ParallelWalker(self.root, data.WalkSettings())
+        walker.cancel()
+        self.assertEquals(list(walker), [])
+
+    def testWorkerErrorIsRaised(self):
+        walker = data.ParallelWalker(self.root, data.WalkSettings())
+        read_dir = walker._read_dir
+
+        def failing_read_dir(dirs, root, depth):
+            if os.path.basename(root) == 'b':
+                raise ValueError('unexpected')
+
+            return read_dir(dirs, root, depth)
+
+        walker._read_dir = failing_read_dir
+        self.assertRaises(ValueError, list, walker)
+
+
+class TestDirChanges(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        open(os.path.join(self.root, 'a'), 'w').close()
+        data.list_files = lambda flat, cwd: data.list_dir_entries(cwd)
+        self.model = data.PanelModel('m.')
+        self.model.fill_list_by_working_dir(self.root)
+
+    def tearDown(self):
+        data.list_files = util.fake_file_lister
+        shutil.rmtree(self.root)
+
+    def names(self):
+        return [i.file_name for i in self.model.items]
+
+    def testCreatedAppear(self):
+        os.mkdir(os.path.join(self.root, 'd'))
+        self.model.apply_dir_changes(['d'], [])
+        self.assertEquals(self.names(), ['..', 'd', 'a'])
+        self.assertTrue(self.model.items[1].is_dir)
+
+    def testDeletedVanish(self):
+        os.remove(os.path.join(self.root, 'a'))
+        self.model.apply_dir_changes([], ['a'])
+        self.assertEquals(self.names(), ['..'])
+
+    def testRenamed(self):
+        os.rename(os.path.join(self.root, 'a'), os.path.join(self.root, 'b'))
+        self.model.apply_dir_changes(['b'], ['a'])
+        self.assertEquals(self.names(), ['..', 'b'])
+
+    def testVanishedBeforeStatIsSkipped(self):
+        self.model.apply_dir_changes(['ghost'], [])
+        self.assertEquals(self.names(), ['..', 'a'])
+
+    def testChangesWaitForScanToFinish(self):
+        queued = []
+        call_later = lambda func, *args: queued.append((func, args))
+        self.model.start_filling_by_working_dir(self.root, call_later, 0)
+        self.model._scanner.join()
+        open(os.path.join(self.root, 'b'), 'w').close()
+        self.model.apply_dir_changes(['b'], [])
+        self.assertEquals(self.names(), ['..'])
+
+        for func, args in queued:
+            func(*args)
+
+        self.assertEquals(self.names(), ['..', 'a', 'b'])
+
+    def testDropItems(self):
+        self.model.drop_items([self.model.items[1]])
+        self.assertEquals(self.names(), ['..'])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'a')))
+
+    def testAddPaths(self):
+        self.model.drop_items([self.model.items[1]])
+        os.mkdir(os.path.join(self.root, 'd'))
+        elsewhere = tempfile.gettempdir()
+        self.model.add_paths([os.path.join(self.root, 'a'),
+                              os.path.join(self.root, 'd'),
+                              os.path.join(self.root, 'ghost'),
+                              os.path.join(self.root, 'a'),
+                              elsewhere])
+        self.assertEquals(self.names(), ['..', 'd', 'a'])
+        self.model.add_paths([os.path.join(self.root, 'a')])
+        self.assertEquals(self.names(), ['..', 'd', 'a'])
+
+    def testAddPathsInFlatView(self):
+        os.makedirs(os.path.join(self.root, 'd', 'e'))
+        open(os.path.join(self.root, 'd', 'e', 'f'), 'w').close()
+        self.model.flat_directory_view = True
+        self.model.add_paths([os.path.join(self.root, 'd', 'e', 'f')])
+        self.assertEquals(self.names(), ['..', 'a', 'f'])
+        self.assertEquals(self.model.items[2].path,
+                          os.path.join(self.root, 'd', 'e'))
+
+
+class TestUpdir(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+
+        # More than the first batch, so that the rest is read in background
+        for i in range(300):
+            os.mkdir(os.path.join(self.root, 'dir%d' % i))
+
+        data.list_files = lambda flat, cwd: data.iter_dir_entries(cwd)
+        self.model = data.PanelModel('m.')
+        self.queued = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        data.list_files = util.fake_file_lister
+        shutil.rmtree(self.root)
+
+    def call_later(self, func, *args):
+        self.queued.append((func, args))
+
+    def testParentIsReadInBackground(self):
+        sub_dir = os.path.join(self.root, 'dir150')
+        os.chdir(sub_dir)
+        self.model.fill_list_by_working_dir(sub_dir)
+        index = self.model.updir(self.call_later)
+        self.assertTrue(self.model.is_scanning())
+
+        self.model._scanner.join()
+        for func, args in self.queued:
+            func(*args)
+
+            # What the controller does on 'NEW ITEMS'
+            listed = self.model.listed_selection()
+
+            if listed is not None:
+                index = listed
+
+        self.assertFalse(self.model.is_scanning())
+        self.assertEquals(self.model.items[index].file_name, 'dir150')
+        self.assertEquals(self.model.listed_selection(), None)
+
+    def testSelectionIsForgottenOnLeaving(self):
+        os.chdir(os.path.join(self.root, 'dir150'))
+        self.model.fill_list_by_working_dir(os.getcwdu())
+        self.model.updir(self.call_later)
+        self.model.fill_list_by_working_dir(self.root)
+        self.assertEquals(self.model.listed_selection(), None)
+
+
+class TestArchiveBrowsing(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.root, u'a.zip')
+        archive = zipfile.ZipFile(self.zip_path, 'w')
+        archive.writestr('src/main.c', 'int main;')
+        archive.writestr('src/lib/util.c', '')
+        archive.close()
+        data.list_files = lambda flat, cwd: data.list_dir_entries(cwd)
+        self.model = data.PanelModel('m.')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        data.list_files = util.fake_file_lister
+        shutil.rmtree(self.root)
+
+    def names(self):
+        return [i.file_name for i in self.model.items]
+
+    def testListing(self):
+        self.model.fill_list_by_working_dir(os.path.join(self.zip_path,
+                                                         u'src'))
+        self.assertTrue(self.model.in_archive())
+        self.assertEquals(self.names(), ['..', 'lib', 'main.c'])
+        self.assertEquals(self.model.items[2].size, len('int main;'))
+
+    def testFlatView(self):
+        self.model.flatten_directory()
+        self.model.fill_list_by_working_dir(self.zip_path)
+        self.assertEquals(self.names(), ['..', 'main.c', 'util.c'])
+
+    def testUpdir(self):
+        os.chdir(self.root)
+        self.model.fill_list_by_working_dir(os.path.join(self.zip_path,
+                                                         u'src'))
+        index = self.model.updir()
+        self.assertEquals(self.model.working_dir, self.zip_path)
+        self.assertEquals(self.names()[index], 'src')
+
+        index = self.model.updir()
+        self.assertEquals(self.model.working_dir, self.root)
+        self.assertFalse(self.model.in_archive())
+        self.assertEquals(self.names()[index], 'a.zip')
+
+
+class TestItemMetadata(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        f = open(os.path.join(self.root, 'a.txt'), 'w')
+        f.write('12345')
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testStatIsTakenOnFirstAccess(self):
+        item = data.RawItem(u'a.txt', self.root)
+        self.assertEquals(item.stat_result, None)
+        self.assertEquals(item.size, 5)
+        self.assertTrue(item.stat_result)
+
+    def testStatIsCached(self):
+        item = data.RawItem(u'a.txt', self.root)
+        item.load_stat()
+        os.remove(os.path.join(self.root, 'a.txt'))
+        self.assertEquals(item.size, 5)
+
+    def testMissingFile(self):
+        item = data.RawItem(u'gone', self.root)
+        self.assertEquals(item.size, None)
+        self.assertEquals(item.mtime, None)
+        self.assertEquals(item.stat_result, False)
+
+    def testLoaderStatsRequestedItems(self):
+        loaded = []
+        done = threading.Event()
+
+        def on_loaded(items):
+            loaded.append(items)
+            done.set()
+
+        loader = data.MetadataLoader(on_loaded)
+        loader.start()
+        items = [data.RawItem(u'a.txt', self.root)]
+
+        try:
+            loader.request(items)
+            done.wait(5.0)
+        finally:
+            loader.stop()
+
+        self.assertTrue(loaded[0] is items)
+        self.assertTrue(items[0].stat_result)
+
+
 class TestModel(unittest.TestCase):
     def setUp(self):
         self.model = data.PanelModel('m.')
@@ -75,6 +575,61 @@ class TestModel(unittest.TestCase):
         # have it added internally:
         self.assertEquals(len(self.model.items) - 1, fakeListLen)
 
+    def testStartFillingStreamsTheRest(self):
+        queued = []
+        call_later = lambda func, *args: queued.append((func, args))
+        self.model.start_filling_by_working_dir('.', call_later, 10)
+        self.assertEquals(len(self.model.items), 10 + 1)
+        self.assertTrue(self.model.is_scanning())
+
+        self.model._scanner.join()
+        for func, args in queued:
+            func(*args)
+
+        self.assertFalse(self.model.is_scanning())
+        self.assertEquals(len(self.model.items), 30 + 1)
+
+    def testStreamedBatchesMergeIntoSortedOrders(self):
+        queued = []
+        call_later = lambda func, *args: queued.append((func, args))
+        self.model.start_filling_by_working_dir('.', call_later, 10)
+        self.model.set_sort_mode(data.SORT_NATURAL)
+        self.model._scanner.join()
+        for func, args in queued:
+            func(*args)
+
+        streamed = [i.file_name for i in self.model.items]
+        self.model.set_sort_mode(data.SORT_BY_NAME)
+        streamed_by_name = [i.file_name for i in self.model.items]
+
+        self.model.fill_list_by_working_dir('.')
+        self.assertEquals(streamed_by_name,
+                          [i.file_name for i in self.model.items])
+        self.model.set_sort_mode(data.SORT_NATURAL)
+        self.assertEquals(streamed, [i.file_name for i in self.model.items])
+
+    def testMergeItemsKeepsTiesInOrder(self):
+        items = [data.RawItem(name, u'.') for name in [u'a', u'b', u'b']]
+        new_items = [data.RawItem(name, u'.') for name in [u'c', u'b', u'a']]
+        key = data.merge_key(data.SORT_BY_NAME)
+        merged, keys = data.merge_items(items, map(key, items), new_items,
+                                        key)
+        expected = sorted(items + new_items, key=key)
+        self.assertEquals(map(id, merged), map(id, expected))
+        self.assertEquals(keys, map(key, expected))
+
+    def testNavigatingAwayDropsQueuedBatches(self):
+        queued = []
+        call_later = lambda func, *args: queued.append((func, args))
+        self.model.start_filling_by_working_dir('.', call_later, 10)
+        self.model._scanner.join()
+        self.model.fill_list_by_working_dir('.')
+        items = self.model.items
+        for func, args in queued:
+            func(*args)
+
+        self.assertTrue(self.model.items is items)
+
     def testUpdirFromFlatView(self):
         self.model.fill_list_by_working_dir('.')
         self.model.flatten_directory()
@@ -85,6 +640,105 @@ class TestModel(unittest.TestCase):
         match = self.model.next_search_match('no_such_match', onePastLast)
         self.assertEquals(match, 0)
 
+    def testFuzzySearchRanksAndRestores(self):
+        self.model.fill_list_by_working_dir('.')
+        items = self.model.items
+        search = self.model.start_fuzzy_search('fl1')
+        self.assertTrue(self.model.run_fuzzy_search(search, 10.0))
+        names = [i.file_name for i in self.model.items]
+        self.assertEquals(names[0], 'file1')
+        self.assertEquals(len(names), 11)
+
+        self.model.end_fuzzy_search(False)
+        self.assertTrue(self.model.items is items)
+
+    def testFuzzySearchKeepsMatches(self):
+        self.model.fill_list_by_working_dir('.')
+        search = self.model.start_fuzzy_search('dir')
+        self.model.run_fuzzy_search(search, 10.0)
+        self.model.end_fuzzy_search(True)
+        self.assertFalse(self.model.is_fuzzy_searching())
+        self.assertEquals(len(self.model.items), 10)
+
+    def testSupersededFuzzySearchIsNotRun(self):
+        self.model.fill_list_by_working_dir('.')
+        old = self.model.start_fuzzy_search('d')
+        self.model.start_fuzzy_search('f')
+        self.assertTrue(self.model.run_fuzzy_search(old, 10.0))
+        self.assertFalse(old.done)
+
+    def testIndexOfName(self):
+        self.model.fill_list_by_working_dir('.')
+        self.assertEquals(self.model.index_of_name('file3'),
+                          self.model.items.index('file3'))
+        self.assertEquals(self.model.index_of_name('no_such_file'), None)
+
+    def testIndexOfNameFollowsNewItems(self):
+        self.model.fill_list_by_working_dir('.')
+        self.model.index_of_name('file3')
+        self.model.set_items(self.model.items[::-1])
+        self.assertEquals(self.model.index_of_name('file3'),
+                          self.model.items.index('file3'))
+
+    def testIndexOfPathWithRepeatedNames(self):
+        entries = [(u'a', u'/x', False, False), (u'a', u'/y', False, False),
+                   (u'a', u'/x', False, False)]
+        self.model.set_items(map(data.make_raw_item, entries))
+        self.assertEquals(self.model.index_of_name(u'a'), 0)
+        self.assertEquals(self.model.index_of_path(u'/x', u'a'), 0)
+        self.assertEquals(self.model.index_of_path(u'/y', u'a'), 1)
+        self.assertEquals(self.model.index_of_path(u'/z', u'a'), None)
+
+    def testSortModeSwitchDoesNotRescan(self):
+        data.list_files = util.fake_file_lister2
+        self.model.fill_list_by_working_dir('.')
+        data.list_files = util.failing_file_lister
+
+        try:
+            self.model.set_sort_mode(data.SORT_BY_NAME, True)
+        finally:
+            data.list_files = util.fake_file_lister
+
+        names = [i.file_name for i in self.model.items]
+        self.assertEquals(names, [u'..', u'dir1', u'dir0', u'file2', u'file1',
+                                  u'file0'])
+
+    def testSortedOrdersAreCachedUntilItemsChange(self):
+        self.model.fill_list_by_working_dir('.')
+        self.model.set_sort_mode(data.SORT_NATURAL)
+        parts = self.model._sorted_raw_items[data.SORT_NATURAL]
+        self.model.set_sort_mode(data.SORT_BY_NAME)
+        self.model.set_sort_mode(data.SORT_NATURAL)
+        self.assertTrue(self.model._sorted_raw_items[data.SORT_NATURAL]
+                        is parts)
+        self.assertEquals(self.model.items[2].file_name, u'dir1')
+
+        self.model.apply_dir_changes([], [u'file3'])
+        self.assertFalse(self.model._sorted_raw_items[data.SORT_NATURAL]
+                         is parts)
+
+    def testItemsToStatBeforeSorting(self):
+        data.list_files = util.fake_file_lister2
+
+        try:
+            self.model.fill_list_by_working_dir('.')
+        finally:
+            data.list_files = util.fake_file_lister
+
+        names = lambda items: sorted([i.file_name for i in items])
+        self.assertEquals(self.model.items_to_stat(data.SORT_NATURAL), [])
+        self.assertEquals(names(self.model.items_to_stat(data.SORT_BY_SIZE)),
+                          [u'.hid0', u'file0', u'file1', u'file2'])
+        self.assertEquals(names(self.model.items_to_stat(data.SORT_BY_MTIME)),
+                          [u'.hid0', u'dir0', u'dir1', u'file0', u'file1',
+                           u'file2'])
+
+        for item in self.model.items_to_stat(data.SORT_BY_MTIME):
+            item.stat_result = FakeStat(1, 1)
+
+        self.assertEquals(self.model.items_to_stat(data.SORT_BY_SIZE), [])
+        self.assertEquals(self.model.items_to_stat(data.SORT_BY_MTIME), [])
+
     def testSetDirFilter(self):
         self.model.set_dir_filter('a')
 
@@ -95,7 +749,23 @@ class TestModel(unittest.TestCase):
 def suite():
     modelSuite = unittest.makeSuite(TestModel, 'test')
     file_lister_suite = unittest.makeSuite(TestFileLister)
-    return unittest.TestSuite([modelSuite, file_lister_suite])
+    dir_entries_suite = unittest.makeSuite(TestDirEntries)
+    scanner_suite = unittest.makeSuite(TestDirectoryScanner)
+    cache_suite = unittest.makeSuite(TestListingCache)
+    dir_changes_suite = unittest.makeSuite(TestDirChanges)
+    walker_suite = unittest.makeSuite(TestParallelWalker)
+    construction_suite = unittest.makeSuite(TestListConstruction)
+    search_index_suite = unittest.makeSuite(TestSearchIndex)
+    metadata_suite = unittest.makeSuite(TestItemMetadata)
+    sorting_suite = unittest.makeSuite(TestSorting)
+    archive_suite = unittest.makeSuite(TestArchiveBrowsing)
+    updir_suite = unittest.makeSuite(TestUpdir)
+    return unittest.TestSuite([modelSuite, file_lister_suite,
+                               dir_entries_suite, scanner_suite, cache_suite,
+                               dir_changes_suite, walker_suite,
+                               construction_suite, search_index_suite,
+                               metadata_suite, sorting_suite, archive_suite,
+                               updir_suite])
 
 
 if __name__ == '__main__':
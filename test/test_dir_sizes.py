@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import threading
+
+sys.path.append(os.path.abspath('../src'))
+
+import dir_sizes
+
+
+class Item(object):
+    # Just what SizeComputer needs of a data.RawItem
+    def __init__(self, file_name, path):
+        self.file_name = file_name
+        self.path = path
+
+
+def write_file(path, size):
+    f = open(path, 'wb')
+    f.write('x' * size)
+    f.close()
+
+
+def usage_by_walking(root):
+    total = dir_sizes._disk_usage(os.lstat(root))
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        for name in dir_names + file_names:
+            total += dir_sizes._disk_usage(os.lstat(os.path.join(dir_path,
+                                                                 name)))
+
+    return total
+
+
+class TestTreeSize(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'a', 'b'))
+        write_file(os.path.join(self.root, 'a', 'one'), 10000)
+        write_file(os.path.join(self.root, 'a', 'b', 'two'), 20000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testSameAsWalking(self):
+        self.assertEquals(dir_sizes.tree_size(self.root),
+                          usage_by_walking(self.root))
+
+    def testHardLinksCountOnce(self):
+        if not hasattr(os, 'link'):
+            return
+
+        before = dir_sizes.tree_size(self.root)
+        os.link(os.path.join(self.root, 'a', 'one'),
+                os.path.join(self.root, 'one-again'))
+        self.assertEquals(dir_sizes.tree_size(self.root), before)
+
+
+class TestSizeComputer(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+        for name in ['a', 'b', 'c']:
+            os.mkdir(os.path.join(self.root, name))
+            write_file(os.path.join(self.root, name, 'file'), 5000)
+
+        self.items = [Item(name, self.root) for name in ['a', 'b', 'c']]
+        self.sizes = {}
+        self.done = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def on_size(self, computer, item, size):
+        self.sizes[item.file_name] = size
+
+    def on_done(self, computer):
+        self.done.set()
+
+    def compute(self, cache, num_processes):
+        computer = dir_sizes.SizeComputer(self.items, cache, self.on_size,
+                                          self.on_done, num_processes)
+        computer.start()
+        self.done.wait(30.0)
+        self.done.clear()
+
+    def expected_sizes(self):
+        sizes = {}
+
+        for name in ['a', 'b', 'c']:
+            sizes[name] = usage_by_walking(os.path.join(self.root, name))
+
+        return sizes
+
+    def testOnThisThread(self):
+        self.compute(dir_sizes.SizeCache(), 0)
+        self.assertEquals(self.sizes, self.expected_sizes())
+
+    def testInProcessPool(self):
+        if not dir_sizes.processes_available():
+            return
+
+        self.compute(dir_sizes.SizeCache(), 2)
+        self.assertEquals(self.sizes, self.expected_sizes())
+
+    def testCachedSizesAreNotComputedAgain(self):
+        cache = dir_sizes.SizeCache()
+        self.compute(cache, 0)
+        key = dir_sizes.size_cache_key(os.path.join(self.root, 'a'))
+        cache.put(key, 1)
+        self.compute(cache, 0)
+        self.assertEquals(self.sizes['a'], 1)
+
+    def testMissingDirectory(self):
+        self.items.append(Item('gone', self.root))
+        self.compute(dir_sizes.SizeCache(), 0)
+        self.assertEquals(self.sizes['gone'], None)
+
+
+def suite():
+    tree_size_suite = unittest.makeSuite(TestTreeSize)
+    computer_suite = unittest.makeSuite(TestSizeComputer)
+    return unittest.TestSuite([tree_size_suite, computer_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+import stat
+import errno
+import shutil
+import tempfile
+import threading
+
+sys.path.append(os.path.abspath('../src'))
+
+import file_ops
+import trash
+
+
+def write_file(path, data):
+    f = open(path, 'wb')
+    f.write(data)
+    f.close()
+
+
+def read_file(path):
+    f = open(path, 'rb')
+
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class FileOpsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = os.path.join(self.root, 'src')
+        self.dst = os.path.join(self.root, 'dst')
+        os.mkdir(self.src)
+        os.mkdir(self.dst)
+        self.data = os.urandom(3 * file_ops.CHUNK_SIZE + 123)
+        write_file(os.path.join(self.src, 'big'), self.data)
+        self.saved = (file_ops.copy_file_range, file_ops.sendfile)
+
+    def tearDown(self):
+        file_ops.copy_file_range, file_ops.sendfile = self.saved
+        shutil.rmtree(self.root)
+
+
+class TestCopyFile(FileOpsTestCase):
+    def copy(self):
+        chunks = []
+        file_ops.copy_file(os.path.join(self.src, 'big'),
+                           os.path.join(self.dst, 'big'), chunks.append)
+        self.assertEquals(read_file(os.path.join(self.dst, 'big')), self.data)
+        self.assertEquals(sum(chunks), len(self.data))
+
+    def testBuffered(self):
+        file_ops.copy_file_range = None
+        file_ops.sendfile = None
+        self.copy()
+
+    def testZeroCopy(self):
+        calls = []
+
+        def fake_copy_file_range(src_fd, dst_fd, count):
+            calls.append(count)
+            data = os.read(src_fd, count)
+            return os.write(dst_fd, data)
+
+        file_ops.copy_file_range = fake_copy_file_range
+        self.copy()
+        self.assertTrue(len(calls) > 1)
+
+    def testSystemZeroCopy(self):
+        # Whichever of them the system has must copy it all
+        for name in ['copy_file_range', 'sendfile']:
+            file_ops.copy_file_range, file_ops.sendfile = self.saved
+
+            if getattr(file_ops, name) is None:
+                continue
+
+            if name == 'sendfile':
+                file_ops.copy_file_range = None
+
+            self.copy()
+            os.remove(os.path.join(self.dst, 'big'))
+
+    def testFallsBackWhenUnsupported(self):
+        def unsupported(*args):
+            raise OSError(errno.EXDEV, 'Cross-device link')
+
+        file_ops.copy_file_range = unsupported
+        file_ops.sendfile = unsupported
+        self.copy()
+
+    def testKeepsMode(self):
+        os.chmod(os.path.join(self.src, 'big'), 0750)
+        self.copy()
+        mode = os.stat(os.path.join(self.dst, 'big')).st_mode
+        self.assertEquals(stat.S_IMODE(mode), 0750)
+
+    def testPartialFileIsRemoved(self):
+        def failing(src_fd, dst_fd, on_chunk):
+            os.write(dst_fd, 'x')
+            raise IOError(errno.ENOSPC, 'No space left on device')
+
+        copy_data = file_ops.copy_data
+        file_ops.copy_data = failing
+
+        try:
+            self.assertRaises(IOError, file_ops.copy_file,
+                              os.path.join(self.src, 'big'),
+                              os.path.join(self.dst, 'big'), None)
+        finally:
+            file_ops.copy_data = copy_data
+
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'big')))
+
+
+class TestJobs(FileOpsTestCase):
+    def setUp(self):
+        FileOpsTestCase.setUp(self)
+        os.makedirs(os.path.join(self.src, 'tree', 'sub'))
+        write_file(os.path.join(self.src, 'tree', 'sub', 'small'), 'abc')
+
+        if hasattr(os, 'symlink'):
+            os.symlink('sub/small', os.path.join(self.src, 'tree', 'link'))
+
+    def testCopyTree(self):
+        job = file_ops.Job(file_ops.COPY, [os.path.join(self.src, 'tree'),
+                                           os.path.join(self.src, 'big')],
+                           self.dst)
+        job.run()
+        self.assertEquals(job.errors, [])
+        self.assertEquals(job.num_done, 2)
+        self.assertEquals(job.bytes_total, len(self.data) + 3)
+        self.assertEquals(job.bytes_done, job.bytes_total)
+        copied = os.path.join(self.dst, 'tree', 'sub', 'small')
+        self.assertEquals(read_file(copied), 'abc')
+
+        if hasattr(os, 'symlink'):
+            link = os.path.join(self.dst, 'tree', 'link')
+            self.assertEquals(os.readlink(link), 'sub/small')
+
+    def testMove(self):
+        job = file_ops.Job(file_ops.MOVE, [os.path.join(self.src, 'tree')],
+                           self.dst)
+        job.run()
+        self.assertEquals(job.errors, [])
+        self.assertFalse(os.path.exists(os.path.join(self.src, 'tree')))
+        self.assertTrue(os.path.exists(os.path.join(self.dst, 'tree', 'sub')))
+
+    def testExistingDestinationIsAnError(self):
+        write_file(os.path.join(self.dst, 'big'), 'old')
+        job = file_ops.Job(file_ops.COPY, [os.path.join(self.src, 'big')],
+                           self.dst)
+        job.run()
+        self.assertEquals(len(job.errors), 1)
+        self.assertEquals(read_file(os.path.join(self.dst, 'big')), 'old')
+
+    def testUncreatableDestinationFailsTheSources(self):
+        # Under a file, so that not even root can make it
+        dest_dir = os.path.join(self.src, 'big', 'dest')
+        sources = [os.path.join(self.src, 'tree')]
+        job = file_ops.Job(file_ops.COPY, sources, dest_dir)
+        job.run()
+        self.assertEquals(job.num_done, 0)
+        self.assertEquals([src for src, message in job.errors], sources)
+
+    def testCopyIntoItself(self):
+        tree = os.path.join(self.src, 'tree')
+        job = file_ops.Job(file_ops.COPY, [tree], os.path.join(tree, 'sub'))
+        job.run()
+        self.assertEquals(len(job.errors), 1)
+
+    def testQueue(self):
+        done = []
+        finished = threading.Event()
+
+        def on_done(job):
+            done.append(job)
+
+            if len(done) == 2:
+                finished.set()
+
+        queue = file_ops.JobQueue(lambda job: None, on_done)
+        queue.start()
+
+        try:
+            cancelled = file_ops.Job(file_ops.COPY,
+                                     [os.path.join(self.src, 'tree')],
+                                     self.dst)
+            cancelled.cancel()
+            queue.submit(cancelled)
+            queue.submit(file_ops.Job(file_ops.COPY,
+                                      [os.path.join(self.src, 'big')],
+                                      self.dst))
+            finished.wait(10.0)
+        finally:
+            queue.stop()
+
+        self.assertEquals(done[0].num_done, 0)
+        self.assertEquals(done[1].num_done, 1)
+        self.assertEquals(queue.pending_jobs(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.dst, 'tree')))
+
+    def testQueueGoesOnAfterUnexpectedError(self):
+        done = []
+        finished = threading.Event()
+
+        def on_done(job):
+            done.append(job)
+
+            if len(done) == 2:
+                finished.set()
+
+        def broken():
+            raise ValueError('broken')
+
+        queue = file_ops.JobQueue(lambda job: None, on_done)
+        queue.start()
+
+        try:
+            failing = file_ops.Job(file_ops.COPY,
+                                   [os.path.join(self.src, 'tree')],
+                                   self.dst)
+            failing._run_copy = broken
+            queue.submit(failing)
+            queue.submit(file_ops.Job(file_ops.COPY,
+                                      [os.path.join(self.src, 'big')],
+                                      self.dst))
+            finished.wait(10.0)
+        finally:
+            queue.stop()
+
+        self.assertEquals(len(done[0].errors), 1)
+        self.assertTrue('broken' in done[0].errors[0][1])
+        self.assertEquals(done[1].num_done, 1)
+
+
+class TestCopyScheduler(FileOpsTestCase):
+    def setUp(self):
+        FileOpsTestCase.setUp(self)
+
+        for i in range(3):
+            sub = os.path.join(self.src, 'many', 'sub%d' % (i))
+            os.makedirs(sub)
+
+            for j in range(20):
+                write_file(os.path.join(sub, 'f%d' % (j)), 'data %d %d' % (i, j))
+
+        shutil.move(os.path.join(self.src, 'big'),
+                    os.path.join(self.src, 'many', 'big'))
+        self.stamp = 1000000000
+        os.utime(os.path.join(self.src, 'many', 'sub1'),
+                 (self.stamp, self.stamp))
+        os.utime(os.path.join(self.src, 'many', 'sub1', 'f3'),
+                 (self.stamp, self.stamp))
+        os.chmod(os.path.join(self.src, 'many', 'sub2', 'f0'), 0600)
+
+    def run_plan(self, num_workers):
+        plan = file_ops.CopyPlan()
+        plan.add_tree(os.path.join(self.src, 'many'),
+                      os.path.join(self.dst, 'many'))
+        self.assertEquals(len(plan.dirs), 4)
+        self.assertEquals(len(plan.files), 61)
+        small_sizes = [len('data %d %d' % (i, j))
+                       for i in range(3) for j in range(20)]
+        self.assertEquals(plan.bytes_total, len(self.data) + sum(small_sizes))
+
+        chunks = []
+        scheduler = file_ops.CopyScheduler(plan, chunks.append, num_workers)
+        scheduler.run()
+        self.assertEquals(scheduler.errors, [])
+        self.assertEquals(sum(chunks), plan.bytes_total)
+
+    def check_copy(self):
+        for i in range(3):
+            for j in range(20):
+                path = os.path.join(self.dst, 'many', 'sub%d' % (i),
+                                    'f%d' % (j))
+                self.assertEquals(read_file(path), 'data %d %d' % (i, j))
+
+        big = os.path.join(self.dst, 'many', 'big')
+        self.assertEquals(read_file(big), self.data)
+
+        sub1 = os.path.join(self.dst, 'many', 'sub1')
+        self.assertEquals(int(os.stat(sub1).st_mtime), self.stamp)
+        f3 = os.path.join(sub1, 'f3')
+        self.assertEquals(int(os.stat(f3).st_mtime), self.stamp)
+        f0 = os.path.join(self.dst, 'many', 'sub2', 'f0')
+        self.assertEquals(stat.S_IMODE(os.stat(f0).st_mode), 0600)
+
+    def testParallel(self):
+        self.run_plan(4)
+        self.check_copy()
+
+    def testWithoutWorkers(self):
+        self.run_plan(0)
+        self.check_copy()
+
+    def testCancel(self):
+        plan = file_ops.CopyPlan()
+        plan.add_tree(os.path.join(self.src, 'many'),
+                      os.path.join(self.dst, 'many'))
+
+        def cancel(num_bytes):
+            raise file_ops.JobCancelled()
+
+        scheduler = file_ops.CopyScheduler(plan, cancel, 4)
+        self.assertRaises(file_ops.JobCancelled, scheduler.run)
+
+    def testFlatJob(self):
+        root = os.path.join(self.src, 'many')
+        sources = [os.path.join(root, 'sub0', 'f1'),
+                   os.path.join(root, 'sub2', 'f5'),
+                   os.path.join(root, 'big')]
+        job = file_ops.Job(file_ops.COPY, sources, self.dst, root, 2)
+        job.run()
+        self.assertEquals(job.errors, [])
+        self.assertEquals(job.num_done, 3)
+        self.assertEquals(read_file(os.path.join(self.dst, 'sub2', 'f5')),
+                          'data 2 5')
+        self.assertEquals(sorted(os.listdir(self.dst)),
+                          ['big', 'sub0', 'sub2'])
+
+    def testFlatMove(self):
+        root = os.path.join(self.src, 'many')
+        job = file_ops.Job(file_ops.MOVE, [os.path.join(root, 'sub1', 'f2')],
+                           self.dst, root)
+        job.run()
+        self.assertEquals(job.errors, [])
+        self.assertEquals(read_file(os.path.join(self.dst, 'sub1', 'f2')),
+                          'data 1 2')
+        self.assertFalse(os.path.exists(os.path.join(root, 'sub1', 'f2')))
+
+
+class TestRemoval(FileOpsTestCase):
+    def setUp(self):
+        FileOpsTestCase.setUp(self)
+        self.tree = os.path.join(self.src, 'tree')
+
+        for i in range(4):
+            sub = os.path.join(self.tree, 'sub%d' % (i), 'deeper')
+            os.makedirs(sub)
+
+            for j in range(10):
+                write_file(os.path.join(sub, 'f%d' % (j)), 'x')
+
+        if hasattr(os, 'symlink'):
+            os.symlink(self.dst, os.path.join(self.tree, 'link'))
+
+        self.saved_data_home = os.environ.get('XDG_DATA_HOME')
+        os.environ['XDG_DATA_HOME'] = self.root
+        self.journal = trash.Journal(os.path.join(self.root, 'journal'))
+
+    def tearDown(self):
+        if self.saved_data_home is None:
+            del os.environ['XDG_DATA_HOME']
+        else:
+            os.environ['XDG_DATA_HOME'] = self.saved_data_home
+
+        FileOpsTestCase.tearDown(self)
+
+    def testTreeRemover(self):
+        removed = []
+        remover = file_ops.TreeRemover([self.tree], lambda: removed.append(1),
+                                       4)
+        num_entries = remover.walk()
+        remover.run()
+        self.assertEquals(remover.errors, [])
+        self.assertEquals(len(removed), num_entries)
+        self.assertFalse(os.path.lexists(self.tree))
+
+        # Symlinks are removed, not followed
+        self.assertTrue(os.path.exists(self.dst))
+
+    def testDelete(self):
+        job = file_ops.Job(file_ops.DELETE, [self.tree,
+                                             os.path.join(self.src, 'big'),
+                                             os.path.join(self.src, 'gone')])
+        job.run()
+        self.assertEquals(job.num_done, 3)
+        self.assertEquals(job.failed, [])
+        self.assertEquals(len(job.errors), 1)
+        self.assertEquals(os.listdir(self.src), [])
+
+    def testCancelledDeleteReportsWhatIsLeft(self):
+        job = file_ops.Job(file_ops.DELETE, [self.tree])
+        job.cancel()
+        job.run()
+        self.assertEquals(job.failed, [self.tree])
+        self.assertEquals(job.num_done, 0)
+
+    def testTrashAndRestore(self):
+        big = os.path.join(self.src, 'big')
+        job = file_ops.Job(file_ops.TRASH, [self.tree, big],
+                           journal=self.journal)
+        job.run()
+        self.assertEquals(job.errors, [])
+        self.assertEquals(job.num_done, 2)
+        self.assertEquals(os.listdir(self.src), [])
+        self.assertEquals(sorted(os.listdir(os.path.join(self.root, 'Trash',
+                                                         'files'))),
+                          ['big', 'tree'])
+
+        job = file_ops.Job(file_ops.RESTORE, [], journal=self.journal)
+        job.run()
+        self.assertEquals(job.errors, [])
+        self.assertEquals(job.restored, [self.tree, big])
+        self.assertEquals(read_file(big), self.data)
+        self.assertEquals(self.journal.last_batch(), None)
+
+    def testRestoreOnlyTheLastBatch(self):
+        big = os.path.join(self.src, 'big')
+        file_ops.Job(file_ops.TRASH, [big], journal=self.journal).run()
+        file_ops.Job(file_ops.TRASH, [self.tree], journal=self.journal).run()
+        job = file_ops.Job(file_ops.RESTORE, [], journal=self.journal)
+        job.run()
+        self.assertEquals(job.restored, [self.tree])
+        self.assertFalse(os.path.exists(big))
+
+    def testNothingTrashedWithoutJournal(self):
+        def failing_record(batch, original, trashed):
+            raise IOError(errno.ENOSPC, 'No space left on device')
+
+        self.journal.record = failing_record
+        big = os.path.join(self.src, 'big')
+        job = file_ops.Job(file_ops.TRASH, [big], journal=self.journal)
+        job.run()
+        self.assertEquals(len(job.errors), 1)
+        self.assertEquals(job.failed, [big])
+        self.assertEquals(read_file(big), self.data)
+
+        for sub in ['files', 'info']:
+            self.assertEquals(os.listdir(os.path.join(self.root, 'Trash',
+                                                      sub)), [])
+
+    def testFailedMoveIsNotJournaled(self):
+        gone = os.path.join(self.src, 'gone')
+        job = file_ops.Job(file_ops.TRASH, [gone], journal=self.journal)
+        job.run()
+        self.assertEquals(job.failed, [gone])
+        self.assertEquals(self.journal.last_batch(), None)
+
+    def testUnexpectedErrorReportsWhatIsLeft(self):
+        def broken(path, trash_dir=None):
+            raise ValueError('broken')
+
+        reserve_in_trash = trash.reserve_in_trash
+        trash.reserve_in_trash = broken
+
+        try:
+            job = file_ops.Job(file_ops.TRASH, [self.tree],
+                               journal=self.journal)
+            job.run()
+        finally:
+            trash.reserve_in_trash = reserve_in_trash
+
+        self.assertEquals(job.failed, [self.tree])
+        self.assertEquals(len(job.errors), 1)
+
+    def testRestoreKeepsWhatCantGoBack(self):
+        big = os.path.join(self.src, 'big')
+        file_ops.Job(file_ops.TRASH, [big], journal=self.journal).run()
+        write_file(big, 'new')
+        job = file_ops.Job(file_ops.RESTORE, [], journal=self.journal)
+        job.run()
+        self.assertEquals(len(job.errors), 1)
+        self.assertEquals(read_file(big), 'new')
+        self.assertEquals(self.journal.last_batch()[1][0][0], big)
+
+
+def suite():
+    copy_file_suite = unittest.makeSuite(TestCopyFile)
+    jobs_suite = unittest.makeSuite(TestJobs)
+    scheduler_suite = unittest.makeSuite(TestCopyScheduler)
+    removal_suite = unittest.makeSuite(TestRemoval)
+    return unittest.TestSuite([copy_file_suite, jobs_suite, scheduler_suite,
+                               removal_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+import unittest
+import os
+import sys
+import re
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import paged_file
+import file_search
+
+
+class TestFileSearch(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.paged = None
+        self.progress = []
+        self.done = []
+
+    def tearDown(self):
+        if self.paged is not None:
+            self.paged.close()
+
+        shutil.rmtree(self.root)
+
+    def open(self, contents):
+        path = os.path.join(self.root, 'f')
+        f = open(path, 'wb')
+        f.write(contents)
+        f.close()
+        self.paged = paged_file.PagedFile(path)
+
+    def on_progress(self, search, offset):
+        self.progress.append(offset)
+
+    def on_done(self, search):
+        self.done.append(search)
+
+    def find(self, query, offset=0, direction=file_search.FORWARD,
+             chunk_size=4):
+        # Chunks this small put matches across their boundaries
+        search = file_search.FileSearch(self.paged, query, offset, direction,
+                                        self.on_progress, self.on_done,
+                                        chunk_size)
+        search.run()
+        self.assertEquals(self.done, [search])
+        del self.done[:]
+        return search.match
+
+    def testForward(self):
+        self.open('one two\nthree two\n')
+        self.assertEquals(self.find('two'), (4, 7))
+        self.assertEquals(self.find('two', 5), (14, 17))
+        self.assertEquals(self.find('two', 15), None)
+
+    def testBackward(self):
+        self.open('one two\nthree two\n')
+        self.assertEquals(self.find('two', 18, file_search.BACKWARD),
+                          (14, 17))
+        self.assertEquals(self.find('two', 14, file_search.BACKWARD), (4, 7))
+        self.assertEquals(self.find('two', 4, file_search.BACKWARD), None)
+
+    def testAcrossChunks(self):
+        self.open('abcdefghij')
+
+        for chunk_size in range(1, 11):
+            self.assertEquals(self.find('defgh', 0, chunk_size=chunk_size),
+                              (3, 8))
+            self.assertEquals(self.find('defgh', 10, file_search.BACKWARD,
+                                        chunk_size),
+                              (3, 8))
+            self.assertEquals(self.find('re:d.*h', 0, chunk_size=chunk_size),
+                              (3, 8))
+            self.assertEquals(self.find('re:d.*h', 10, file_search.BACKWARD,
+                                        chunk_size),
+                              (3, 8))
+
+    def testBackwardMatchEndingAfterOffset(self):
+        self.open('abcdef')
+        self.assertEquals(self.find('cde', 3, file_search.BACKWARD), (2, 5))
+        self.assertEquals(self.find('re:c\w+', 3, file_search.BACKWARD),
+                          (2, 6))
+
+    def testRegexLineAnchors(self):
+        self.open('xab\nab\nxab')
+        self.assertEquals(self.find('re:^ab'), (4, 6))
+        self.assertEquals(self.find('re:^ab', 1), (4, 6))
+        self.assertEquals(self.find('re:^ab', 10, file_search.BACKWARD),
+                          (4, 6))
+
+    def testSmartCase(self):
+        self.open('Foo foo')
+        self.assertEquals(self.find('foo'), (0, 3))
+        self.assertEquals(self.find('foo', 1), (4, 7))
+        self.assertEquals(self.find('Foo', 1), None)
+        self.assertEquals(self.find('re:FOO'), None)
+        self.assertEquals(self.find('re:fo+', 1), (4, 7))
+
+    def testCancelled(self):
+        self.open('abc' * 10)
+        search = file_search.FileSearch(self.paged, 'x', 0,
+                                        file_search.FORWARD,
+                                        self.on_progress, self.on_done, 1)
+        search.cancel()
+        search.run()
+        self.assertEquals(search.match, None)
+        self.assertEquals(self.done, [search])
+
+    def testProgress(self):
+        self.open('abc')
+        self.find('x', chunk_size=1)
+        self.assertEquals(self.progress, [1])
+
+    def testEmptyFile(self):
+        self.open('')
+        self.assertEquals(self.find('x'), None)
+        self.assertEquals(self.find('x', 0, file_search.BACKWARD), None)
+
+    def testBadRegex(self):
+        self.assertRaises(re.error, file_search.make_pattern, 're:(')
+
+
+def suite():
+    search_suite = unittest.makeSuite(TestFileSearch)
+    return unittest.TestSuite([search_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
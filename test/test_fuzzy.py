@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.abspath('../src'))
+
+import fuzzy
+
+
+class TestScore(unittest.TestCase):
+    def testNoMatch(self):
+        self.assertEquals(fuzzy.score('abc', 'acb', 'acb'), None)
+
+    def testMatchIsCaseInsensitive(self):
+        self.assertNotEquals(fuzzy.score('rm', 'readme', 'README'), None)
+
+    def testShortestStretchIsPicked(self):
+        self.assertEquals(fuzzy.match_positions('ab', 'axxab'), [3, 4])
+
+    def testConsecutiveBeatsScattered(self):
+        consecutive = fuzzy.score('abc', 'xabcx', 'xabcx')
+        scattered = fuzzy.score('abc', 'xaxbxc', 'xaxbxc')
+        self.assertTrue(consecutive > scattered)
+
+    def testWordStartsBeatMiddles(self):
+        boundaries = fuzzy.score('fb', 'foo_bar', 'foo_bar')
+        middles = fuzzy.score('fb', 'xfxxbx', 'xfxxbx')
+        self.assertTrue(boundaries > middles)
+
+    def testCamelCaseIsBoundary(self):
+        camel = fuzzy.score('fb', 'foobar', 'fooBar')
+        plain = fuzzy.score('fb', 'foobar', 'foobar')
+        self.assertTrue(camel > plain)
+
+
+class TestFuzzyIndex(unittest.TestCase):
+    def setUp(self):
+        self.names = ['data.py', 'test_data.py', 'candy.py', 'daemon.txt',
+                      'readme']
+        self.index = fuzzy.FuzzyIndex(self.names)
+
+    def _ranked_names(self, query):
+        search = self.index.search(query)
+        search.run(10.0)
+        return [self.names[i] for i in search.ranked()]
+
+    def testRanking(self):
+        self.assertEquals(self._ranked_names('data'),
+                          ['data.py', 'test_data.py'])
+
+    def testShorterNameWinsATie(self):
+        self.assertEquals(self._ranked_names('py')[0], 'data.py')
+
+    def testNoMatches(self):
+        self.assertEquals(self._ranked_names('zzz'), [])
+
+    def testNarrowingGivesSameResults(self):
+        self._ranked_names('d')
+        self._ranked_names('da')
+        narrowed = self._ranked_names('dap')
+
+        index = fuzzy.FuzzyIndex(self.names)
+        search = index.search('dap')
+        search.run(10.0)
+        fresh = [self.names[i] for i in search.ranked()]
+        self.assertEquals(narrowed, fresh)
+        self.assertEquals(sorted(fresh), ['data.py', 'test_data.py'])
+
+    def testNarrowingUnfinishedSearch(self):
+        names = ['name%d' % i for i in range(fuzzy.CHECK_BUDGET_EVERY * 4)]
+        index = fuzzy.FuzzyIndex(names)
+        search = index.search('n')
+        search.run(-1.0)
+
+        # Both the matches found so far and the names not scored yet
+        search = index.search('n1')
+        search.run(10.0)
+        self.assertEquals(sorted(search.ranked()),
+                          [i for i, name in enumerate(names) if '1' in name])
+
+    def testWideningStartsOver(self):
+        self._ranked_names('dat')
+        self.assertEquals(self._ranked_names('rd'), ['readme'])
+
+    def testNamesTakenWithKey(self):
+        index = fuzzy.FuzzyIndex([(name,) for name in self.names],
+                                 lambda item: item[0])
+        search = index.search('cdy')
+        search.run(10.0)
+        self.assertEquals(search.ranked(), [2])
+
+    def testBudgetRunsOut(self):
+        names = ['name%d' % i for i in range(fuzzy.CHECK_BUDGET_EVERY * 4)]
+        index = fuzzy.FuzzyIndex(names)
+        search = index.search('n')
+        self.assertFalse(search.run(-1.0))
+        self.assertEquals(len(search.ranked()), fuzzy.CHECK_BUDGET_EVERY)
+
+        while not search.run(-1.0):
+            pass
+
+        self.assertTrue(search.done)
+        self.assertEquals(len(search.ranked()), len(names))
+
+
+def suite():
+    score_suite = unittest.makeSuite(TestScore)
+    index_suite = unittest.makeSuite(TestFuzzyIndex)
+    return unittest.TestSuite([score_suite, index_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -205,6 +205,52 @@ class TestKeyboardOnRealConfig(unittest.TestCase):
         self.assertNotEquals(func, None)
 
 
+class CommandNames(object):
+    """Stands in for a panel, each command being its own name."""
+    def __getattr__(self, name):
+        return name
+
+
+class TestSameKeyDifferentModifiers(unittest.TestCase):
+    def setUp(self):
+        self.kconfig = keyboard.KeyboardConfig()
+        self.kconfig.load(u'keys.conf', CommandNames())
+
+    def command(self, key_code, key_mod):
+        return self.kconfig.get_func(key_code, key_mod)
+
+    def testUpdirAndUndoTrash(self):
+        self.assertEquals(self.command(ord('U'), 0), 'updir')
+        self.assertEquals(self.command(ord('U'), wx.MOD_SHIFT), 'undo_trash')
+
+    def testTrashAndDelete(self):
+        self.assertEquals(self.command(wx.WXK_F8, 0), 'trash_selected')
+        self.assertEquals(self.command(wx.WXK_F8, wx.MOD_SHIFT),
+                          'delete_selected')
+
+    def testClearScreenAndCancel(self):
+        self.assertEquals(self.command(ord('C'), 0), 'clear_screen')
+        self.assertEquals(self.command(ord('C'), wx.MOD_CONTROL),
+                          'cancel_file_operations')
+
+    def testSortModeAndOrder(self):
+        self.assertEquals(self.command(ord('S'), 0), 'cycle_sort_mode')
+        self.assertEquals(self.command(ord('S'), wx.MOD_SHIFT),
+                          'reverse_sort_order')
+
+    def testSearchAndFuzzySearch(self):
+        self.assertEquals(self.command(ord('/'), 0), 'on_start_inc_search')
+        self.assertEquals(self.command(ord('/'), wx.MOD_SHIFT),
+                          'toggle_fuzzy_search')
+
+    def testWinModifierIgnored(self):
+        self.assertEquals(self.command(ord('U'), wx.MOD_WIN), 'updir')
+
+    def testNoModifiersReported(self):
+        # Char events come without modifiers, bindings with them still go
+        self.assertEquals(self.command(ord('`'), None), 'go_home')
+
+
 class TestKeyValueSplit(unittest.TestCase):
     def test_simple_cplit(self):
         test_val = 'on_next_match: n'
@@ -235,8 +281,9 @@ def suite():
     kbd_handler_suite = unittest.makeSuite(TestKeyboardEventHandler, 'test')
     split_suite = unittest.makeSuite(TestKeyValueSplit)
     real_config_suite = unittest.makeSuite(TestKeyboardOnRealConfig)
+    modifiers_suite = unittest.makeSuite(TestSameKeyDifferentModifiers)
     return unittest.TestSuite([kbd_handler_suite, split_suite,
-                               real_config_suite])
+                               real_config_suite, modifiers_suite])
 
 
 if __name__ == '__main__':
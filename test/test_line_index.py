@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import paged_file
+import line_index
+
+
+class LineIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.paged = None
+        self.saved = line_index.INDEX_STEP
+        line_index.INDEX_STEP = 2
+
+    def tearDown(self):
+        line_index.INDEX_STEP = self.saved
+
+        if self.paged is not None:
+            self.paged.close()
+
+        shutil.rmtree(self.root)
+
+    def open(self, contents):
+        path = os.path.join(self.root, 'f')
+        f = open(path, 'wb')
+        f.write(contents)
+        f.close()
+        self.paged = paged_file.PagedFile(path)
+        return self.paged
+
+    def index(self, index=None, chunk_size=3):
+        if index is None:
+            index = line_index.LineIndex()
+
+        done = []
+        indexer = line_index.LineIndexer(index, self.paged,
+                                         lambda indexer: None, done.append,
+                                         chunk_size)
+        indexer.run()
+        self.assertEquals(done, [indexer])
+        return index
+
+
+class TestLineIndex(LineIndexTestCase):
+    def testOffsets(self):
+        self.open('a\nbb\n\nccc\nd\n')
+
+        # Whatever the chunks, every second line is where it is
+        for chunk_size in range(1, 15):
+            index = self.index(chunk_size=chunk_size)
+            self.assertEquals(index.offsets, [0, 5, 10])
+            self.assertEquals(index.indexed_to, 12)
+            self.assertEquals(index.num_lines(), 5)
+
+    def testOffsetOfLine(self):
+        f = self.open('a\nbb\n\nccc\nd')
+        index = self.index()
+        found = [index.offset_of_line(f.data, line) for line in range(6)]
+        self.assertEquals(found, [0, 2, 5, 6, 10, None])
+        self.assertEquals(index.offset_of_line(f.data, -1), None)
+        self.assertEquals(index.num_lines(), 5)
+
+    def testLineOfOffset(self):
+        f = self.open('a\nbb\n\nccc\nd')
+        index = self.index()
+        found = [index.line_of_offset(f.data, offset)
+                 for offset in [0, 1, 2, 5, 6, 9, 10]]
+        self.assertEquals(found, [0, 0, 1, 2, 3, 3, 4])
+        self.assertEquals(index.line_of_offset(f.data, 11), None)
+
+    def testEmpty(self):
+        f = self.open('')
+        index = self.index()
+        self.assertEquals(index.num_lines(), 0)
+        self.assertEquals(index.offset_of_line(f.data, 0), None)
+        self.assertEquals(index.line_of_offset(f.data, 0), None)
+
+    def testPartial(self):
+        f = self.open('a\nb\nc\nd\ne\n')
+        index = line_index.LineIndex()
+        indexer = line_index.LineIndexer(index, f, None, lambda i: None, 4)
+        indexer._index_chunk(0, f.data[0:4])
+
+        # Usable as far as it got
+        self.assertEquals(index.offset_of_line(f.data, 1), 2)
+        self.assertEquals(index.offset_of_line(f.data, 2), None)
+        self.assertEquals(index.line_of_offset(f.data, 2), 1)
+        self.assertEquals(index.line_of_offset(f.data, 4), None)
+
+        # And goes on from there
+        self.index(index)
+        self.assertEquals(index.offsets, [0, 4, 8])
+        self.assertEquals(index.offset_of_line(f.data, 4), 8)
+
+    def testCancelled(self):
+        self.open('a\nb\n')
+        index = line_index.LineIndex()
+        done = []
+        indexer = line_index.LineIndexer(index, self.paged, None,
+                                         done.append, 1)
+        indexer.cancel()
+        indexer.run()
+        self.assertEquals(index.indexed_to, 0)
+        self.assertEquals(done, [indexer])
+
+    def testGrown(self):
+        f = self.open('a\nb')
+        index = self.index()
+        self.assertEquals(index.num_lines(), 2)
+
+        out = open(f.path, 'ab')
+        out.write('b\nc\n')
+        out.close()
+        f.refresh()
+        self.index(index)
+        self.assertEquals(index.offsets, [0, 5])
+        self.assertEquals(index.num_lines(), 3)
+
+
+class TestLineIndexCache(unittest.TestCase):
+    def testGet(self):
+        cache = line_index.LineIndexCache()
+        index = cache.get('f', (10, 100))
+        self.assertEquals(cache.get('f', (10, 100)), index)
+        self.assertNotEquals(cache.get('f', (11, 100)), index)
+        self.assertNotEquals(cache.get('g', (11, 100)), index)
+        self.assertEquals(len(cache), 2)
+
+    def testPut(self):
+        cache = line_index.LineIndexCache()
+        index = cache.get('f', (10, 100))
+        cache.put('f', (20, 200), index)
+        self.assertEquals(cache.get('f', (20, 200)), index)
+        self.assertEquals(len(cache), 1)
+
+    def testLeastRecentlyUsedGo(self):
+        cache = line_index.LineIndexCache(2)
+        first = cache.get('a', (1, 1))
+        cache.get('b', (1, 1))
+        cache.get('a', (1, 1))
+        cache.get('c', (1, 1))
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.get('a', (1, 1)), first)
+
+
+def suite():
+    index_suite = unittest.makeSuite(TestLineIndex)
+    cache_suite = unittest.makeSuite(TestLineIndexCache)
+    return unittest.TestSuite([index_suite, cache_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
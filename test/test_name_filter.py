@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.abspath('../src'))
+
+import name_filter
+
+
+class TestNameFilter(unittest.TestCase):
+    def setUp(self):
+        self.names = [u'data.py', u'test_data.py', u'README', u'notes.txt',
+                      u'Makefile', u'a1', u'a22', u'b1']
+
+    def select(self, expression):
+        selected = name_filter.NameFilter(expression).select(self.names)
+        one_by_one = [i for i, name in enumerate(self.names)
+                      if name_filter.NameFilter(expression).matches(name)]
+        self.assertEquals(selected, one_by_one)
+        return [self.names[i] for i in selected]
+
+    def testSubstringIsCaseInsensitive(self):
+        self.assertEquals(self.select(u'MAKE'), [u'Makefile'])
+
+    def testGlobMatchesWholeName(self):
+        self.assertEquals(self.select(u'*.py'), [u'data.py', u'test_data.py'])
+        self.assertEquals(self.select(u'a?'), [u'a1'])
+        self.assertEquals(self.select(u'[ab]1'), [u'a1', u'b1'])
+        self.assertEquals(self.select(u'[!a]1'), [u'b1'])
+
+    def testRegex(self):
+        self.assertEquals(self.select(u're:^a\\d+$'), [u'a1', u'a22'])
+
+    def testExtensionSet(self):
+        self.assertEquals(self.select(u'ext:py,txt'),
+                          [u'data.py', u'test_data.py', u'notes.txt'])
+
+    def testNegation(self):
+        self.assertEquals(self.select(u'*.py !test_*'), [u'data.py'])
+        self.assertEquals(self.select(u'!a'), [u'notes.txt', u'b1'])
+
+    def testAnyPositiveTermPasses(self):
+        self.assertEquals(self.select(u'readme make'), [u'README', u'Makefile'])
+
+    def testRegexAcrossNamesIsNotAMatch(self):
+        # '1[^x]a' would match across 'a1' and 'a22' in the joined names
+        self.assertEquals(self.select(u're:1[^x]a'), [])
+
+    def testNamesWithNewlines(self):
+        self.names.append(u'odd\nname')
+        self.assertEquals(self.select(u'name'), [u'odd\nname'])
+
+    def testRegexMatchingEmpty(self):
+        # These match nothing at the end of the names, which must not be
+        # looked for again and again
+        self.assertEquals(self.select(u're:$'), self.names)
+        self.assertEquals(self.select(u're:x*'), self.names)
+        self.assertEquals(self.select(u're:.*'), self.names)
+        self.assertEquals(self.select(u're:b?'), self.names)
+
+        self.names = [u'xa', u'b']
+        self.assertEquals(self.select(u're:$'), [u'xa', u'b'])
+        self.assertEquals(self.select(u're:^b$'), [u'b'])
+
+    def testBadRegex(self):
+        self.assertRaises(name_filter.FilterError, name_filter.NameFilter,
+                          u're:(')
+
+
+def suite():
+    return unittest.makeSuite(TestNameFilter)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
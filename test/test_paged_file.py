@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import paged_file
+
+
+class PagedFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.files = []
+
+    def tearDown(self):
+        for f in self.files:
+            f.close()
+
+        shutil.rmtree(self.root)
+
+    def open(self, contents):
+        path = os.path.join(self.root, 'f%d' % (len(self.files)))
+        f = open(path, 'wb')
+        f.write(contents)
+        f.close()
+        paged = paged_file.PagedFile(path)
+        self.files.append(paged)
+        return paged
+
+
+class TestLines(PagedFileTestCase):
+    def testReadLines(self):
+        f = self.open('one\ntwo\r\nthree\n')
+        self.assertEquals(f.read_lines(0, 10),
+                          ([0, 4, 9], ['one', 'two', 'three'], 15))
+        self.assertEquals(f.read_lines(4, 1), ([4], ['two'], 9))
+
+    def testLastLineWithoutNewline(self):
+        f = self.open('one\ntwo')
+        self.assertEquals(f.read_lines(0, 10), ([0, 4], ['one', 'two'], 7))
+        self.assertEquals(f.last_lines(1), 4)
+
+    def testLastLines(self):
+        f = self.open('one\ntwo\nthree\n')
+        self.assertEquals(f.last_lines(1), 8)
+        self.assertEquals(f.last_lines(2), 4)
+        self.assertEquals(f.last_lines(10), 0)
+
+    def testNextAndPrev(self):
+        f = self.open('one\n\ntwo\n')
+        self.assertEquals(f.next_line(0), 4)
+        self.assertEquals(f.next_line(4), 5)
+        self.assertEquals(f.prev_line(5), 4)
+        self.assertEquals(f.prev_line(4), 0)
+        self.assertEquals(f.prev_line(0), 0)
+
+    def testLineStart(self):
+        f = self.open('one\ntwo\n')
+        self.assertEquals(f.line_start(0), 0)
+        self.assertEquals(f.line_start(2), 0)
+        self.assertEquals(f.line_start(4), 4)
+        self.assertEquals(f.line_start(6), 4)
+        self.assertEquals(f.line_start(100), 8)
+
+    def testEmpty(self):
+        f = self.open('')
+        self.assertEquals(f.read_lines(0, 10), ([], [], 0))
+        self.assertEquals(f.last_lines(10), 0)
+        self.assertTrue(f.is_end(0))
+
+
+class TestLongLines(PagedFileTestCase):
+    def setUp(self):
+        PagedFileTestCase.setUp(self)
+        self.saved = paged_file.MAX_LINE_LENGTH
+        paged_file.MAX_LINE_LENGTH = 4
+
+    def tearDown(self):
+        paged_file.MAX_LINE_LENGTH = self.saved
+        PagedFileTestCase.tearDown(self)
+
+    def testCutIntoPieces(self):
+        f = self.open('abcdefghij\nk\n')
+        self.assertEquals(f.read_lines(0, 10),
+                          ([0, 4, 8, 11], ['abcd', 'efgh', 'ij', 'k'], 13))
+
+    def testBackwardsCoversEverything(self):
+        f = self.open('abcdefghij\nk\n')
+        offset = 13
+        pieces = []
+
+        while offset > 0:
+            previous = f.prev_line(offset)
+            self.assertTrue(offset - previous <= 4)
+            pieces.append(f.data[previous:offset])
+            offset = previous
+
+        pieces.reverse()
+        self.assertEquals(''.join(pieces), 'abcdefghij\nk\n')
+
+    def testLineStartInsideLongLine(self):
+        f = self.open('abcdefghij\n')
+        self.assertEquals(f.line_start(3), 0)
+        self.assertEquals(f.line_start(9), 9)
+
+
+class TestHexRows(PagedFileTestCase):
+    def setUp(self):
+        PagedFileTestCase.setUp(self)
+        self.rows = paged_file.HexRows(self.open(''.join(map(chr,
+                                                             range(40)))))
+
+    def testFormatRow(self):
+        self.assertEquals(paged_file.format_row(16, 'Hi!\x00'),
+                          '00000010  48 69 21 00' + ' ' * 39 + '|Hi!.|')
+        row = paged_file.format_row(0, 'a' * 16)
+        self.assertEquals(row, '00000000  ' + '61 ' * 7 + '61  '
+                          + '61 ' * 7 + '61  |' + 'a' * 16 + '|')
+
+    def testRows(self):
+        offsets, rows, end = self.rows.read_lines(0, 10)
+        self.assertEquals(offsets, [0, 16, 32])
+        self.assertEquals(end, 40)
+        self.assertTrue(rows[2].startswith('00000020  20 21 22 23'))
+
+    def testReadFromInsideRow(self):
+        offsets, rows, end = self.rows.read_lines(20, 1)
+        self.assertEquals((offsets, end), ([16], 32))
+
+    def testNavigation(self):
+        self.assertEquals(self.rows.line_start(17), 16)
+        self.assertEquals(self.rows.next_line(32), 40)
+        self.assertEquals(self.rows.prev_line(16), 0)
+        self.assertEquals(self.rows.lines_before(39, 1), 16)
+        self.assertEquals(self.rows.last_lines(1), 32)
+        self.assertEquals(self.rows.last_lines(2), 16)
+        self.assertEquals(self.rows.last_lines(10), 0)
+
+
+class TestParseOffset(unittest.TestCase):
+    def testForms(self):
+        self.assertEquals(paged_file.parse_offset(' 100 ', 1000), 100)
+        self.assertEquals(paged_file.parse_offset('0x1F', 1000), 31)
+        self.assertEquals(paged_file.parse_offset('50%', 1000), 500)
+
+    def testBad(self):
+        self.assertRaises(ValueError, paged_file.parse_offset, 'x', 1000)
+        self.assertRaises(ValueError, paged_file.parse_offset, '1001', 1000)
+        self.assertRaises(ValueError, paged_file.parse_offset, '-1', 1000)
+
+
+class TestRefresh(PagedFileTestCase):
+    def write(self, mode, contents):
+        f = open(self.files[0].path, mode)
+        f.write(contents)
+        f.close()
+
+    def testUnchanged(self):
+        f = self.open('one\n')
+        self.assertEquals(f.refresh(), None)
+
+        # Could still get truncated any time
+        self.assert_(f.needs_refresh())
+
+    def testGrew(self):
+        f = self.open('one\ntw')
+        self.write('ab', 'o\nthree\n')
+        self.assertEquals(f.refresh(), paged_file.GREW)
+        self.assertEquals(f.size, 14)
+        self.assertEquals(f.read_lines(4, 10),
+                          ([4, 8], ['two', 'three'], 14))
+
+    def testGrewFromEmpty(self):
+        f = self.open('')
+        self.write('ab', 'one\n')
+        self.assertEquals(f.refresh(), paged_file.GREW)
+        self.assertEquals(f.read_lines(0, 10), ([0], ['one'], 4))
+
+    def testTruncated(self):
+        f = self.open('one\ntwo\n')
+        self.write('wb', 'x\n')
+        self.assertEquals(f.refresh(), paged_file.TRUNCATED)
+        self.assertEquals(f.read_lines(0, 10), ([0], ['x'], 2))
+
+        self.write('wb', '')
+        self.assertEquals(f.refresh(), paged_file.TRUNCATED)
+        self.assertEquals(f.size, 0)
+
+    def testRotated(self):
+        f = self.open('old\n')
+        os.rename(f.path, f.path + '.1')
+
+        # Not there again yet
+        self.assertEquals(f.refresh(), None)
+
+        self.write('wb', 'new log\n')
+        self.assertEquals(f.refresh(), paged_file.REPLACED)
+        self.assertEquals(f.read_lines(0, 10), ([0], ['new log'], 8))
+        self.assertEquals(f.refresh(), None)
+
+    def testFollowedFileIsRead(self):
+        f = self.open('one\ntwo\n')
+        f.set_following(True)
+        self.assertEquals(f.data[4:8], 'two\n')
+        self.write('ab', 'three\n')
+        self.assertEquals(f.refresh(), paged_file.GREW)
+        self.assertEquals(f.read_lines(4, 10),
+                          ([4, 8], ['two', 'three'], 14))
+
+        f.set_following(False)
+        self.assertEquals(f.read_lines(8, 10), ([8], ['three'], 14))
+
+    def testFollowedFileSurvivesTruncation(self):
+        f = self.open('one\ntwo\nthree\n')
+        f.set_following(True)
+        self.write('wb', 'x\n')
+
+        # Not refreshed yet: reading past the new end just comes out short
+        self.assertEquals(f.read_lines(0, 10), ([0, 2], ['x', ''], 14))
+        self.assertEquals(f.data.find('three'), -1)
+
+        self.assertEquals(f.refresh(), paged_file.TRUNCATED)
+        self.assertEquals(f.read_lines(0, 10), ([0], ['x'], 2))
+
+    def testFollowedFileRotated(self):
+        f = self.open('old\n')
+        f.set_following(True)
+        old_data = f.data
+        os.rename(f.path, f.path + '.1')
+        self.write('wb', 'new log\n')
+        self.assertEquals(f.refresh(), paged_file.REPLACED)
+        self.assertEquals(f.read_lines(0, 10), ([0], ['new log'], 8))
+
+        # Still readable by whoever took it before the rotation
+        self.assertEquals(old_data[0:4], 'old\n')
+
+    def testHexRowsFollow(self):
+        f = self.open('a' * 16)
+        rows = paged_file.HexRows(f)
+        self.write('ab', 'b')
+        f.refresh()
+        self.assertEquals(rows.size, 17)
+        self.assertEquals(rows.read_lines(16, 10)[0], [16])
+
+
+def suite():
+    lines_suite = unittest.makeSuite(TestLines)
+    long_lines_suite = unittest.makeSuite(TestLongLines)
+    hex_suite = unittest.makeSuite(TestHexRows)
+    parse_suite = unittest.makeSuite(TestParseOffset)
+    refresh_suite = unittest.makeSuite(TestRefresh)
+    return unittest.TestSuite([lines_suite, long_lines_suite, hex_suite,
+                               parse_suite, refresh_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+import os
+import sys
+import shutil
+import logging
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import trash
+
+
+class TestMoveToTrash(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.trash_dir = os.path.join(self.root, 'Trash')
+        self.path = os.path.join(self.root, 'doomed')
+        open(self.path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testMove(self):
+        trashed = trash.move_to_trash(self.path, self.trash_dir)
+        self.assertEquals(trashed, os.path.join(self.trash_dir, 'files',
+                                                'doomed'))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(trashed))
+
+        info = open(os.path.join(self.trash_dir, 'info', 'doomed.trashinfo'))
+        lines = info.read().splitlines()
+        info.close()
+        self.assertEquals(lines[0], '[Trash Info]')
+        self.assertEquals(lines[1], 'Path=' + self.path)
+        self.assertTrue(lines[2].startswith('DeletionDate='))
+
+    def testNamesDontCollide(self):
+        first = trash.move_to_trash(self.path, self.trash_dir)
+        open(self.path, 'w').close()
+        second = trash.move_to_trash(self.path, self.trash_dir)
+        self.assertEquals(os.path.basename(second), 'doomed.2')
+        self.assertTrue(os.path.exists(first))
+
+    def testRestore(self):
+        trashed = trash.move_to_trash(self.path, self.trash_dir)
+        trash.restore_from_trash(trashed, self.path)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEquals(os.listdir(os.path.join(self.trash_dir, 'info')),
+                          [])
+
+    def testRestoreDoesNotOverwrite(self):
+        trashed = trash.move_to_trash(self.path, self.trash_dir)
+        open(self.path, 'w').close()
+        self.assertRaises(OSError, trash.restore_from_trash, trashed,
+                          self.path)
+        self.assertTrue(os.path.exists(trashed))
+
+    def testHomeTrashOnSameFilesystem(self):
+        saved = os.environ.get('XDG_DATA_HOME')
+        os.environ['XDG_DATA_HOME'] = self.root
+
+        try:
+            self.assertEquals(trash.trash_dir_for(self.path), self.trash_dir)
+        finally:
+            if saved is None:
+                del os.environ['XDG_DATA_HOME']
+            else:
+                os.environ['XDG_DATA_HOME'] = saved
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.journal = trash.Journal(os.path.join(self.root, 'sub',
+                                                  'journal'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testEmpty(self):
+        self.assertEquals(self.journal.last_batch(), None)
+        self.assertEquals(self.journal.new_batch(), 1)
+
+    def testLastBatch(self):
+        self.journal.record(1, '/a', '/t/a')
+        batch = self.journal.new_batch()
+        self.assertEquals(batch, 2)
+        self.journal.record(batch, u'/b c\t\u0161', u'/t/b c\t\u0161')
+        self.journal.record(batch, '/d', '/t/d')
+        self.assertEquals(self.journal.last_batch(),
+                          (2, [(u'/b c\t\u0161', u'/t/b c\t\u0161'),
+                               ('/d', '/t/d')]))
+
+    def testForget(self):
+        self.journal.record(1, '/a', '/t/a')
+        self.journal.record(2, '/b', '/t/b')
+        self.journal.record(2, '/c', '/t/c')
+        self.journal.forget(2, [('/b', '/t/b')])
+        self.assertEquals(self.journal.last_batch(), (2, [('/c', '/t/c')]))
+        self.journal.forget(2, [('/c', '/t/c')])
+        self.assertEquals(self.journal.last_batch(), (1, [('/a', '/t/a')]))
+
+    def testCutShortLineIsSkipped(self):
+        self.journal.record(1, '/a', '/t/a')
+        f = open(self.journal.path, 'ab')
+        f.write('2\tb\t/b')
+        f.close()
+        self.assertEquals(self.journal.last_batch(), (1, [('/a', '/t/a')]))
+
+    def testOpenMakesTheDirectory(self):
+        journal = trash.open_journal(self.journal.path)
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'sub')))
+        self.assertEquals(journal.new_batch(), 1)
+
+    def testUnusableJournalIsDoneWithout(self):
+        open(os.path.join(self.root, 'file'), 'w').close()
+        logging.disable(logging.ERROR)
+
+        try:
+            # Neither under a file, nor in place of a directory
+            path = os.path.join(self.root, 'file', 'journal')
+            self.assertEquals(trash.open_journal(path), None)
+            self.assertEquals(trash.open_journal(self.root), None)
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+def suite():
+    move_suite = unittest.makeSuite(TestMoveToTrash)
+    journal_suite = unittest.makeSuite(TestJournal)
+    return unittest.TestSuite([move_suite, journal_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import logging
+import sqlite3
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import data
+import tree_index
+
+
+class TestTreeIndex(unittest.TestCase):
+    def setUp(self):
+        self.root = unicode(tempfile.mkdtemp())
+
+        for path in ['a/b', 'c']:
+            os.makedirs(os.path.join(self.root, path))
+
+        for path in ['f', 'a/f', 'a/b/f', 'c/f']:
+            open(os.path.join(self.root, path), 'w').close()
+
+        for path in ['', 'a', 'a/b', 'c']:
+            self.age_dir(path)
+
+        self.index_dir = tempfile.mkdtemp()
+        index_file = os.path.join(self.index_dir, 'index.db')
+        self.index = tree_index.TreeIndex(index_file)
+        self.settings = data.WalkSettings()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.index_dir)
+
+    def age_dir(self, path):
+        # The index doesn't keep directories modified just now
+        an_hour_ago = time.time() - 3600
+        os.utime(os.path.join(self.root, path), (an_hour_ago, an_hour_ago))
+
+    def walk(self):
+        paths = [os.path.join(e[1], e[0])[len(self.root) + 1:]
+                 for e in self.index.walk(self.root, self.settings)]
+        paths.sort()
+        return paths
+
+    def testCovers(self):
+        self.assertFalse(self.index.covers(self.root))
+        self.index.update(self.root, self.settings)
+        self.assertTrue(self.index.covers(self.root))
+
+    def testUnchangedTreeIsNotRead(self):
+        self.assertEquals(self.index.update(self.root, self.settings), 4)
+        self.assertEquals(self.index.update(self.root, self.settings), 0)
+        self.assertEquals(self.walk(), ['a/b/f', 'a/f', 'c/f', 'f'])
+
+    def testOnlyChangedDirIsRead(self):
+        self.index.update(self.root, self.settings)
+        open(os.path.join(self.root, 'a', 'g'), 'w').close()
+        self.age_dir('a')
+        self.assertEquals(self.index.update(self.root, self.settings), 1)
+        self.assertEquals(self.walk(), ['a/b/f', 'a/f', 'a/g', 'c/f', 'f'])
+
+    def testRemovedDirIsForgotten(self):
+        self.index.update(self.root, self.settings)
+        shutil.rmtree(os.path.join(self.root, 'a'))
+        self.age_dir('')
+        self.assertEquals(self.walk(), ['c/f', 'f'])
+        self.assertFalse(self.index.covers(os.path.join(self.root, 'a', 'b')))
+
+    def testLockedIndexIsWalkedAround(self):
+        self.index.update(self.root, self.settings)
+        file_name = self.index.file_name
+        self.index.connect = lambda: sqlite3.connect(file_name, timeout=0.1)
+
+        # Another writer that doesn't let go
+        writer = sqlite3.connect(file_name)
+        writer.execute('BEGIN EXCLUSIVE')
+
+        try:
+            open(os.path.join(self.root, 'a', 'g'), 'w').close()
+            self.age_dir('a')
+            walker = self.index.walk(self.root, self.settings)
+            paths = [os.path.join(e[1], e[0])[len(self.root) + 1:]
+                     for e in walker]
+            paths.sort()
+            self.assertEquals(paths, ['a/b/f', 'a/f', 'a/g', 'c/f', 'f'])
+            self.assertNotEquals(walker.error, None)
+
+            self.assertRaises(tree_index.TreeIndexError, self.index.update,
+                              self.root, self.settings)
+            self.assertFalse(self.index.covers(self.root))
+        finally:
+            writer.rollback()
+            writer.close()
+
+        self.assertEquals(self.index.update(self.root, self.settings), 1)
+
+    def testUnusableIndexIsDoneWithout(self):
+        not_a_db = os.path.join(self.index_dir, 'not-a-db')
+        f = open(not_a_db, 'wb')
+        f.write('x' * 4096)
+        f.close()
+        logging.disable(logging.ERROR)
+
+        try:
+            self.assertEquals(tree_index.open_index(not_a_db), None)
+            self.assertEquals(tree_index.open_index(os.path.join(not_a_db,
+                                                                 'index.db')),
+                              None)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        index = tree_index.open_index(os.path.join(self.index_dir, 'new.db'))
+        self.assertFalse(index.covers(self.root))
+
+
+def suite():
+    return unittest.makeSuite(TestTreeIndex)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
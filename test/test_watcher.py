@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+#   Copyright (C) 2009 Vytautas Saltenis.
+#
+# This file is part of Candy.
+#
+# Candy is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Candy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Candy. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import unittest
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.append(os.path.abspath('../src'))
+
+import watcher
+
+
+class TestChangeSet(unittest.TestCase):
+    def testCreatedThenDeletedIsDeleted(self):
+        changes = watcher.ChangeSet()
+        changes.add_created('a')
+        changes.add_deleted('a')
+        self.assertEquals(changes.created.keys(), [])
+        self.assertEquals(changes.deleted.keys(), ['a'])
+
+    def testEmpty(self):
+        changes = watcher.ChangeSet()
+        self.assertTrue(changes.is_empty())
+        changes.needs_rescan = True
+        self.assertFalse(changes.is_empty())
+
+
+class TestDirectoryWatcher(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        open(os.path.join(self.root, 'old'), 'w').close()
+        self.reports = []
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def on_changes(self, dir_watcher, created, deleted):
+        created.sort()
+        deleted.sort()
+        self.reports.append((created, deleted))
+
+    def _check_burst_is_coalesced(self, dir_watcher):
+        dir_watcher.start()
+        time.sleep(0.3)
+
+        try:
+            open(os.path.join(self.root, 'new'), 'w').close()
+            os.rename(os.path.join(self.root, 'old'),
+                      os.path.join(self.root, 'renamed'))
+            time.sleep(1.0)
+        finally:
+            dir_watcher.stop()
+
+        self.assertEquals(self.reports, [(['new', 'renamed'], ['old'])])
+
+    def testInotify(self):
+        if not watcher.inotify_available():
+            return
+
+        dir_watcher = watcher.DirectoryWatcher(self.root, self.on_changes)
+        self._check_burst_is_coalesced(dir_watcher)
+
+    def testPolling(self):
+        dir_watcher = watcher.DirectoryWatcher(self.root, self.on_changes,
+                                               poll_interval=0.5)
+        dir_watcher._watch = lambda fd: dir_watcher._poll()
+        self._check_burst_is_coalesced(dir_watcher)
+
+
+def suite():
+    change_set_suite = unittest.makeSuite(TestChangeSet)
+    watcher_suite = unittest.makeSuite(TestDirectoryWatcher)
+    return unittest.TestSuite([change_set_suite, watcher_suite])
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')